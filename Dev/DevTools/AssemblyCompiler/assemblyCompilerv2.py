@@ -1,5 +1,12 @@
+import contextlib
+import json
+import os
+import re
 import sys 
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "InstructionSetGenerator"))
+import generate_cpu_microcode
+
 CHARACTER_SET = {
     "\n":"000a", # 0001010
     
@@ -78,33 +85,37 @@ INSTRUCTION_SET = {
     "halt":"0001",        # halt program
     "lda":["0002", "0003"], # load into A-Register
     "sta":"0004",         # store A-Register
-    "ldb":["0005", "0006"], # load into B-Register
-    "stb":"0007",         # store B-Register
-    "add":["0008", "0009"], # add to A-Register
-    "sub":["000a", "000b"], # sub from A-Register
-    "outa":"000c",        # display A-Register
-    "outb":"000d",        # display B-Register
-    "out":["000e", "000f"], # display value
-    "jp":"0010",          # jump to label
-    "jpz":"0011",         # jump to label on zero
-    "jpc":"0012",         # jump to label on carry
-    "rts":"0013",         # return to subroutine
-    "lb":"0014",          # loop-back to label (does not change RTS)
-    "lbz":"0015",         # loop-back to label on zero
-    "lbc":"0016",         # loop-back to label on carry
-    "rtc":"0017",         # return to subroutine on carry
-    "rtz":"0018",         # return to subroutine on zero
-    "lpc":["0019", "001a"], # load value into Program-Counter
-    "spc":"001b",         # store value of Program-Counter
+    # "ldb":["0005", "0006"], # load into B-Register
+    # "stb":"0007",         # store B-Register
+    "add":["0005", "0006"], # add to A-Register
+    "sub":["0007", "0008"], # sub from A-Register
+    "out":["0009", "000a"], # display value
+    "jp":"000b",          # jump to label
+    "jpz":"000c",         # jump to label on zero
+    "jpc":"000d",         # jump to label on carry
+    "rts":"000e",         # return to subroutine
+    "lb":"000f",          # loop-back to label (does not change RTS)
+    "lbz":"0010",         # loop-back to label on zero
+    "lbc":"0011",         # loop-back to label on carry
+    "rtc":"0012",         # return to subroutine on carry
+    "rtz":"0013",         # return to subroutine on zero
+    "lpc":["0014", "0015"], # load value into Program-Counter
+    "spc":"0016",         # store value of Program-Counter
     
-    "dc":"001c",          # clears the contents of the graphic display
-    "tc":"001d",          # clears the contents of the terminal
+    "dc":"0017",          # clears the contents of the graphic display
+    "tc":"0018",          # clears the contents of the terminal
     
-    "tw":"001e",          # sets pixel to value
-    "dr":"001f",          # resets pixel
-    "dw":"0020",          # writes character to terminal
+    "tw":"0019",          # writes character to terminal
+    "dw":["001a", "001b"],# sets pixel to value
+
+    "co":"001c",          # first 4-bit of A-Register
+    "ct":"001d",          # last 4-bit of A-Register
 }
 
+# instructions of the older encoding the microcode does not implement, the
+# opcodes after them moved down; rejected instead of being assembled as labels
+REMOVED_INSTRUCTIONS = ["ldb", "stb", "outa", "outb", "dr"]
+
 MEMORY = {}
 for i in range(0xffff):
     MEMORY[i] = "0000"
@@ -131,6 +142,14 @@ SYSTEM_POINTER = 0xf001 # pointing towards the current location in System memory
 JUMP_LABELS = {}
 JUMP_LABELS_AWAIT = {}
 
+# clears what the last assembly left behind: its labels and the data and
+# strings it wrote to MEMORY
+def resetState():
+    JUMP_LABELS.clear()
+    JUMP_LABELS_AWAIT.clear()
+    for address in MEMORY:
+        MEMORY[address] = "0000"
+
 #
 #   TRANSLATING
 #
@@ -158,6 +177,390 @@ def tokenizer(inputString):
 
     return tokens
 
+#
+#   MACROS
+#
+#   .macro name %param ...      defines a macro, the parameters start with '%'
+#   .endm
+#   .rept count                 repeats the tokens up to .endr count times
+#   .endr
+#
+#   A macro call takes as many tokens as the macro has parameters. Inside a
+#   body '\@' is replaced by a number unique to every expansion, so labels
+#   like ':loop\@' do not clash between expansions.
+#
+
+MACROS = {}         # name: [parameters, body tokens]
+MACRO_CACHE = {}    # (name, arguments): expanded tokens of bodies without local labels
+MACRO_DEPTH = 64    # deepest nesting of macro calls and .rept blocks
+MACRO_EXPANSIONS = [0]
+
+class AssemblerError(Exception):
+    pass
+
+# collects the tokens up to the directive closing the block, returns [body, position after it]
+def collectBlock(tokens, curPos, end):
+    body = []
+    depth = 0
+
+    while (curPos < len(tokens)):
+        curTok = tokens[curPos]
+
+        if (curTok == ".macro" or curTok == ".rept"):
+            depth += 1
+        elif (curTok == ".endm" or curTok == ".endr"):
+            if (depth == 0):
+                if (curTok != end):
+                    raise AssemblerError("'{}' found where '{}' was expected".format(curTok, end))
+                return [body, curPos+1]
+            depth -= 1
+
+        body.append(curTok)
+        curPos += 1
+
+    raise AssemblerError("missing '{}'".format(end))
+
+# reads the count of a .rept block or a size: 4, #4 or 0x4
+def getCount(token):
+    try:
+        if (token[0:2] == "0x"):
+            return int(token[2:], 16)
+        if (token[0] == "#"):
+            return int(token[1:])
+        return int(token)
+    except (TypeError, ValueError, IndexError):
+        raise AssemblerError("invalid count '{}'".format(token)) from None
+
+# replaces the parameters inside a token by the arguments of the call
+def substitute(token, parameters, arguments):
+    if (type(token) != str or "%" not in token):
+        return token
+    for parameter, index in parameters:
+        token = token.replace(parameter, arguments[index])
+    return token
+
+# gives the local labels ('\@') of one expansion their unique number
+def numberLabels(tokens):
+    MACRO_EXPANSIONS[0] += 1
+    number = "." + str(MACRO_EXPANSIONS[0])
+    return [token.replace("\\@", number) if type(token) == str else token for token in tokens]
+
+def hasLocalLabels(tokens):
+    for token in tokens:
+        if (type(token) == str and "\\@" in token):
+            return True
+    return False
+
+# instruction names are turned into opcodes by the tokenizer, so they can not name a macro
+def defineMacro(name, parameters, body):
+    if (type(name) != str or not (name[0].isalpha() or name[0] == "_")):
+        raise AssemblerError("invalid macro name '{}'".format(name))
+
+    # (parameter, argument index) sorted longest first, so '%ab' is not replaced as '%a'
+    parameters = sorted(((parameter, i) for i, parameter in enumerate(parameters)), key = lambda item: -len(item[0]))
+    MACROS[name] = [parameters, body]
+    for key in [key for key in MACRO_CACHE if key[0] == name]:
+        del MACRO_CACHE[key]
+
+# expands a macro call, returns [tokens, whether they hold numbered local labels]
+def expandMacro(name, arguments, depth):
+    cached = MACRO_CACHE.get((name, arguments))
+    if (cached != None):
+        return [cached, False]
+
+    parameters, body = MACROS[name]
+    expanded, local = expandTokens([substitute(token, parameters, arguments) for token in body], depth+1)
+    if (hasLocalLabels(expanded)):
+        return [numberLabels(expanded), True]
+    if (not local):
+        MACRO_CACHE[(name, arguments)] = expanded
+    return [expanded, local]
+
+# expands a .rept block
+def expandRept(body, count, depth):
+    expanded, local = expandTokens(body, depth+1)
+    if (hasLocalLabels(expanded)):
+        result = []
+        for _i in range(count):
+            result.extend(numberLabels(expanded))
+        return [result, True]
+    if (local):
+        # labels of nested blocks need their own numbers in every repetition
+        result = []
+        for _i in range(count):
+            result.extend(expandTokens(body, depth+1)[0])
+        return [result, True]
+    return [expanded * count, False]
+
+# expands the macro definitions, calls and .rept blocks of the token stream,
+# returns [tokens, whether they hold numbered local labels]
+def expandTokens(tokens, depth = 0):
+    if (depth > MACRO_DEPTH):
+        raise AssemblerError("macros nested deeper than {} levels, is a macro calling itself?".format(MACRO_DEPTH))
+
+    result = []
+    local = False
+    curPos = 0
+
+    while (curPos < len(tokens)):
+        curTok = tokens[curPos]
+
+        if (type(curTok) != str):
+            result.append(curTok)
+            curPos += 1
+
+        elif (curTok == ".macro"):
+            if (curPos+1 >= len(tokens)):
+                raise AssemblerError("'.macro' without a name")
+            name = tokens[curPos+1]
+            parameters = []
+            curPos += 2
+            while (curPos < len(tokens) and type(tokens[curPos]) == str and tokens[curPos][0] == "%"):
+                parameters.append(tokens[curPos])
+                curPos += 1
+            body, curPos = collectBlock(tokens, curPos, ".endm")
+            defineMacro(name, parameters, body)
+
+        elif (curTok == ".rept"):
+            if (curPos+1 >= len(tokens)):
+                raise AssemblerError("'.rept' without a count")
+            count = getCount(tokens[curPos+1])
+            body, curPos = collectBlock(tokens, curPos+2, ".endr")
+            expanded, bodyLocal = expandRept(body, count, depth)
+            result.extend(expanded)
+            local = local or bodyLocal
+
+        elif (curTok == ".endm" or curTok == ".endr"):
+            raise AssemblerError("'{}' without an open block".format(curTok))
+
+        elif (curTok in MACROS):
+            count = len(MACROS[curTok][0])
+            arguments = tuple(tokens[curPos+1:curPos+1+count])
+            if (len(arguments) < count or not all(type(argument) == str for argument in arguments)):
+                raise AssemblerError("macro '{}' takes {} arguments".format(curTok, count))
+            expanded, bodyLocal = expandMacro(curTok, arguments, depth)
+            result.extend(expanded)
+            local = local or bodyLocal
+            curPos += 1+count
+
+        else:
+            result.append(curTok)
+            curPos += 1
+
+    return [result, local]
+
+# expands all macros and .rept blocks of the tokens, macros of an earlier
+# program are forgotten
+def expandMacros(tokens):
+    MACROS.clear()
+    MACRO_CACHE.clear()
+    MACRO_EXPANSIONS[0] = 0
+    return expandTokens(tokens)[0]
+
+#
+#   SUPERINSTRUCTIONS
+#
+#   superinstructions.py gives frequent instruction pairs a fused opcode and
+#   writes them to InstructionSetGenerator/superinstructions.json. Matching
+#   pairs are rewritten into the fused opcode followed by the operands of
+#   both instructions, unless a label points at the second instruction.
+#
+
+SUPERINSTRUCTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "InstructionSetGenerator", "superinstructions.json")
+
+OPCODE_TOKENS = set(value for value in INSTRUCTION_SET.values() if type(value) == str)
+
+# reads the file written by superinstructions.py, returns [operand count by opcode, fused opcode by pair]
+def loadSuperinstructions(file_name = SUPERINSTRUCTIONS_FILE):
+    if (not os.path.exists(file_name)):
+        return [{}, {}]
+    file = open(file_name, "r")
+    content = json.load(file)
+    file.close()
+
+    operands = {int(opCode): count for opCode, count in content["operands"].items()}
+    fused = {(instruction["first"], instruction["second"]): instruction["op_code"] for instruction in content["fused"]}
+    return [operands, fused]
+
+# returns [opcode, operand count, whether the first operand is an address in brackets]
+# of the instruction token at curPos, None if it is no instruction
+def instructionAt(tokens, curPos, operands):
+    if (curPos >= len(tokens)):
+        return None
+    curTok = tokens[curPos]
+    nextTok = tokens[curPos+1] if curPos+1 < len(tokens) else None
+    bracket = False
+
+    if (type(curTok) == list):
+        bracket = type(nextTok) == str and nextTok[0] == "["
+        opCode = int(curTok[1] if bracket else curTok[0], 16)
+    elif (curTok in OPCODE_TOKENS):
+        opCode = int(curTok, 16)
+    else:
+        return None
+
+    if (opCode not in operands):
+        return None
+    return [opCode, operands[opCode], bracket]
+
+# the operand tokens of an instruction, brackets are removed like grammar2 does
+def operandTokens(tokens, curPos, instruction):
+    result = tokens[curPos+1:curPos+1+instruction[1]]
+    if (instruction[2]):
+        result[0] = result[0][1:len(result[0])-1]
+    return result
+
+# rewrites adjacent instruction pairs into their fused opcodes
+def fuseInstructions(tokens, superinstructions):
+    operands, fused = superinstructions
+    if (len(fused) == 0):
+        return tokens
+
+    result = []
+    curPos = 0
+    while (curPos < len(tokens)):
+        first = instructionAt(tokens, curPos, operands)
+        if (first == None):
+            result.append(tokens[curPos])
+            curPos += 1
+            continue
+
+        nextPos = curPos+1+first[1]
+        second = instructionAt(tokens, nextPos, operands)
+        opCode = fused.get((first[0], second[0])) if second != None else None
+        if (opCode == None):
+            result.extend(tokens[curPos:nextPos])
+            curPos = nextPos
+            continue
+
+        result.append(format(opCode, "04x"))
+        result.extend(operandTokens(tokens, curPos, first))
+        result.extend(operandTokens(tokens, nextPos, second))
+        curPos = nextPos+1+second[1]
+
+    return result
+
+#
+#   JUMP SELECTION
+#
+#   jp/jpz/jpc save the PC into the C-register before jumping, which costs
+#   one step more than lb/lbz/lbc. The saved value is only used by a
+#   rts/rtz/rtc (or spc) reached before the next jump or lpc overwrites it.
+#   Following the label references from every instruction tells for each
+#   jump whether such a return can be reached from its target; if none can,
+#   the jump becomes its loop-back form. Jumps to addresses instead of labels,
+#   and code running into raw words or the end of the program, keep the jump.
+#   The saving is the step difference of the two forms in the microcode.
+#
+
+JUMP_FORMS = {"000b": "000f", "000c": "0010", "000d": "0011"}   # jp, jpz, jpc -> lb, lbz, lbc
+
+# steps of the longest microcode variant of an opcode (the one taking the jump)
+def microcodeSteps(opCode):
+    return max(len(generate_cpu_microcode.cast_array(instruction['flags'])) for instruction in
+        generate_cpu_microcode.instruction_set if instruction['op_code'] == int(opCode, 16))
+
+JUMP_SAVED_CYCLES = {jump: microcodeSteps(jump)-microcodeSteps(form) for jump, form in JUMP_FORMS.items()}
+RETURNS = {"000e", "0012", "0013", "0016"}                      # rts, rtc, rtz, spc read the C-register
+CONDITIONAL = {"000c", "000d", "0010", "0011"}                  # jpz, jpc, lbz, lbc
+NO_OPERANDS = {"nop", "halt", "rts", "rtc", "rtz", "dc", "tc", "co", "ct"}
+MNEMONICS = {}
+for mnemonic, value in INSTRUCTION_SET.items():
+    for opCode in (value if type(value) == list else [value]):
+        MNEMONICS[opCode] = mnemonic
+
+JUMP_SELECTIONS = []    # [mnemonic, target, replacement] of the last assemble()
+
+# cycles the replaced jumps save when each of them is taken once
+def jumpSaving(selections):
+    return sum(JUMP_SAVED_CYCLES[INSTRUCTION_SET[mnemonic]] for mnemonic, _target, _replacement in selections)
+
+# splits the tokens into instructions: [[token position, opcode or None, operand], ...]
+# and returns them with the instruction every label points at
+def instructionList(tokens):
+    instructions = []
+    labels = {}
+    curPos = 0
+    while (curPos < len(tokens)):
+        curTok = tokens[curPos]
+        if (type(curTok) == str and curTok[0:1] == ":"):
+            labels[curTok[1:len(curTok)]] = len(instructions)
+            curPos += 1
+            continue
+
+        opCode = curTok
+        if (type(curTok) == list):
+            nextTok = tokens[curPos+1] if curPos+1 < len(tokens) else ""
+            opCode = curTok[1] if type(nextTok) == str and nextTok[0:1] == "[" else curTok[0]
+        if (opCode not in MNEMONICS):
+            instructions.append([curPos, None, None])
+            curPos += 1
+            continue
+
+        operands = 0 if MNEMONICS[opCode] in NO_OPERANDS else 1
+        operand = tokens[curPos+1] if operands and curPos+1 < len(tokens) else None
+        instructions.append([curPos, opCode, operand])
+        curPos += 1+operands
+    return [instructions, labels]
+
+# whether the C-register is read before it is written again, for every instruction
+def returnReachable(instructions, labels):
+    count = len(instructions)
+    live = [False] * (count+1)
+    live[count] = True     # running past the program
+
+    changed = True
+    while (changed):
+        changed = False
+        for index in range(count-1, -1, -1):
+            _curPos, opCode, operand = instructions[index]
+            target = labels.get(operand) if type(operand) == str else None
+
+            if (opCode == None or opCode in RETURNS):
+                value = True
+            elif (MNEMONICS[opCode] in ("halt", "jp", "lpc")):
+                value = False
+            elif (MNEMONICS[opCode] in ("jpz", "jpc")):
+                value = live[index+1]
+            elif (MNEMONICS[opCode] in ("lb", "lbz", "lbc")):
+                value = live[target] if target != None else True
+                if (opCode in CONDITIONAL):
+                    value = value or live[index+1]
+            else:
+                value = live[index+1]
+
+            if (value and not live[index]):
+                live[index] = True
+                changed = True
+    return live
+
+# replaces the jumps whose saved return address is never used by their loop-back
+# form, unless the jump would lose a superinstruction; returns [tokens, selections]
+def selectJumps(tokens, superinstructions):
+    _operands, fused = superinstructions
+    instructions, labels = instructionList(tokens)
+    live = returnReachable(instructions, labels)
+    labelled = set(labels.values())
+
+    result = list(tokens)
+    selections = []
+    for index, (curPos, opCode, operand) in enumerate(instructions):
+        if (opCode not in JUMP_FORMS or type(operand) != str or operand not in labels):
+            continue
+        if (live[labels[operand]]):
+            continue
+
+        replacement = JUMP_FORMS[opCode]
+        previous = instructions[index-1][1] if index > 0 else None
+        if (previous != None and index not in labelled):
+            first = int(previous, 16)
+            if ((first, int(opCode, 16)) in fused and (first, int(replacement, 16)) not in fused):
+                continue
+
+        result[curPos] = replacement
+        selections.append([MNEMONICS[opCode], operand, MNEMONICS[replacement]])
+    return [result, selections]
+
 # translate any string into ascii-bytes for Logisim
 def getTextFrom(token, buffer_pointer):
     result= {}
@@ -187,9 +590,347 @@ def getTextFrom(token, buffer_pointer):
             
         curPos += 1
 
-    print(result)
     return [result, buffer_pointer]
 
+#
+#   MEMORY ALLOCATION
+#
+#   .var name [#size [#align]]      reserves words in VARIABLE_MEM (1 word by default)
+#   .buffer name #size [#align]     reserves words in BUFFER_MEM
+#   .system name #size [#align]     reserves words in SYSTEM_MEM
+#
+#   Sizes and alignments are written as #4 or 0x4, so they are not taken for
+#   the instruction after the directive. The operands name, [name] and
+#   name+offset are replaced by the address. Strings ($Hello\sWorld!$) are
+#   placed in BUFFER_MEM, equal strings share their words.
+#   All requests are placed at once, largest first, each into the free block
+#   it leaves the least room in (best fit), so the partitions stay dense.
+#
+#   Data is placed the same way, its words are written in one go:
+#   .word name #1 0x2 ...           the words in VARIABLE_MEM
+#   .fill name #count #value        count words of value in VARIABLE_MEM
+#   .incbin name file [#offset [#count]]   one word per byte of the file in BUFFER_MEM
+#   !import ./file                  a file named after itself in BUFFER_MEM:
+#                                   .txt  one word per character
+#                                   .dosm rows of 0 and 1, .pbm (P1 or P4)
+#                                         one display word (dw) per set pixel
+#                                   else  one word per byte
+#   Files are read relative to the source file.
+#
+
+ALLOCATION_DIRECTIVES = {".var": "VARIABLE_MEM", ".buffer": "BUFFER_MEM", ".system": "SYSTEM_MEM"}
+DATA_DIRECTIVES = {".word": "VARIABLE_MEM", ".fill": "VARIABLE_MEM", ".incbin": "BUFFER_MEM", "!import": "BUFFER_MEM"}
+
+HEX_BYTES = [format(value, "04x") for value in range(256)]
+# word of every byte of a text file, None for characters the CPU does not know
+TEXT_WORDS = [CHARACTER_SET.get(chr(value)) for value in range(256)]
+BIT_STRINGS = [format(value, "08b") for value in range(256)]
+PBM_HEADER = re.compile(rb"(P[14])(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+(\d+)\s")
+PIXEL_VALUE = 1
+DISPLAY_SIZE = 256
+
+# the bytes of a file
+def readData(file_name):
+    try:
+        with open(file_name, "rb") as file:
+            data = file.read()
+    except OSError as error:
+        raise AssemblerError("can not read '{}': {}".format(file_name, error.strerror)) from None
+    if (len(data) == 0):
+        raise AssemblerError("'{}' is empty".format(file_name))
+    return data
+
+def textWords(data, file_name):
+    words = list(map(TEXT_WORDS.__getitem__, data.replace(b"\r", b"")))
+    if (None in words):
+        position = words.index(None)
+        raise AssemblerError("'{}' holds a character without a code at byte {}".format(file_name, position))
+    return words
+
+# rows of "0"/"1" of a PBM image (P1 text or P4 packed bits)
+def pbmRows(data, file_name):
+    header = PBM_HEADER.match(data)
+    if (header == None):
+        raise AssemblerError("'{}' is no P1 or P4 PBM image".format(file_name))
+    width, height = int(header.group(2)), int(header.group(3))
+    body = data[header.end():len(data)]
+
+    if (header.group(1) == b"P4"):
+        stride = (width+7) // 8
+        if (len(body) < stride*height):
+            raise AssemblerError("'{}' holds less than {} rows".format(file_name, height))
+        return ["".join(map(BIT_STRINGS.__getitem__, body[row*stride:(row+1)*stride]))[0:width] for row in range(height)]
+
+    bits = body.translate(None, b" \t\r\n").decode("ascii", "replace")
+    if (len(bits) < width*height):
+        raise AssemblerError("'{}' holds less than {} pixels".format(file_name, width*height))
+    return [bits[row*width:(row+1)*width] for row in range(height)]
+
+# display words (see DisplayAdapter.md) of the set pixels, "1" or "#" is a pixel
+def pixelWords(rows, file_name):
+    if (len(rows) > DISPLAY_SIZE or max(len(row) for row in rows) > DISPLAY_SIZE):
+        raise AssemblerError("'{}' is larger than the {}x{} display".format(file_name, DISPLAY_SIZE, DISPLAY_SIZE))
+    words = []
+    for y in range(len(rows)):
+        row = rows[y].replace("#", "1")
+        x = row.find("1")
+        while (x >= 0):
+            words.append(format(PIXEL_VALUE << 16 | y << 8 | x, "04x"))
+            x = row.find("1", x+1)
+    return words
+
+# words of a file imported by !import
+def importWords(file_name):
+    data = readData(file_name)
+    extension = os.path.splitext(file_name)[1].lower()
+    if (extension == ".txt"):
+        return textWords(data, file_name)
+    if (extension == ".dosm"):
+        return pixelWords(data.decode("ascii", "replace").replace("\r", "").split("\n"), file_name)
+    if (extension == ".pbm"):
+        return pixelWords(pbmRows(data, file_name), file_name)
+    return list(map(HEX_BYTES.__getitem__, data))
+
+# the numbers following position curPos, returns [numbers, position after them]
+def getNumbers(tokens, curPos, limit = None):
+    numbers = []
+    while (curPos < len(tokens) and isNumber(tokens[curPos]) and (limit == None or len(numbers) < limit)):
+        numbers.append(getCount(tokens[curPos]))
+        curPos += 1
+    return [numbers, curPos]
+
+# a data word, numbers outside of 24 bits are rejected
+def checkWord(number, name):
+    if (number < 0 or number > 0xFFFFFF):
+        raise AssemblerError("{} of '{}' is outside of 0 - 0xffffff".format(number, name))
+    return number
+
+# reads a data directive at curPos, returns [name, words, position after it]
+def dataDirective(tokens, curPos, directory):
+    directive = tokens[curPos]
+    argument = tokens[curPos+1] if curPos+1 < len(tokens) else None
+    if (type(argument) != str):
+        raise AssemblerError("'{}' needs {}".format(directive, "a file" if directive == "!import" else "a name"))
+
+    if (directive == "!import"):
+        file_name = os.path.join(directory, argument)
+        name = os.path.splitext(os.path.basename(argument))[0]
+        return [name, importWords(file_name), curPos+2]
+
+    name = argument
+    if (not (name[0].isalpha() or name[0] == "_")):
+        raise AssemblerError("invalid name '{}' for '{}'".format(name, directive))
+
+    if (directive == ".word"):
+        numbers, curPos = getNumbers(tokens, curPos+2)
+        words = [format(checkWord(number, name), "04x") for number in numbers]
+    elif (directive == ".fill"):
+        numbers, curPos = getNumbers(tokens, curPos+2, 2)
+        if (len(numbers) != 2):
+            raise AssemblerError("'.fill {}' needs a count and a value".format(name))
+        if (numbers[0] < 0):
+            raise AssemblerError("'.fill {}' needs a count of at least 0".format(name))
+        words = [format(checkWord(numbers[1], name), "04x")] * numbers[0]
+    else:
+        if (curPos+2 >= len(tokens) or type(tokens[curPos+2]) != str):
+            raise AssemblerError("'.incbin {}' needs a file".format(name))
+        file_name = os.path.join(directory, tokens[curPos+2])
+        numbers, curPos = getNumbers(tokens, curPos+3, 2)
+        data = readData(file_name)
+        offset = numbers[0] if len(numbers) > 0 else 0
+        count = numbers[1] if len(numbers) > 1 else len(data)-offset
+        words = list(map(HEX_BYTES.__getitem__, data[offset:offset+count]))
+    return [name, words, curPos]
+
+# words of a partition, its end address is not part of it
+def partitionSize(partition):
+    return PARTITIONS[partition][1] - PARTITIONS[partition][0]
+
+def isNumber(token):
+    return type(token) == str and (token[0:1] == "#" or token[0:2] == "0x")
+
+def isString(token):
+    return type(token) == str and len(token) > 1 and token[0] == "$" and token[len(token)-1] == "$"
+
+# removes the allocation directives, returns [tokens, requests] with a
+# request being [name, partition, size, align, words of data or None]
+def collectAllocations(tokens, directory = "."):
+    result = []
+    requests = []
+    names = {}
+    curPos = 0
+
+    while (curPos < len(tokens)):
+        curTok = tokens[curPos]
+
+        if (type(curTok) == str and curTok in ALLOCATION_DIRECTIVES):
+            name = tokens[curPos+1] if curPos+1 < len(tokens) else None
+            if (type(name) != str or not (name[0].isalpha() or name[0] == "_")):
+                raise AssemblerError("'{}' needs a name, got '{}'".format(curTok, name))
+            if (name in names):
+                raise AssemblerError("'{}' is allocated twice".format(name))
+
+            arguments = []
+            curPos += 2
+            while (curPos < len(tokens) and len(arguments) < 2 and isNumber(tokens[curPos])):
+                arguments.append(getCount(tokens[curPos]))
+                curPos += 1
+            if (len(arguments) == 0 and curTok != ".var"):
+                raise AssemblerError("'{} {}' needs a size".format(curTok, name))
+
+            size = arguments[0] if len(arguments) > 0 else 1
+            align = arguments[1] if len(arguments) > 1 else 1
+            if (size < 1 or align < 1):
+                raise AssemblerError("'{}' needs a size and alignment of at least 1".format(name))
+            names[name] = True
+            requests.append([name, ALLOCATION_DIRECTIVES[curTok], size, align, None])
+            continue
+
+        if (type(curTok) == str and curTok in DATA_DIRECTIVES):
+            name, words, curPos = dataDirective(tokens, curPos, directory)
+            if (name in names):
+                raise AssemblerError("'{}' is allocated twice".format(name))
+            if (len(words) == 0):
+                raise AssemblerError("'{}' holds no words".format(name))
+            names[name] = True
+            requests.append([name, DATA_DIRECTIVES[curTok], len(words), 1, words])
+            continue
+
+        if (isString(curTok) and curTok not in names):
+            words = getTextFrom(curTok, 0)[0]
+            names[curTok] = True
+            requests.append([curTok, "BUFFER_MEM", len(words), 1, [words[key] for key in sorted(words)]])
+
+        result.append(curTok)
+        curPos += 1
+
+    return [result, requests]
+
+# places the requests, returns [{name: [partition, address, size]}, free blocks [start, end] by partition]
+def placeAllocations(requests):
+    free = {partition: [list(PARTITIONS[partition])] for partition in ALLOCATION_DIRECTIVES.values()}
+    placed = {}
+
+    for index in sorted(range(len(requests)), key = lambda i: (-requests[i][2], -requests[i][3], i)):
+        name, partition, size, align, _words = requests[index]
+        best = None
+        for block in free[partition]:
+            address = block[0] + (-block[0]) % align
+            if (address+size <= block[1]):
+                rest = block[1]-block[0]-size
+                if (best == None or rest < best[0]):
+                    best = [rest, block, address]
+
+        if (best == None):
+            largest = max([block[1]-block[0] for block in free[partition]] + [0])
+            raise AssemblerError("ALLOCATION FAILED: {} words for '{}' do not fit into {} (largest free block {} words)".format(
+                size, name, partition, largest))
+
+        block, address = best[1], best[2]
+        position = free[partition].index(block)
+        free[partition][position:position+1] = [piece for piece in [[block[0], address], [address+size, block[1]]] if piece[1] > piece[0]]
+        placed[name] = [partition, address, size]
+
+    return [placed, free]
+
+# the operand for name, [name] or name+offset, None if the token names no allocation
+def allocatedOperand(token, placed):
+    bracket = token[0] == "[" and token[len(token)-1] == "]"
+    inner = token[1:len(token)-1] if bracket else token
+    name, plus, offset = inner.partition("+")
+    if (name not in placed or isString(name)):
+        return None
+
+    offset = getCount(offset) if plus else 0
+    if (offset >= placed[name][2]):
+        raise AssemblerError("'{}' is outside of the {} words of '{}'".format(inner, placed[name][2], name))
+    operand = "0x" + format(placed[name][1]+offset, "04x")
+    return "[" + operand + "]" if bracket else operand
+
+# places variables, buffers, data and strings and replaces their names by the addresses,
+# returns [tokens, allocations, free blocks]
+def allocateMemory(tokens, directory = "."):
+    tokens, requests = collectAllocations(tokens, directory)
+    placed, free = placeAllocations(requests)
+
+    for name, _partition, size, _align, words in requests:
+        if (words != None):
+            address = placed[name][1]
+            MEMORY.update(zip(range(address, address+size), words))
+
+    result = []
+    for curTok in tokens:
+        if (type(curTok) == str):
+            if (curTok[0] == ":" and curTok[1:len(curTok)] in placed):
+                raise AssemblerError("'{}' is a label and an allocation".format(curTok[1:len(curTok)]))
+            if (isString(curTok)):
+                curTok = "0x" + format(placed[curTok][1], "04x")
+            else:
+                curTok = allocatedOperand(curTok, placed) or curTok
+        result.append(curTok)
+
+    return [result, placed, free]
+
+# usage of every partition followed by the allocations and labels (':name')
+# and the jumps replaced by their loop-back form, as written to the .map file
+def memoryReport(programWords, placed, free, labels = {}, selections = []):
+    lines = ["{:<14} {:>7} {:>7} {:>7} {:>7} {:>8}".format("partition", "start", "end", "used", "free", "largest")]
+    for partition in PARTITIONS:
+        start, end = PARTITIONS[partition]
+        if (partition == "PROG_MEM"):
+            used = programWords
+            blocks = [[start+programWords, end]]
+        else:
+            used = sum(entry[2] for entry in placed.values() if entry[0] == partition)
+            blocks = free[partition]
+        largest = max([block[1]-block[0] for block in blocks] + [0])
+        lines.append("{:<14} {:>7} {:>7} {:>7} {:>7} {:>8}   {:.1f}% used".format(partition, "0x" + format(start, "04x"),
+            "0x" + format(end, "04x"), used, partitionSize(partition)-used, largest, 100*used/partitionSize(partition)))
+
+    lines.append("")
+    entries = [[address, str(size), partition, name] for name, (partition, address, size) in placed.items()]
+    entries += [[int(address, 16), "-", "PROG_MEM", ":" + name] for name, address in labels.items()]
+    for address, size, partition, name in sorted(entries, key = lambda entry: entry[0]):
+        lines.append("0x{:04x} {:>7}  {:<14} {}".format(address, size, partition, name))
+
+    if (len(selections) > 0):
+        lines.append("")
+        for mnemonic, target, replacement in selections:
+            lines.append("{:<4} {:<20} -> {:<4} {:>2} cycle(s) saved".format(mnemonic, target, replacement,
+                JUMP_SAVED_CYCLES[INSTRUCTION_SET[mnemonic]]))
+        lines.append("{} replaced jumps save {} cycles when each is taken once".format(len(selections), jumpSaving(selections)))
+    return "\n".join(lines) + "\n"
+
+def checkProgram(grammar):
+    # names that are no label are left padded like words, "0ldb"
+    for word in grammar:
+        if (word.lstrip("0").lower() in REMOVED_INSTRUCTIONS):
+            raise AssemblerError("'{}' is not part of the instruction set anymore, the microcode does not implement it".format(word.lstrip("0")))
+    if (len(grammar) > partitionSize("PROG_MEM")):
+        raise AssemblerError("ALLOCATION FAILED: the program needs {} words, PROG_MEM holds {}".format(
+            len(grammar), partitionSize("PROG_MEM")))
+
+# translates the source, files of data directives are read relative to `directory`,
+# returns [tokens, program words, allocations, free blocks]
+# every call starts from a clean state, so programs can be assembled one after the other
+# stats is a PhaseStats (--stats), the labels are resolved while grammar2 runs
+def assemble(content, superinstructions, directory = ".", stats = None):
+    phase = stats.phase if (stats != None) else (lambda name: contextlib.nullcontext())
+    resetState()
+
+    with phase("tokenize"):
+        tokens = expandMacros(tokenizer(content))
+    with phase("allocate"):
+        tokens, placed, free = allocateMemory(tokens, directory)
+    with phase("jump selection"):
+        tokens, selections = selectJumps(tokens, superinstructions)
+        JUMP_SELECTIONS[:] = selections
+        tokens = fuseInstructions(tokens, superinstructions)
+    with phase("grammar + labels"):
+        grammar = grammar2(tokens, BUFFER_POINTER)
+        checkProgram(grammar)
+    return [tokens, grammar, placed, free]
+
 def grammar2(tokens, buffer_pointer):
     RESULT = []
 
@@ -267,14 +1008,15 @@ def grammar2(tokens, buffer_pointer):
                         curTok = "0"+curTok
 
             elif (curTok[0] == "$" and curTok[len(curTok)-1] == "$"): # $Hello World!$=f000
+                # only reached when allocateMemory did not run before
                 stringRes = getTextFrom(curTok, buffer_pointer)
-                buffer_pointer = stringRes[1]
-                if (stringRes[1] == "ALLOCATION FAILED"):
-                    print("ALLOCATION FAILED; ISSUES MAY OCCUR WHEN PROGRAM IS RUN")
+                if (stringRes[1] > PARTITIONS["BUFFER_MEM"][1]):
+                    raise AssemblerError("ALLOCATION FAILED: {} does not fit into BUFFER_MEM".format(curTok))
 
                 for key in stringRes[0].keys():
                     MEMORY[key] = stringRes[0][key]
-                curTok = "0000"
+                curTok = format(buffer_pointer, "04x")
+                buffer_pointer = stringRes[1]
 
             foundJump = JUMP_LABELS.get(curTok)
 
@@ -289,7 +1031,8 @@ def grammar2(tokens, buffer_pointer):
                         curTok = "0"+curTok
                         
             else:
-                save = True
+                # the label may be defined later, remembered by its name and not by the padded word
+                save = curTok
 
             
             resTok = curTok
@@ -307,13 +1050,12 @@ def grammar2(tokens, buffer_pointer):
             resPos += 1
 
             if (save):
-                if (len(resTok)>2):
-                    _list = JUMP_LABELS_AWAIT.get(resTok)
-                    if (_list):
-                        _list.insert(len(_list), resPos)
-                    else:
-                        JUMP_LABELS_AWAIT[resTok] = [resPos]
-                    
+                _list = JUMP_LABELS_AWAIT.get(save)
+                if (_list):
+                    _list.insert(len(_list), resPos)
+                else:
+                    JUMP_LABELS_AWAIT[save] = [resPos]
+                
                 save = False
 
             resTok = ""
@@ -337,87 +1079,122 @@ def grammar2(tokens, buffer_pointer):
 #   Input-Handling
 #
 
+# places the assembled program at the start of memory
+def placeProgram(grammar):
+    counter = 0
+    for _i in grammar:
+        MEMORY[counter] = grammar[grammar.index(_i)]
+        counter +=1 
+
+# formats the memory as a Logisim "v2.0 raw" image
+def formatImage(memory, width = 10):
+    formatGrammar = "v2.0 raw\n"
+    counter = 1
+
+    for element in memory:
+        if (counter%width == 0):
+            formatGrammar = formatGrammar + memory[element] + "\n"
+        else:
+            formatGrammar = formatGrammar + memory[element] + " "
+
+        counter += 1
+
+    return formatGrammar
+
 def loadFile(file_name):
     file = open(file_name, "r")
     res = file.read()
     file.close()
     return res
 
-arguments_num = len(sys.argv)
-PRINT_RESULT = False
-file_name = None
+if __name__ == "__main__":
+    # --stats prints time and peak memory per phase, --profile FILE also writes a cProfile dump
+    from phase_stats import PhaseStats
+    STATS_ENABLED = "--stats" in sys.argv
+    if (STATS_ENABLED):
+        sys.argv.remove("--stats")
+    PROFILE_FILE = None
+    if ("--profile" in sys.argv and sys.argv.index("--profile") + 1 < len(sys.argv)):
+        position = sys.argv.index("--profile")
+        PROFILE_FILE = sys.argv[position + 1]
+        del sys.argv[position:position + 2]
+    STATS = PhaseStats(STATS_ENABLED, PROFILE_FILE)
+
+    arguments_num = len(sys.argv)
+    PRINT_RESULT = False
+    file_name = None
+
+    if (arguments_num == 4):
+        file_name = sys.argv[2]
+        PRINT_RESULT = True
+
+    elif (arguments_num == 3):
+        file_name = sys.argv[1]
 
-if (arguments_num == 4):
-    file_name = sys.argv[2]
-    PRINT_RESULT = True
-
-elif (arguments_num == 3):
-    file_name = sys.argv[1]
-
-else:
-    print("!! NO FILE PROVIDED !!")
-    exit(0)
-    
-CONTENT = loadFile(file_name)
-TOKENS = tokenizer(CONTENT)
-GRAMMAR = grammar2(TOKENS, BUFFER_POINTER)
-
-counter = 0
-for _i in GRAMMAR:
-    MEMORY[counter] = GRAMMAR[GRAMMAR.index(_i)]
-    counter +=1 
-
-if (PRINT_RESULT):
-    print(" ")
-    print("DECODED TOKENS:")
-    print(TOKENS)
-    print("------------------------------------")
-    print("\nAST-Applied: ")
-    print(GRAMMAR)
-    print("------------------------------------")
-    res = ""
-
-    count = 0
-    for item in GRAMMAR:
-        count += 1
-        res+=str(item)+" "
-    print("\nRaw-Binary: ")
-    print(res)
-    print(" ")
-    print("Bytes:\n" + str(len(GRAMMAR)) + " / 255\n")
-    
-    print("#Include <sub-routine>")
-    for i in JUMP_LABELS:
-        print("\t:"+i)
-
-FORMAT_GRAMMAR = "v2.0 raw\n"
-FORMAT_WIDTH = 10
-COUNTER = 1
-
-for element in MEMORY:
-    if (COUNTER%FORMAT_WIDTH == 0):
-        FORMAT_GRAMMAR = FORMAT_GRAMMAR + MEMORY[element] + "\n"
     else:
-        FORMAT_GRAMMAR = FORMAT_GRAMMAR + MEMORY[element] + " "
-
-    COUNTER += 1
-
-# for element in GRAMMAR:
-#    if (COUNTER%FORMAT_WIDTH == 0):
-#        FORMAT_GRAMMAR = FORMAT_GRAMMAR + GRAMMAR[COUNTER-1] + "\n"
-#    else:
-#        FORMAT_GRAMMAR = FORMAT_GRAMMAR + GRAMMAR[COUNTER-1] + " "
-#
-#    COUNTER += 1
-
-
-outputFilename = ""
-if (len(sys.argv) == 4):
-    outputFilename = sys.argv[3]
-else:
-    outputFilename = sys.argv[2]
-
-outputFile = open(outputFilename+".o", "w")
-outputFile.write(FORMAT_GRAMMAR)
-outputFile.close()
-
+        print("!! NO FILE PROVIDED !!")
+        exit(0)
+
+    CONTENT = loadFile(file_name)
+    try:
+        TOKENS, GRAMMAR, ALLOCATIONS, FREE = assemble(CONTENT, loadSuperinstructions(), os.path.dirname(os.path.abspath(file_name)), STATS)
+    except AssemblerError as error:
+        print("!! {} !!".format(error))
+        exit(1)
+
+    outputFilename = ""
+    if (len(sys.argv) == 4):
+        outputFilename = sys.argv[3]
+    else:
+        outputFilename = sys.argv[2]
+
+    with STATS.phase("emit"):
+        placeProgram(GRAMMAR)
+        FORMAT_GRAMMAR = formatImage(MEMORY)
+
+        outputFile = open(outputFilename+".o", "w")
+        outputFile.write(FORMAT_GRAMMAR)
+        outputFile.close()
+
+        REPORT = memoryReport(len(GRAMMAR), ALLOCATIONS, FREE, JUMP_LABELS, JUMP_SELECTIONS)
+        outputFile = open(outputFilename+".map", "w")
+        outputFile.write(REPORT)
+        outputFile.close()
+
+    if (PRINT_RESULT):
+        print(" ")
+        print("DECODED TOKENS:")
+        print(TOKENS)
+        print("------------------------------------")
+        print("\nAST-Applied: ")
+        print(GRAMMAR)
+        print("------------------------------------")
+        res = ""
+
+        count = 0
+        for item in GRAMMAR:
+            count += 1
+            res+=str(item)+" "
+        print("\nRaw-Binary: ")
+        print(res)
+        print(" ")
+        print("Words:\n" + str(len(GRAMMAR)) + " / " + str(partitionSize("PROG_MEM")) + "\n")
+
+        print("#Include <sub-routine>")
+        for i in JUMP_LABELS:
+            print("\t:"+i)
+
+        print("\nMemory:")
+        print(REPORT)
+
+        print("\nJumps:")
+        for mnemonic, target, replacement in JUMP_SELECTIONS:
+            print("\t{} {} -> {}".format(mnemonic, target, replacement))
+
+    if (len(JUMP_SELECTIONS) > 0):
+        print("{} jumps never return, their loop-back form saves {} cycles when each is taken once".format(
+            len(JUMP_SELECTIONS), jumpSaving(JUMP_SELECTIONS)))
+
+    if (STATS.enabled):
+        print("")
+        STATS.report()
@@ -0,0 +1,151 @@
+#!python3
+
+#
+#   Turns assembled programs back into source for assemblyCompilerv2.py.
+#
+#   The opcodes and operand counts are taken from the instruction set of
+#   generate_cpu_microcode.py, the mnemonics from the INSTRUCTION_SET of the
+#   assembler (`lda #5` for lda_num, `lda [0x00a1]` for lda_addr). Jump
+#   targets pointing at an instruction become labels, fused opcodes
+#   (superinstructions.py) are written as their two instructions. Words that
+#   are no opcode are written as plain `0x` words.
+#
+#   Assembling the output again gives the same program words.
+#
+#   Ex.: disassembler.py program.o
+#        disassembler.py program.o -o program.asm
+#
+
+import argparse
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+
+import generate_cpu_microcode
+import load_rom
+import optimize_microcode
+from assemblyCompilerv2 import INSTRUCTION_SET, PARTITIONS
+
+# microcode name -> [mnemonic, whether the first operand is written in brackets]
+def mnemonics(counts):
+    names = {op_code: name for name, (op_code, _operands) in counts.items()}
+    result = {}
+    for mnemonic, value in INSTRUCTION_SET.items():
+        for index, op_code in enumerate(value if type(value) == list else [value]):
+            name = names.get(int(op_code, 16))
+            if name is not None:
+                result[name] = [mnemonic, index == 1]
+    return result
+
+# opcode -> parts of the instruction, a part is (mnemonic, bracket, operand kinds)
+def opcode_table(instruction_set = None):
+    counts = optimize_microcode.operand_counts(instruction_set or generate_cpu_microcode.instruction_set)
+    names = mnemonics(counts)
+    table = {}
+    for name, (op_code, _operands) in counts.items():
+        parts = []
+        for part in name.split("+"):
+            if part not in names:
+                break
+            mnemonic, bracket = names[part]
+            parts.append((mnemonic, bracket, optimize_microcode.operand_kinds(counts, part)))
+        else:
+            table[op_code] = parts
+    return table
+
+# Splits the words into instructions: (address, opcode or None for a plain word, operands).
+def decode(words, table):
+    instructions = []
+    address = 0
+    while address < len(words):
+        op_code = words[address]
+        parts = table.get(op_code)
+        operands = sum(len(kinds) for _mnemonic, _bracket, kinds in parts) if parts else 0
+        if parts is None or address + operands >= len(words):
+            instructions.append((address, None, []))
+            address += 1
+            continue
+        instructions.append((address, op_code, list(words[address + 1:address + 1 + operands])))
+        address += 1 + operands
+    return instructions
+
+def label_name(address):
+    return "L{:04x}".format(address)
+
+def format_operand(kind, word, bracket, labels):
+    if kind == "target" and word in labels:
+        text = label_name(word)
+    elif kind == "value":
+        text = "#{}".format(word)
+    else:
+        text = "0x{:04x}".format(word)
+    return "[{}]".format(text) if bracket else text
+
+# Returns the source of the program words.
+def disassemble(words, instruction_set = None):
+    words = [int(word) for word in words]
+    table = opcode_table(instruction_set)
+    instructions = decode(words, table)
+    starts = set(address for address, _op_code, _operands in instructions) | {len(words)}
+
+    labels = set()
+    for _address, op_code, operands in instructions:
+        if op_code is None:
+            continue
+        kinds = [kind for _mnemonic, _bracket, part_kinds in table[op_code] for kind in part_kinds]
+        labels.update(word for kind, word in zip(kinds, operands) if kind == "target" and word in starts)
+
+    # the assembler fuses these pairs again unless a label separates them
+    fused = set()
+    for parts in table.values():
+        if len(parts) == 2:
+            fused.add(tuple(part[:2] for part in parts))
+    for first, second in zip(instructions, instructions[1:]):
+        if first[1] is not None and second[1] is not None and len(table[first[1]]) == 1 and len(table[second[1]]) == 1:
+            if (table[first[1]][0][:2], table[second[1]][0][:2]) in fused:
+                labels.add(second[0])
+
+    lines = []
+    for address, op_code, operands in instructions:
+        if address in labels:
+            lines.append(":" + label_name(address))
+        if op_code is None:
+            lines.append("    0x{:04x}".format(words[address]))
+            continue
+        for mnemonic, bracket, kinds in table[op_code]:
+            texts = [format_operand(kind, word, bracket and i == 0, labels) for i, (kind, word) in enumerate(zip(kinds, operands))]
+            operands = operands[len(kinds):]
+            lines.append("    " + " ".join([mnemonic] + texts))
+    if len(words) in labels:
+        lines.append(":" + label_name(len(words)))
+    return "\n".join(lines) + "\n"
+
+# Program words of an image: PROG_MEM without the zeros at its end.
+def program_words(image):
+    words = [int(word) for word in image[PARTITIONS["PROG_MEM"][0]:PARTITIONS["PROG_MEM"][1]]]
+    while words and words[-1] == 0:
+        words.pop()
+    return words
+
+def main():
+    parser = argparse.ArgumentParser(description = "Disassembles programs of assemblyCompilerv2.py.")
+    parser.add_argument("image", help = "assembled program (v2.0 raw)")
+    parser.add_argument("-o", "--output", help = "write the source to this file instead of printing it")
+    args = parser.parse_args()
+
+    try:
+        source = disassemble(program_words(load_rom.read_file(args.image)))
+    except (OSError, load_rom.RawImageError) as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(source)
+    else:
+        print(source, end = "")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#
+#   Assembler for the register based instruction set (docs/InstructionSet.md)
+#   implemented by newGenerator.py.
+#
+#   Instruction word:
+#       bits 0-7    opcode
+#       bits 8-12   source register / expansion port
+#       bits 13-17  destination register / expansion port
+#   Immediate values and addresses follow in the next words.
+#
+#   The opcodes are read from newGenerator's `instructions` map, so the
+#   encoding always matches the microcode. Instructions the microcode does
+#   not implement yet (missing, or only fetch and end steps) are rejected.
+#
+#   Ex.: newAssembler.py program.asm program      (writes program.o)
+#        newAssembler.py program.asm program --stats
+#
+
+import argparse
+import contextlib
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+
+import newGenerator
+import save_rom
+from phase_stats import PhaseStats
+
+SOURCE_SHIFT = 8
+DEST_SHIFT = 13
+REGISTER_MASK = 0x1F
+WORD_MASK = 0xFFFFFF
+
+# register and expansion port addresses (docs/Registers.md)
+REGISTERS = {"rea": 0x00, "reb": 0x01, "acc": 0x02, "sp": 0x0E, "pc": 0x0F}
+for _i, _letter in enumerate("pqrstuvwxyz"):
+    REGISTERS["re" + _letter] = 0x03 + _i
+for _i in range(16):
+    REGISTERS["ep{:x}".format(_i)] = 0x10 + _i
+
+# mnemonic: [(operands, microcode instruction), ...]
+#   dest    register or expansion port, placed in the destination field
+#   src     register or expansion port, placed in the source field
+#   value   immediate value (#10, 0xff), label or label+offset, placed in the next word
+#   memory  RAM location ([0xa001]), its address is placed in the next word
+ENCODINGS = {
+    "nop":  [((), "nop")],
+    "halt": [((), "halt")],
+    "mov":  [(("dest", "src"), "mov")],
+    "ldi":  [(("dest", "value"), "ldi"), (("dest", "memory"), "ldi_addr")],
+    "str":  [(("src", "value"), "str"), (("value", "value"), "str_addr")],
+    "jp":   [(("value",), "jp")],
+    "jpz":  [(("value",), "jpz")],
+    "jpc":  [(("value",), "jpc")],
+    "call": [(("value",), "call")],
+    "rts":  [((), "rts")],
+}
+
+# operate on REA and REB and put the result into ACC, given operands are loaded first
+ALU_INSTRUCTIONS = ["add", "sub", "mul", "div", "and", "or", "xor"]
+for _name in ALU_INSTRUCTIONS:
+    ENCODINGS[_name] = [((), _name)]
+
+class AssemblerError(Exception):
+    pass
+
+# instructions doing nothing on purpose, the others need execute steps
+EMPTY_INSTRUCTIONS = ["nop"]
+
+# Opcodes of the microcode: {instruction name: opcode}. Instructions whose
+# microcode is only fetch and end (not written yet) are left out.
+def loadOpcodes():
+    if (not newGenerator.instructions):
+        newGenerator.generate_microcode(newGenerator.instruction_set)
+    empty = newGenerator.generateInstruction()
+    stubs = set(instruction['name'] for instruction in newGenerator.instruction_set
+        if instruction['steps'] == empty and instruction['name'] not in EMPTY_INSTRUCTIONS)
+    return {name: int(opcode, 16) for name, opcode in newGenerator.instructions.items() if name not in stubs}
+
+# Sorts an operand into dest/src (register), value or memory.
+def getOperandKind(operand):
+    if (operand.lower() in REGISTERS):
+        return "register"
+    if (operand[0] == "[" and operand[-1] == "]"):
+        return "memory"
+    return "value"
+
+# Reads an immediate value, returns the label name instead if it is one.
+def getValue(operand):
+    try:
+        if (operand[0] == "#"):
+            return int(operand[1:]) & WORD_MASK
+        if (operand[0:2].lower() == "0x"):
+            return int(operand[2:], 16) & WORD_MASK
+    except ValueError:
+        raise AssemblerError("invalid value '{}'".format(operand)) from None
+    if (not (operand[0].isalpha() or operand[0] == "_")):
+        raise AssemblerError("invalid operand '{}'".format(operand))
+    return operand
+
+# Encodes one instruction, returns its words. Labels are returned as names
+# and replaced by their address once all labels are known.
+def encodeInstruction(mnemonic, operands, opcodes):
+    forms = ENCODINGS.get(mnemonic)
+    if (forms == None):
+        raise AssemblerError("unknown instruction '{}'".format(mnemonic))
+
+    kinds = [getOperandKind(operand) for operand in operands]
+    for roles, name in forms:
+        if (len(roles) != len(operands)):
+            continue
+        if (not all(kind == ("register" if role in ("dest", "src") else role) for role, kind in zip(roles, kinds))):
+            continue
+
+        opcode = opcodes.get(name)
+        if (opcode == None):
+            raise AssemblerError("'{}' is not implemented by the microcode".format(name))
+
+        word = opcode
+        extra = []
+        for role, operand in zip(roles, operands):
+            if (role == "dest"):
+                word |= REGISTERS[operand.lower()] << DEST_SHIFT
+            elif (role == "src"):
+                word |= REGISTERS[operand.lower()] << SOURCE_SHIFT
+            elif (role == "memory"):
+                extra.append(getValue(operand[1:-1]))
+            else:
+                extra.append(getValue(operand))
+        return [word] + extra
+
+    if (mnemonic in ALU_INSTRUCTIONS and len(operands) == 2):
+        # add x, y  ->  x into REA, y into REB, add
+        return (loadOperand("REA", operands[0], opcodes) + loadOperand("REB", operands[1], opcodes)
+            + encodeInstruction(mnemonic, [], opcodes))
+
+    raise AssemblerError("invalid operands for '{}': {}".format(mnemonic, ", ".join(operands) or "none"))
+
+# Encodes moving a register, value or RAM location into `register`.
+def loadOperand(register, operand, opcodes):
+    if (getOperandKind(operand) == "register"):
+        if (operand.lower() == register.lower()):
+            return []
+        return encodeInstruction("mov", [register, operand], opcodes)
+    return encodeInstruction("ldi", [register, operand], opcodes)
+
+# Splits a source line into [label or None, mnemonic or None, operands].
+def parseLine(line):
+    line = line.split(";")[0].strip()
+    label = None
+    if (line[0:1] == ":"):
+        label, _, line = line[1:].partition(" ")
+        line = line.strip()
+    if (not line):
+        return [label, None, []]
+
+    mnemonic, _, rest = line.partition(" ")
+    operands = [operand.strip() for operand in rest.split(",") if operand.strip()]
+    return [label, mnemonic.lower(), operands]
+
+# Assembles the source, returns [words, labels].
+# stats is a PhaseStats (--stats) timing the phases.
+def assemble(source, opcodes = None, stats = None):
+    phase = stats.phase if (stats != None) else (lambda name: contextlib.nullcontext())
+    with phase("opcodes"):
+        opcodes = opcodes or loadOpcodes()
+    words = []
+    labels = {}
+
+    with phase("tokenize"):
+        lines = [[number] + parseLine(line) for number, line in enumerate(source.split("\n"), 1)]
+
+    with phase("grammar"):
+        for number, label, mnemonic, operands in lines:
+            try:
+                if (label != None):
+                    if (label in labels):
+                        raise AssemblerError("label '{}' defined twice".format(label))
+                    labels[label] = len(words)
+                if (mnemonic != None):
+                    words.extend(encodeInstruction(mnemonic, operands, opcodes))
+            except AssemblerError as error:
+                raise AssemblerError("line {}: {}".format(number, error)) from None
+
+    with phase("label resolve"):
+        for i, word in enumerate(words):
+            if (type(word) == str):
+                # label+N addresses a word inside an instruction (self-modifying code)
+                name, _, offset = word.partition("+")
+                if (name not in labels):
+                    raise AssemblerError("unknown label '{}'".format(name))
+                try:
+                    words[i] = (labels[name] + int(offset or "0", 0)) & WORD_MASK
+                except ValueError:
+                    raise AssemblerError("invalid offset in '{}'".format(word)) from None
+
+    return [words, labels]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Assembles programs for the register based instruction set.")
+    parser.add_argument("source", help = "assembly file")
+    parser.add_argument("output", help = "output name, '.o' is appended")
+    parser.add_argument("-v", "--verbose", action = "store_true", help = "print the words and labels")
+    parser.add_argument("--stats", action = "store_true", help = "print time and peak memory of every phase")
+    parser.add_argument("--profile", metavar = "FILE", help = "also write a cProfile dump of the phases to FILE")
+    args = parser.parse_args()
+    stats = PhaseStats(args.stats, args.profile)
+
+    with open(args.source, "r", encoding = "utf-8") as file:
+        source = file.read()
+    try:
+        words, labels = assemble(source, stats = stats)
+    except AssemblerError as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
+
+    if (args.verbose):
+        for address, word in enumerate(words):
+            print("{:06x}: {:06x}".format(address, word))
+        for label, address in labels.items():
+            print(":{} = {:06x}".format(label, address))
+
+    with stats.phase("emit"):
+        save_rom.save_file(args.output + ".o", words, 24)
+    print("{} words written to {}.o".format(len(words), args.output))
+    stats.report()
@@ -0,0 +1,322 @@
+#!python3
+
+#
+#   Benchmark suite for the toolchain.
+#
+#   Generates synthetic programs that fill PROG_MEM, times the assembler
+#   phases (tokenizer, grammar2, image emission) and the microcode generators
+#   (generate_microcode, fill_microcode_addresses, save_rom.save_file) and
+#   measures the simulator's speed in MIPS.
+#   Results are written as JSON so runs from different commits can be compared.
+#
+#   Ex.: benchmark.py -o results.json
+#        benchmark.py -o new.json --compare old.json
+#
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "Simulator"))
+
+import assemblyCompilerv2
+import generate_cpu_microcode
+import newGenerator
+import save_rom
+import simulator
+
+PROG_MEM_SIZE = assemblyCompilerv2.partitionSize("PROG_MEM")
+BUFFER_MEM_SIZE = assemblyCompilerv2.partitionSize("BUFFER_MEM")
+DEFAULT_SIZES = [1024, 4096, 16384, PROG_MEM_SIZE]
+SIMULATOR_INSTRUCTIONS = 1000000
+
+# endless loop of loads, stores, ALU operations and taken branches
+SIMULATOR_KERNEL = """
+lda #0
+:loop
+add #1
+sta 0xa001
+dw [0xa001]
+sub [0xa001]
+lbz loop
+"""
+
+# instructions taking an immediate or [address] operand
+OPERAND_INSTRUCTIONS = ["lda", "add", "sub", "out", "lpc", "dw"]
+# instructions taking a plain address operand
+ADDRESS_INSTRUCTIONS = ["sta", "spc", "tw"]
+# instructions jumping to a label
+JUMP_INSTRUCTIONS = ["jp", "jpz", "jpc", "lb", "lbz", "lbc"]
+# instructions without operand
+SINGLE_INSTRUCTIONS = ["nop", "rts", "rtz", "rtc", "dc", "tc", "co", "ct"]
+
+STRING_CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,!?"
+
+#
+#   Program generation
+#
+
+# Generates a random operand in one of the notations the assembler accepts.
+def random_operand(rng):
+    kind = rng.randrange(3)
+    if kind == 0:
+        return "#" + str(rng.randrange(0x10000))
+    elif kind == 1:
+        return "0x{:04x}".format(rng.randrange(0x10000))
+    return "[0x{:04x}]".format(rng.randrange(0xa001, 0xd000))
+
+# Generates a random "$...$" string token, spaces are written as "\s".
+def random_string(rng):
+    words = ["".join(rng.choice(STRING_CHARACTERS) for _ in range(rng.randrange(1, 8)))
+        for _ in range(rng.randrange(1, 4))]
+    return "$" + "\\s".join(words) + "$"
+
+# Generates a program of roughly `words` memory words.
+# Labels are placed every few instructions and jumps target labels both
+# before and after their own position.
+def generate_program(words, seed = 0):
+    rng = random.Random(seed)
+    label_count = max(1, words // 16)
+    labels = ["label_{}".format(i) for i in range(label_count)]
+    next_label = 0
+
+    lines = []
+    emitted = 0
+    string_words = 0    # the strings have to fit into BUFFER_MEM
+    while emitted < words - 1:
+        if next_label < label_count and rng.random() < 0.08:
+            lines.append(":" + labels[next_label])
+            next_label += 1
+
+        pick = rng.random()
+        if pick < 0.45:
+            lines.append(rng.choice(OPERAND_INSTRUCTIONS) + " " + random_operand(rng))
+            emitted += 2
+        elif pick < 0.6:
+            lines.append(rng.choice(ADDRESS_INSTRUCTIONS) + " 0x{:04x}".format(rng.randrange(0xa001, 0xd000)))
+            emitted += 2
+        elif pick < 0.8:
+            lines.append(rng.choice(JUMP_INSTRUCTIONS) + " " + rng.choice(labels))
+            emitted += 2
+        elif pick < 0.9 and string_words < BUFFER_MEM_SIZE - 32:
+            string = random_string(rng)
+            lines.append("out " + string)
+            string_words += len(string) - 2 - string.count("\\s")
+            emitted += 2
+        else:
+            lines.append(rng.choice(SINGLE_INSTRUCTIONS))
+            emitted += 1
+
+    # defining the labels that were never placed so every jump resolves
+    for label in labels[next_label:]:
+        lines.append(":" + label)
+    lines.append("halt")
+
+    return "\n".join(lines) + "\n"
+
+#
+#   Measuring
+#
+
+# Runs the phases of `run_phases` once and returns {phase: (seconds, peak_bytes)}.
+# `run_phases` is a generator yielding the phase name before each phase starts
+# and once more at the end.
+def measure(run_phases, trace_memory):
+    results = {}
+    current = None
+    started = 0
+
+    for phase in run_phases():
+        now = time.perf_counter()
+        if current is not None:
+            peak = 0
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+            results[current] = (now - started, peak)
+
+        if trace_memory:
+            tracemalloc.reset_peak()
+        current = phase
+        started = time.perf_counter()
+
+    return results
+
+# Repeats `run_phases`, keeping every timing and the peak memory of an extra traced run.
+def benchmark(run_phases, repeat):
+    timings = {}
+    for _ in range(repeat):
+        for phase, (seconds, _peak) in measure(run_phases, False).items():
+            timings.setdefault(phase, []).append(seconds)
+
+    tracemalloc.start()
+    try:
+        peaks = {phase: peak for phase, (_seconds, peak) in measure(run_phases, True).items()}
+    finally:
+        tracemalloc.stop()
+
+    return {
+        phase: {
+            "min_s": min(seconds),
+            "median_s": statistics.median(seconds),
+            "runs": len(seconds),
+            "peak_bytes": peaks.get(phase, 0)
+        }
+        for phase, seconds in timings.items()
+    }
+
+def assembler_phases(source):
+    def run_phases():
+        assemblyCompilerv2.resetState()
+        yield "assembler.tokenizer"
+        tokens = assemblyCompilerv2.tokenizer(source)
+        yield "assembler.grammar2"
+        grammar = assemblyCompilerv2.grammar2(tokens, assemblyCompilerv2.BUFFER_POINTER)
+        yield "assembler.emit"
+        assemblyCompilerv2.placeProgram(grammar)
+        assemblyCompilerv2.formatImage(assemblyCompilerv2.MEMORY)
+        yield None
+    return run_phases
+
+def microcode_phases(directory):
+    def run_phases():
+        yield "generate_cpu_microcode.generate"
+        microcode = generate_cpu_microcode.generate_microcode(
+            generate_cpu_microcode.fetch, generate_cpu_microcode.instruction_set)
+        yield "generate_cpu_microcode.fill"
+        microcode = generate_cpu_microcode.fill_microcode_addresses(microcode)
+        yield "generate_cpu_microcode.save"
+        save_rom.save_file(
+            os.path.join(directory, "cpu_microcode.rom"),
+            [instruction_step["flag"] for instruction_step in microcode],
+            32)
+        yield None
+    return run_phases
+
+def new_microcode_phases(directory):
+    def run_phases():
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield "newGenerator.generate"
+            microcode = newGenerator.generate_microcode(newGenerator.instruction_set)
+            yield "newGenerator.fill"
+            rom = newGenerator.fill_microcode_addresses(microcode)
+            yield "newGenerator.save"
+            save_rom.save_file(os.path.join(directory, "new_microcode.rom"), rom, 24)
+            yield None
+    return run_phases
+
+def simulator_phases(instructions):
+    assemblyCompilerv2.resetState()
+    program = assemblyCompilerv2.grammar2(
+        assemblyCompilerv2.tokenizer(SIMULATOR_KERNEL), assemblyCompilerv2.BUFFER_POINTER)
+    words = [int(word, 16) for word in program]
+
+    def run_phases():
+        yield "simulator.boot"
+        cpu = simulator.Simulator()
+        cpu.load(words)
+        yield "simulator.run"
+        cpu.run(instructions)
+        yield None
+    return run_phases
+
+#
+#   Reporting
+#
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd = DEV_TOOLS,
+            capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    print("{} {} {} {}".format("benchmark".ljust(36), "size".rjust(8), "median [s]".rjust(12), "peak [KiB]".rjust(12)))
+    for result in results:
+        print("{} {} {:12.4f} {:12.1f}{}".format(
+            result["name"].ljust(36),
+            str(result["size"] or "-").rjust(8),
+            result["median_s"],
+            result["peak_bytes"] / 1024,
+            "  {:.2f} MIPS".format(result["mips"]) if "mips" in result else ""))
+
+# Prints the ratio of every benchmark to the same benchmark in an older result file.
+def print_comparison(results, old_file_name):
+    with open(old_file_name, "r", encoding="utf-8") as file:
+        old = json.load(file)
+    old_results = {(item["name"], item["size"]): item for item in old["results"]}
+
+    print("\ncompared to {} ({})".format(old_file_name, old["meta"].get("revision")))
+    for result in results:
+        previous = old_results.get((result["name"], result["size"]))
+        if previous is None:
+            continue
+        time_ratio = result["median_s"] / previous["median_s"] if previous["median_s"] else float("inf")
+        memory_ratio = result["peak_bytes"] / previous["peak_bytes"] if previous["peak_bytes"] else float("inf")
+        print("{} {} time x{:.2f}  memory x{:.2f}".format(
+            result["name"].ljust(36), str(result["size"] or "-").rjust(8), time_ratio, memory_ratio))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the assembler, microcode generators and simulator.")
+    parser.add_argument("-o", "--output", default = "benchmark.json", help = "JSON result file")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = DEFAULT_SIZES,
+        help = "program sizes in words (default: %(default)s)")
+    parser.add_argument("--repeat", type = int, default = 3, help = "timed runs per benchmark")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the program generator")
+    parser.add_argument("--skip-full-rom", action = "store_true",
+        help = "skip the 16M-word newGenerator ROM")
+    parser.add_argument("--compare", metavar = "OLD_JSON", help = "result file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        source = generate_program(min(size, PROG_MEM_SIZE), args.seed)
+        for name, result in benchmark(assembler_phases(source), args.repeat).items():
+            results.append(dict(name = name, size = size, **result))
+
+    for name, result in benchmark(simulator_phases(SIMULATOR_INSTRUCTIONS), args.repeat).items():
+        if name == "simulator.run":
+            result["mips"] = SIMULATOR_INSTRUCTIONS / result["median_s"] / 1e6
+        results.append(dict(name = name, size = SIMULATOR_INSTRUCTIONS, **result))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, result in benchmark(microcode_phases(directory), args.repeat).items():
+            results.append(dict(name = name, size = None, **result))
+        if not args.skip_full_rom:
+            for name, result in benchmark(new_microcode_phases(directory), 1).items():
+                results.append(dict(name = name, size = None, **result))
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent = 2)
+
+    print_results(results)
+    if args.compare:
+        print_comparison(results, args.compare)
+
+if __name__ == "__main__":
+    main()
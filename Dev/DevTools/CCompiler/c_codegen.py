@@ -0,0 +1,339 @@
+#
+#   Assembly output for newAssembler.py.
+#
+#   Calling convention:
+#       arguments in REP, REQ, ... (at most 11), the result in ACC
+#       the caller saves the registers and spill slots live across the call
+#       on the stack, SP points to the next free word and grows upwards
+#       like CALL/RTS use it
+#
+#   The instruction set has no register indirect addressing, so pointer
+#   loads and stores write the address into the operand word of the
+#   following `ldi`/`str` (the program runs from RAM).
+#   Immediate values are stored through REA/REB, the microcode has no
+#   `str #n, address`.
+#
+#   Comparisons subtract and test the flags: zero for == and !=, carry
+#   (set when there was no borrow) for the others, so they are unsigned.
+#
+
+from c_ir import is_register, uses
+from c_parser import CompileError
+from c_regalloc import REGISTERS, allocate
+
+STACK_BASE = 0xf001     # SYSTEM_MEM
+PATCHED = "0x0000"      # operand written at run time
+
+MNEMONICS = {"+": "add", "-": "sub", "*": "mul", "/": "div", "&": "and", "|": "or", "^": "xor"}
+
+# branch condition: (swap the operands of the subtraction, flag jump, jump target when the flag is set)
+BRANCHES = {
+    "==": (False, "jpz", True),
+    "!=": (False, "jpz", False),
+    "<":  (False, "jpc", False),
+    ">=": (False, "jpc", True),
+    ">":  (True, "jpc", False),
+    "<=": (True, "jpc", True),
+}
+
+def function_label(name):
+    return "_" + name
+
+def immediate(value):
+    return "#{}".format(value)
+
+def address(value):
+    return "0x{:04x}".format(value)
+
+class FunctionGenerator:
+    def __init__(self, function, layout):
+        self.function = function
+        self.lines = []
+        self.patches = 0
+        self.allocation = allocate(function.code,
+            lambda register: layout.allocate("{}.spill.{}".format(function.name, register)))
+        self.used = set()
+        self.use_counts = {}
+        for instruction in function.code:
+            self.used.update(uses(instruction))
+            for register in uses(instruction):
+                self.use_counts[register] = self.use_counts.get(register, 0) + 1
+        self.in_acc = None      # virtual register whose value was left in ACC
+
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    def label(self, name):
+        self.lines.append(":" + name)
+
+    def patch_label(self):
+        self.patches += 1
+        return "{}.patch{}".format(self.function.name, self.patches)
+
+    def register(self, register):
+        return self.allocation.registers.get(register)
+
+    def slot(self, register):
+        return self.allocation.spilled.get(register)
+
+    # Moves an operand (constant or virtual register) into a machine register.
+    def load(self, target, operand):
+        if operand == self.in_acc:
+            if target != "ACC":
+                self.emit("mov {}, ACC".format(target))
+        elif not is_register(operand):
+            self.emit("ldi {}, {}".format(target, immediate(operand)))
+        elif self.register(operand) is not None:
+            if self.register(operand) != target:
+                self.emit("mov {}, {}".format(target, self.register(operand)))
+        else:
+            self.emit("ldi {}, [{}]".format(target, address(self.slot(operand))))
+
+    # Stores a machine register into a virtual register.
+    def store(self, register, source):
+        if self.register(register) is not None:
+            if self.register(register) != source:
+                self.emit("mov {}, {}".format(self.register(register), source))
+        else:
+            self.emit("str {}, {}".format(source, address(self.slot(register))))
+
+    # Machine register holding the operand, loads it into `scratch` if needed.
+    def operand(self, operand, scratch):
+        if is_register(operand) and self.register(operand) is not None:
+            return self.register(operand)
+        self.load(scratch, operand)
+        return scratch
+
+    #
+    #   Parallel moves
+    #
+
+    # Performs the moves {target register: source register} as if all at once.
+    def parallel_move(self, moves):
+        moves = {target: source for target, source in moves.items() if target != source}
+        while moves:
+            ready = [target for target in moves if target not in moves.values()]
+            if ready:
+                target = ready[0]
+                self.emit("mov {}, {}".format(target, moves.pop(target)))
+                continue
+            # a cycle, one source goes through REA
+            target, source = next(iter(moves.items()))
+            self.emit("mov REA, {}".format(source))
+            for other in moves:
+                if moves[other] == source:
+                    moves[other] = "REA"
+
+    #
+    #   Stack
+    #
+
+    # Points the operand word of the instruction at `label` to SP + offset.
+    def patch_stack_address(self, label, offset, word):
+        if offset == 0:
+            self.emit("str SP, {}+{}".format(label, word))
+        else:
+            self.emit("mov REA, SP")
+            self.emit("ldi REB, {}".format(immediate(offset)))
+            self.emit("add")
+            self.emit("str ACC, {}+{}".format(label, word))
+
+    def adjust_stack(self, op, count):
+        self.emit("mov REA, SP")
+        self.emit("ldi REB, {}".format(immediate(count)))
+        self.emit(op)
+        self.emit("mov SP, ACC")
+
+    # Saves registers and spill slots (given as ("register", name) or ("slot", address)).
+    def push(self, items):
+        for offset, (kind, value) in enumerate(items):
+            label = self.patch_label()
+            self.patch_stack_address(label, offset, 1)
+            if kind == "slot":
+                self.emit("ldi REB, [{}]".format(address(value)))
+                value = "REB"
+            self.label(label)
+            self.emit("str {}, {}".format(value, PATCHED))
+        if items:
+            self.adjust_stack("add", len(items))
+
+    def pop(self, items):
+        if not items:
+            return
+        self.adjust_stack("sub", len(items))
+        for offset, (kind, value) in enumerate(items):
+            label = self.patch_label()
+            self.patch_stack_address(label, offset, 1)
+            self.label(label)
+            if kind == "slot":
+                self.emit("ldi REB, [{}]".format(PATCHED))
+                self.emit("str REB, {}".format(address(value)))
+            else:
+                self.emit("ldi {}, [{}]".format(value, PATCHED))
+
+    #
+    #   Instructions
+    #
+
+    def generate(self):
+        self.label(function_label(self.function.name))
+        code = self.function.code
+        self.parameters([instruction for instruction in code if instruction[0] == "param"])
+        for position, instruction in enumerate(code):
+            following = code[position + 1] if position + 1 < len(code) else None
+            getattr(self, "generate_" + instruction[0])(position, instruction, following)
+        return self.lines
+
+    # Moves the arguments from REP, REQ, ... to the registers they were given.
+    def parameters(self, parameters):
+        moves = {}
+        for _kind, register, index in parameters:
+            if register not in self.used:
+                continue
+            if self.register(register) is None:
+                self.emit("str {}, {}".format(REGISTERS[index], address(self.slot(register))))
+            else:
+                moves[self.register(register)] = REGISTERS[index]
+        self.parallel_move(moves)
+
+    def generate_param(self, _position, _instruction, _following):
+        pass
+
+    def generate_label(self, _position, instruction, _following):
+        self.label(instruction[1])
+
+    def generate_const(self, _position, instruction, _following):
+        _kind, register, value = instruction
+        if self.register(register) is not None:
+            self.emit("ldi {}, {}".format(self.register(register), immediate(value)))
+        else:
+            self.store(register, self.operand(value, "REA"))
+
+    def generate_mov(self, _position, instruction, _following):
+        _kind, register, source = instruction
+        if self.register(register) is not None:
+            self.load(self.register(register), source)
+        else:
+            self.store(register, self.operand(source, "REA"))
+
+    def generate_bin(self, _position, instruction, following):
+        _kind, op, register, left, right = instruction
+        self.load("REA", left)
+        self.load("REB", right)
+        self.emit(MNEMONICS[op])
+        if self.stays_in_acc(register, following):
+            self.in_acc = register
+        else:
+            self.store(register, "ACC")
+
+    # Whether a result can stay in ACC: it is only read by the next
+    # instruction, which loads its operands before touching ACC.
+    def stays_in_acc(self, register, following):
+        return (following is not None and following[0] in ("bin", "branch", "mov", "ret")
+            and self.use_counts.get(register) == 1 and register in uses(following))
+
+    def generate_load(self, _position, instruction, _following):
+        _kind, register, source = instruction
+        target = self.register(register) or "REA"
+        if is_register(source):
+            label = self.patch_label()
+            self.emit("str {}, {}+1".format(self.operand(source, "REA"), label))
+            self.label(label)
+            self.emit("ldi {}, [{}]".format(target, PATCHED))
+        else:
+            self.emit("ldi {}, [{}]".format(target, address(source)))
+        if self.register(register) is None:
+            self.store(register, target)
+
+    def generate_store(self, _position, instruction, _following):
+        _kind, target, value = instruction
+        value = self.operand(value, "REB")
+
+        if is_register(target):
+            label = self.patch_label()
+            self.emit("str {}, {}+1".format(self.operand(target, "REA"), label))
+            self.label(label)
+            self.emit("str {}, {}".format(value, PATCHED))
+        else:
+            self.emit("str {}, {}".format(value, address(target)))
+
+    def generate_read(self, _position, instruction, _following):
+        _kind, register, port = instruction
+        target = self.register(register) or "REA"
+        self.emit("mov {}, EP{:X}".format(target, port))
+        self.store(register, target)
+
+    def generate_write(self, _position, instruction, _following):
+        _kind, port, value = instruction
+        self.load("EP{:X}".format(port), value)
+
+    def generate_call(self, position, instruction, _following):
+        _kind, register, name, arguments = instruction
+        saved = []
+        for other in sorted(self.allocation.live_across(position)):
+            if self.register(other) is not None:
+                saved.append(("register", self.register(other)))
+            else:
+                saved.append(("slot", self.slot(other)))
+        saved.sort()
+        self.push(saved)
+
+        if len(arguments) > len(REGISTERS):
+            raise CompileError("'{}' takes more than {} arguments".format(name, len(REGISTERS)))
+        moves = {}
+        for index, argument in enumerate(arguments):
+            if is_register(argument) and self.register(argument) is not None:
+                moves[REGISTERS[index]] = self.register(argument)
+        self.parallel_move(moves)
+        for index, argument in enumerate(arguments):
+            if not is_register(argument) or self.register(argument) is None:
+                self.load(REGISTERS[index], argument)
+
+        self.emit("call {}".format(function_label(name)))
+        if register is not None and register in self.used:
+            self.store(register, "ACC")
+        self.pop(saved)
+
+    def generate_ret(self, _position, instruction, _following):
+        if instruction[1] is not None:
+            self.load("ACC", instruction[1])
+        self.emit("rts")
+
+    def generate_jump(self, _position, instruction, following):
+        if following != ("label", instruction[1]):
+            self.emit("jp {}".format(instruction[1]))
+
+    def generate_branch(self, _position, instruction, following):
+        _kind, condition, left, right, true, false = instruction
+        swap, jump, on_true = BRANCHES[condition]
+        if swap:
+            left, right = right, left
+        self.load("REA", left)
+        self.load("REB", right)
+        self.emit("sub")
+        self.emit("{} {}".format(jump, true if on_true else false))
+        # only the jump without a flag can fall through
+        other = false if on_true else true
+        if following != ("label", other):
+            self.emit("jp {}".format(other))
+
+# Generates the program: start code, global initial values and the functions.
+def generate(functions, layout, initial):
+    lines = ["; generated by mini_c.py", ";"]
+    generators = [FunctionGenerator(function, layout) for function in functions]
+    for name, location, size in layout.symbols:
+        lines.append("; {} {}{}".format(address(location), name, "[{}]".format(size) if size > 1 else ""))
+    lines.append("")
+
+    lines.append("    ldi SP, {}".format(address(STACK_BASE)))
+    for location, value in sorted(initial.items()):
+        if value:
+            lines.append("    ldi REA, {}".format(immediate(value)))
+            lines.append("    str REA, {}".format(address(location)))
+    lines.append("    call {}".format(function_label("main")))
+    lines.append("    halt")
+
+    for generator in generators:
+        lines.append("")
+        lines.extend(generator.generate())
+    return "\n".join(lines) + "\n"
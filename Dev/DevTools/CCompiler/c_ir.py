@@ -0,0 +1,533 @@
+#
+#   Intermediate code of the C compiler.
+#
+#   Every function is lowered to a list of instructions (tuples) working on
+#   an unlimited number of virtual registers. Operands are virtual registers
+#   (strings) or constants (ints).
+#       ("const", dest, value)          ("mov", dest, source)
+#       ("bin", op, dest, left, right)  op: + - * / & | ^
+#       ("load", dest, address)         ("store", address, source)
+#       ("read", dest, port)            ("write", port, source)
+#       ("param", dest, index)          ("call", dest or None, name, arguments)
+#       ("ret", source or None)
+#       ("label", name)                 ("jump", label)
+#       ("branch", cond, left, right, true label, false label)
+#                                       cond: == != < <= > >=
+#
+#   Globals, local arrays and locals whose address is taken live in
+#   VARIABLE_MEM, all other locals stay in virtual registers.
+#
+
+from c_parser import CompileError
+
+WORD_MASK = 0xFFFFFF
+VARIABLE_MEM = (0xa001, 0xd000)
+
+COMPARISONS = {"==", "!=", "<", "<=", ">", ">="}
+NEGATED = {"==": "!=", "!=": "==", "<": ">=", ">=": "<", ">": "<=", "<=": ">"}
+
+# instructions without side effects, removed when their result is unused
+PURE = {"const", "mov", "bin", "load"}
+TERMINATORS = {"jump", "branch", "ret"}
+
+# built-in functions: name -> number of arguments
+BUILTINS = {"port_read": 1, "port_write": 2}
+
+def is_register(operand):
+    return isinstance(operand, str)
+
+# Virtual registers read by an instruction.
+def uses(instruction):
+    kind = instruction[0]
+    if kind == "mov":
+        operands = [instruction[2]]
+    elif kind == "bin":
+        operands = [instruction[3], instruction[4]]
+    elif kind == "load":
+        operands = [instruction[2]]
+    elif kind == "store":
+        operands = [instruction[1], instruction[2]]
+    elif kind == "write":
+        operands = [instruction[2]]
+    elif kind == "call":
+        operands = instruction[3]
+    elif kind == "ret":
+        operands = [instruction[1]]
+    elif kind == "branch":
+        operands = [instruction[2], instruction[3]]
+    else:
+        operands = []
+    return [operand for operand in operands if is_register(operand)]
+
+# Virtual register written by an instruction, or None.
+def definition(instruction):
+    kind = instruction[0]
+    if kind in ("const", "mov", "load", "read", "param", "call"):
+        return instruction[1]
+    if kind == "bin":
+        return instruction[2]
+    return None
+
+# Labels an instruction may continue at, None stands for the next instruction.
+def successors(instruction):
+    kind = instruction[0]
+    if kind == "jump":
+        return [instruction[1]]
+    if kind == "branch":
+        return [instruction[4], instruction[5]]
+    if kind == "ret":
+        return []
+    return [None]
+
+# Computes `left op right` on 24-bit words, comparisons give 0 or 1.
+# Comparisons are unsigned like the carry flag the hardware compares with.
+def evaluate(op, left, right):
+    if op == "+":
+        value = left + right
+    elif op == "-":
+        value = left - right
+    elif op == "*":
+        value = left * right
+    elif op in ("/", "%"):
+        if right == 0:
+            return None
+        value = left // right if op == "/" else left % right
+    elif op == "&":
+        value = left & right
+    elif op == "|":
+        value = left | right
+    elif op == "^":
+        value = left ^ right
+    elif op == "<<":
+        value = left << right if right < 24 else 0
+    elif op == ">>":
+        value = left >> right
+    elif op == "==":
+        value = int(left == right)
+    elif op == "!=":
+        value = int(left != right)
+    elif op == "<":
+        value = int(left < right)
+    elif op == "<=":
+        value = int(left <= right)
+    elif op == ">":
+        value = int(left > right)
+    elif op == ">=":
+        value = int(left >= right)
+    else:
+        return None
+    return value & WORD_MASK
+
+class Function:
+    def __init__(self, name, parameters):
+        self.name = name
+        self.parameters = parameters
+        self.code = []
+
+# Addresses of everything living in VARIABLE_MEM.
+class Layout:
+    def __init__(self):
+        self.next = VARIABLE_MEM[0]
+        self.symbols = []   # (name, address, size)
+
+    def allocate(self, name, size = 1):
+        address = self.next
+        if address + size - 1 > VARIABLE_MEM[1]:
+            raise CompileError("VARIABLE_MEM is full, '{}' does not fit".format(name))
+        self.next += size
+        self.symbols.append((name, address, size))
+        return address
+
+#
+#   Lowering
+#
+
+# Names of the locals whose address is taken somewhere in `node`.
+def addressed_names(node, names = None):
+    if names is None:
+        names = set()
+    if isinstance(node, tuple):
+        if node[0] == "address" and node[1][0] == "var":
+            names.add(node[1][1])
+        for child in node[1:]:
+            addressed_names(child, names)
+    elif isinstance(node, list):
+        for child in node:
+            addressed_names(child, names)
+    return names
+
+class Lowering:
+    def __init__(self, layout, globals, functions):
+        self.layout = layout
+        self.globals = globals          # name: ("memory" | "array", address)
+        self.functions = functions      # name: parameter count
+
+    def function(self, name, parameters, body):
+        self.function_name = name
+        self.code = []
+        self.scopes = [{}]
+        self.loops = []
+        self.temps = 0
+        self.labels = 0
+        self.addressed = addressed_names(body)
+
+        function = Function(name, [])
+        copies = []
+        for index, parameter in enumerate(parameters):
+            symbol = self.new_variable(parameter)
+            register = symbol[1] if symbol[0] == "register" else self.temp()
+            if symbol[0] == "memory":
+                # parameters arrive in registers, addressed ones are copied to memory
+                copies.append((symbol[1], register))
+            self.emit("param", register, index)
+            function.parameters.append(register)
+        for address, register in copies:
+            self.emit("store", address, register)
+        self.statement(body)
+        self.emit("ret", None)
+        function.code = self.code
+        return function
+
+    def emit(self, *instruction):
+        self.code.append(instruction)
+
+    def temp(self):
+        self.temps += 1
+        return "t{}".format(self.temps)
+
+    def label(self, hint):
+        self.labels += 1
+        return "{}.{}{}".format(self.function_name, hint, self.labels)
+
+    # Declares a local, returns its symbol: ("register", virtual register),
+    # ("memory", address) or ("array", address).
+    def new_variable(self, name, size = None):
+        if size is not None:
+            symbol = ("array", self.layout.allocate("{}.{}".format(self.function_name, name), size))
+        elif name in self.addressed:
+            symbol = ("memory", self.layout.allocate("{}.{}".format(self.function_name, name)))
+        else:
+            self.temps += 1
+            symbol = ("register", "{}.{}".format(name, self.temps))
+        if name in self.scopes[-1]:
+            raise CompileError("'{}' declared twice".format(name))
+        self.scopes[-1][name] = symbol
+        return symbol
+
+    def lookup(self, name, line):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        if name in self.globals:
+            return self.globals[name]
+        raise CompileError("unknown variable '{}'".format(name), line)
+
+    #
+    #   Statements
+    #
+
+    def statement(self, node):
+        kind = node[0]
+
+        if kind == "block":
+            self.scopes.append({})
+            for statement in node[1]:
+                self.statement(statement)
+            self.scopes.pop()
+
+        elif kind == "decl":
+            for name, size, initializer in node[1]:
+                if initializer is not None and size is None:
+                    # the initializer can not see the new variable
+                    value = self.expression(initializer)
+                symbol = self.new_variable(name, size)
+                if size is not None:
+                    for index, value in enumerate(initializer or []):
+                        self.emit("store", symbol[1] + index, self.expression(value))
+                elif initializer is not None:
+                    if symbol[0] == "memory":
+                        self.emit("store", symbol[1], value)
+                    else:
+                        self.emit("mov", symbol[1], value)
+
+        elif kind == "expr":
+            self.expression(node[1])
+
+        elif kind == "if":
+            then, otherwise, end = self.label("then"), self.label("else"), self.label("endif")
+            self.condition(node[1], then, otherwise if node[3] is not None else end)
+            self.emit("label", then)
+            self.statement(node[2])
+            if node[3] is not None:
+                self.emit("jump", end)
+                self.emit("label", otherwise)
+                self.statement(node[3])
+            self.emit("label", end)
+
+        elif kind == "while":
+            self.loop(node[1], None, node[2])
+
+        elif kind == "for":
+            self.scopes.append({})
+            if node[1] is not None:
+                self.statement(node[1])
+            self.loop(node[2], node[3], node[4])
+            self.scopes.pop()
+
+        elif kind == "return":
+            self.emit("ret", None if node[1] is None else self.expression(node[1]))
+
+        elif kind in ("break", "continue"):
+            if not self.loops:
+                raise CompileError("'{}' outside of a loop".format(kind))
+            self.emit("jump", self.loops[-1][0 if kind == "break" else 1])
+
+        else:
+            raise CompileError("unknown statement '{}'".format(kind))
+
+    # Lowers a loop with the condition at the bottom, so every iteration
+    # takes a single branch.
+    def loop(self, condition, step, body):
+        start, next, test, end = self.label("loop"), self.label("next"), self.label("test"), self.label("endloop")
+        self.emit("jump", test)
+        self.emit("label", start)
+        self.loops.append((end, next))
+        self.statement(body)
+        self.loops.pop()
+        self.emit("label", next)
+        if step is not None:
+            self.expression(step)
+        self.emit("label", test)
+        if condition is None:
+            self.emit("jump", start)
+        else:
+            self.condition(condition, start, end)
+        self.emit("label", end)
+
+    # Lowers a condition to branches to `true` or `false`, && and || short-circuit.
+    def condition(self, node, true, false):
+        kind = node[0]
+        if kind == "and":
+            middle = self.label("and")
+            self.condition(node[1], middle, false)
+            self.emit("label", middle)
+            self.condition(node[2], true, false)
+        elif kind == "or":
+            middle = self.label("or")
+            self.condition(node[1], true, middle)
+            self.emit("label", middle)
+            self.condition(node[2], true, false)
+        elif kind == "unary" and node[1] == "!":
+            self.condition(node[2], false, true)
+        elif kind == "binary" and node[1] in COMPARISONS:
+            left = self.expression(node[2])
+            right = self.expression(node[3])
+            self.emit("branch", node[1], left, right, true, false)
+        elif kind == "num":
+            self.emit("jump", true if node[1] & WORD_MASK else false)
+        else:
+            self.emit("branch", "!=", self.expression(node), 0, true, false)
+
+    #
+    #   Expressions
+    #
+
+    def binary(self, op, left, right):
+        if op == "%":
+            quotient = self.binary("/", left, right)
+            return self.binary("-", left, self.binary("*", quotient, right))
+        if op in ("<<", ">>"):
+            if not isinstance(right, int):
+                raise CompileError("shifting by a variable amount is not supported")
+            if right >= 24:
+                return 0
+            return self.binary("*" if op == "<<" else "/", left, 1 << right)
+        destination = self.temp()
+        self.emit("bin", op, destination, left, right)
+        return destination
+
+    # Lowers a condition used as a value to 0 or 1.
+    def boolean(self, node):
+        destination = self.temp()
+        true, false, end = self.label("true"), self.label("false"), self.label("endbool")
+        self.condition(node, true, false)
+        self.emit("label", true)
+        self.emit("const", destination, 1)
+        self.emit("jump", end)
+        self.emit("label", false)
+        self.emit("const", destination, 0)
+        self.emit("label", end)
+        return destination
+
+    def load(self, address):
+        destination = self.temp()
+        self.emit("load", destination, address)
+        return destination
+
+    # Address of a memory lvalue, or None for a local held in a register.
+    def address(self, node):
+        kind = node[0]
+        if kind == "var":
+            symbol = self.lookup(node[1], node[2])
+            if symbol[0] == "register":
+                return None
+            return symbol[1]
+        if kind == "index":
+            return self.binary("+", self.expression(node[1]), self.expression(node[2]))
+        if kind == "deref":
+            return self.expression(node[1])
+        raise CompileError("expression is not assignable")
+
+    def expression(self, node):
+        kind = node[0]
+
+        if kind == "num":
+            return node[1] & WORD_MASK
+
+        if kind == "var":
+            symbol = self.lookup(node[1], node[2])
+            if symbol[0] == "register":
+                return symbol[1]
+            if symbol[0] == "array":
+                return symbol[1]        # arrays decay to their address
+            return self.load(symbol[1])
+
+        if kind == "unary":
+            operand = self.expression(node[2]) if node[1] != "!" else None
+            if node[1] == "-":
+                return self.binary("-", 0, operand)
+            if node[1] == "~":
+                return self.binary("^", operand, WORD_MASK)
+            return self.boolean(node)
+
+        if kind == "binary":
+            if node[1] in COMPARISONS:
+                return self.boolean(node)
+            return self.binary(node[1], self.expression(node[2]), self.expression(node[3]))
+
+        if kind in ("and", "or"):
+            return self.boolean(node)
+
+        if kind == "assign":
+            address = self.address(node[1])
+            value = self.expression(node[2])
+            return self.assign(node[1], address, value)
+
+        if kind == "compound":
+            address = self.address(node[2])
+            current = self.current(node[2], address)
+            value = self.binary(node[1], current, self.expression(node[3]))
+            return self.assign(node[2], address, value)
+
+        if kind == "incdec":
+            address = self.address(node[3])
+            current = self.current(node[3], address)
+            if not node[2] and address is None:
+                # the variable's register changes, the old value is kept in a copy
+                old = self.temp()
+                self.emit("mov", old, current)
+                current = old
+            value = self.binary("+" if node[1] == "++" else "-", current, 1)
+            self.assign(node[3], address, value)
+            return value if node[2] else current
+
+        if kind == "index":
+            return self.load(self.address(node))
+
+        if kind == "deref":
+            return self.load(self.expression(node[1]))
+
+        if kind == "address":
+            address = self.address(node[1])
+            if address is None:
+                raise CompileError("can not take the address of '{}'".format(node[1][1]))
+            return address
+
+        if kind == "call":
+            return self.call(node[1], node[2], node[3])
+
+        raise CompileError("unknown expression '{}'".format(kind))
+
+    # Value of an lvalue whose address (or None for registers) is known.
+    def current(self, node, address):
+        if address is None:
+            return self.lookup(node[1], node[2])[1]
+        return self.load(address)
+
+    def assign(self, node, address, value):
+        if address is None:
+            register = self.lookup(node[1], node[2])[1]
+            self.emit("mov", register, value)
+            return register
+        self.emit("store", address, value)
+        return value
+
+    def call(self, name, arguments, line):
+        count = BUILTINS.get(name, self.functions.get(name))
+        if count is None:
+            raise CompileError("unknown function '{}'".format(name), line)
+        if count != len(arguments):
+            raise CompileError("'{}' takes {} arguments".format(name, count), line)
+
+        if name in BUILTINS:
+            port = arguments[0]
+            if port[0] != "num" or not 0 <= port[1] < 16:
+                raise CompileError("the port of '{}' has to be a number from 0 to 15".format(name), line)
+            if name == "port_read":
+                destination = self.temp()
+                self.emit("read", destination, port[1])
+                return destination
+            self.emit("write", port[1], self.expression(arguments[1]))
+            return 0
+
+        values = [self.expression(argument) for argument in arguments]
+        destination = self.temp()
+        self.emit("call", destination, name, values)
+        return destination
+
+# Lowers the parsed program, returns [functions, layout, initial values {address: value}].
+def lower(program):
+    layout = Layout()
+    globals = {}
+    functions = {}
+    initial = {}
+
+    for item in program:
+        if item[0] == "function":
+            if item[1] in functions or item[1] in BUILTINS:
+                raise CompileError("function '{}' defined twice".format(item[1]))
+            functions[item[1]] = len(item[2])
+    if "main" not in functions:
+        raise CompileError("no 'main' function")
+
+    for item in program:
+        if item[0] != "global":
+            continue
+        _kind, name, size, initializer = item
+        if name in globals:
+            raise CompileError("global '{}' defined twice".format(name))
+        address = layout.allocate(name, size or 1)
+        globals[name] = ("array" if size else "memory", address)
+
+        values = initializer if size else [initializer] if initializer is not None else []
+        for index, value in enumerate(values):
+            if value[0] != "num":
+                raise CompileError("the initializer of '{}' is not constant".format(name))
+            initial[address + index] = value[1] & WORD_MASK
+
+    lowering = Lowering(layout, globals, functions)
+    result = []
+    for item in program:
+        if item[0] == "function":
+            result.append(lowering.function(item[1], item[2], item[3]))
+    return [result, layout, initial]
+
+# Formats the code of a function for reading.
+def format_function(function):
+    lines = ["{}({}):".format(function.name, ", ".join(function.parameters))]
+    for instruction in function.code:
+        if instruction[0] == "label":
+            lines.append(instruction[1] + ":")
+        else:
+            lines.append("    " + " ".join(str(part) for part in instruction))
+    return "\n".join(lines)
@@ -0,0 +1,388 @@
+#
+#   Optimization passes of the C compiler.
+#
+#   fold_program      constant folding and algebraic simplification on the
+#                     syntax tree, `if`/`while` on constants lose their dead arm
+#   propagate_constants
+#                     replaces virtual registers holding known constants by
+#                     the constant, folds the instructions that become
+#                     constant and turns constant branches into jumps
+#   eliminate_dead_code
+#                     removes unreachable code, jumps to the next
+#                     instruction, unused labels and instructions whose
+#                     result is never used
+#   coalesce_copies   writes results straight into the register they are
+#                     copied to when the copy is their only use
+#
+
+from c_ir import PURE, TERMINATORS, WORD_MASK, definition, evaluate, is_register, successors, uses
+
+#
+#   Syntax tree
+#
+
+# Whether evaluating the expression can change anything.
+def has_side_effects(node):
+    if not isinstance(node, tuple):
+        return False
+    if node[0] in ("assign", "compound", "incdec", "call"):
+        return True
+    return any(has_side_effects(child) for child in node[1:] if isinstance(child, (tuple, list)))
+
+def is_number(node, value = None):
+    return node[0] == "num" and (value is None or node[1] & WORD_MASK == value)
+
+def fold_expression(node):
+    kind = node[0]
+    if kind in ("num", "var"):
+        return node
+
+    if kind == "binary":
+        op = node[1]
+        left, right = fold_expression(node[2]), fold_expression(node[3])
+        if is_number(left) and is_number(right):
+            value = evaluate(op, left[1] & WORD_MASK, right[1] & WORD_MASK)
+            if value is not None:
+                return ("num", value)
+        # x + 0, x - 0, x | 0, x ^ 0, x << 0, x >> 0, x * 1, x / 1
+        if is_number(right, 0) and op in ("+", "-", "|", "^", "<<", ">>"):
+            return left
+        if is_number(left, 0) and op in ("+", "|", "^"):
+            return right
+        if is_number(right, 1) and op in ("*", "/"):
+            return left
+        if is_number(left, 1) and op == "*":
+            return right
+        if op in ("*", "&") and (is_number(left, 0) and not has_side_effects(right)
+                or is_number(right, 0) and not has_side_effects(left)):
+            return ("num", 0)
+        return ("binary", op, left, right)
+
+    if kind == "unary":
+        operand = fold_expression(node[2])
+        if is_number(operand):
+            value = operand[1] & WORD_MASK
+            if node[1] == "-":
+                return ("num", -value & WORD_MASK)
+            if node[1] == "~":
+                return ("num", ~value & WORD_MASK)
+            return ("num", int(value == 0))
+        return ("unary", node[1], operand)
+
+    if kind in ("and", "or"):
+        left, right = fold_expression(node[1]), fold_expression(node[2])
+        if is_number(left):
+            decided = bool(left[1] & WORD_MASK) == (kind == "or")
+            if decided:
+                return ("num", int(kind == "or"))
+            if is_number(right):
+                return ("num", int(bool(right[1] & WORD_MASK)))
+            return ("binary", "!=", right, ("num", 0))
+        return (kind, left, right)
+
+    if kind == "assign":
+        return ("assign", fold_expression(node[1]), fold_expression(node[2]))
+    if kind == "compound":
+        return ("compound", node[1], fold_expression(node[2]), fold_expression(node[3]))
+    if kind == "incdec":
+        return ("incdec", node[1], node[2], fold_expression(node[3]))
+    if kind == "call":
+        return ("call", node[1], [fold_expression(argument) for argument in node[2]], node[3])
+    if kind == "index":
+        return ("index", fold_expression(node[1]), fold_expression(node[2]))
+    if kind in ("deref", "address"):
+        return (kind, fold_expression(node[1]))
+    return node
+
+def fold_statement(node):
+    if node is None:
+        return None
+    kind = node[0]
+
+    if kind == "block":
+        return ("block", [fold_statement(statement) for statement in node[1]])
+    if kind == "decl":
+        return ("decl", [(name, size, fold_initializer(initializer)) for name, size, initializer in node[1]])
+    if kind == "expr":
+        return ("expr", fold_expression(node[1]))
+    if kind == "return":
+        return ("return", None if node[1] is None else fold_expression(node[1]))
+
+    if kind == "if":
+        condition = fold_expression(node[1])
+        if is_number(condition):
+            taken = node[2] if condition[1] & WORD_MASK else node[3]
+            return fold_statement(taken) if taken is not None else ("block", [])
+        return ("if", condition, fold_statement(node[2]), fold_statement(node[3]))
+
+    if kind == "while":
+        condition = fold_expression(node[1])
+        if is_number(condition, 0):
+            return ("block", [])
+        return ("while", condition, fold_statement(node[2]))
+
+    if kind == "for":
+        condition = None if node[2] is None else fold_expression(node[2])
+        if condition is not None and is_number(condition) and condition[1] & WORD_MASK:
+            condition = None
+        step = None if node[3] is None else fold_expression(node[3])
+        return ("for", fold_statement(node[1]), condition, step, fold_statement(node[4]))
+
+    return node
+
+def fold_initializer(initializer):
+    if initializer is None:
+        return None
+    if isinstance(initializer, list):
+        return [fold_expression(value) for value in initializer]
+    return fold_expression(initializer)
+
+def fold_program(program):
+    result = []
+    for item in program:
+        if item[0] == "function":
+            result.append(("function", item[1], item[2], fold_statement(item[3])))
+        else:
+            result.append(("global", item[1], item[2], fold_initializer(item[3])))
+    return result
+
+#
+#   Intermediate code
+#
+
+# Replaces the operands found in `constants` ({register: value}).
+def substitute(instruction, constants):
+    def value(operand):
+        return constants.get(operand, operand) if is_register(operand) else operand
+
+    kind = instruction[0]
+    if kind == "mov":
+        return ("mov", instruction[1], value(instruction[2]))
+    if kind == "bin":
+        return ("bin", instruction[1], instruction[2], value(instruction[3]), value(instruction[4]))
+    if kind == "load":
+        return ("load", instruction[1], value(instruction[2]))
+    if kind == "store":
+        return ("store", value(instruction[1]), value(instruction[2]))
+    if kind == "write":
+        return ("write", instruction[1], value(instruction[2]))
+    if kind == "call":
+        return ("call", instruction[1], instruction[2], [value(argument) for argument in instruction[3]])
+    if kind == "ret":
+        return ("ret", value(instruction[1]))
+    if kind == "branch":
+        return ("branch", instruction[1], value(instruction[2]), value(instruction[3]), instruction[4], instruction[5])
+    return instruction
+
+# Folds an instruction whose operands are constant or trivial.
+def simplify(instruction):
+    kind = instruction[0]
+    if kind == "mov" and not is_register(instruction[2]):
+        return ("const", instruction[1], instruction[2])
+
+    if kind == "bin":
+        op, destination, left, right = instruction[1:]
+        if not is_register(left) and not is_register(right):
+            value = evaluate(op, left, right)
+            if value is not None:
+                return ("const", destination, value)
+        if right == 0 and op in ("+", "-", "|", "^") or right == 1 and op in ("*", "/"):
+            return ("mov", destination, left)
+        if left == 0 and op in ("+", "|", "^") or left == 1 and op == "*":
+            return ("mov", destination, right)
+        if (left == 0 or right == 0) and op in ("*", "&"):
+            return ("const", destination, 0)
+
+    if kind == "branch" and not is_register(instruction[2]) and not is_register(instruction[3]):
+        taken = evaluate(instruction[1], instruction[2], instruction[3])
+        return ("jump", instruction[4] if taken else instruction[5])
+
+    return instruction
+
+def propagate_constants(code):
+    changed = True
+    while changed:
+        changed = False
+
+        # registers written exactly once, by a constant, hold it everywhere
+        definitions = {}
+        for instruction in code:
+            register = definition(instruction)
+            if register is not None:
+                definitions[register] = definitions.get(register, 0) + 1
+        constants = {instruction[1]: instruction[2] for instruction in code
+            if instruction[0] == "const" and definitions[instruction[1]] == 1}
+
+        result = []
+        local = {}
+        for instruction in code:
+            if instruction[0] == "label":
+                local = {}      # other paths may join here
+            known = dict(constants)
+            known.update(local)
+            new = simplify(substitute(instruction, known))
+            if new != instruction:
+                changed = True
+
+            register = definition(new)
+            if register is not None:
+                local.pop(register, None)
+                if new[0] == "const":
+                    local[register] = new[2]
+            result.append(new)
+        code = result
+    return code
+
+# Splits the code into basic blocks, returns a list of [label or None, instructions].
+def basic_blocks(code):
+    blocks = []
+    current = None
+    for instruction in code:
+        if instruction[0] == "label" or current is None:
+            current = [instruction[1] if instruction[0] == "label" else None, []]
+            blocks.append(current)
+            if instruction[0] == "label":
+                continue
+        current[1].append(instruction)
+        if instruction[0] in TERMINATORS:
+            current = None
+    return blocks
+
+# Labels (or the index of the next block) every block can continue at.
+def block_successors(blocks):
+    index_of = {block[0]: i for i, block in enumerate(blocks) if block[0] is not None}
+    result = []
+    for i, (_label, instructions) in enumerate(blocks):
+        last = instructions[-1] if instructions else ("label",)
+        targets = []
+        for target in successors(last):
+            if target is None:
+                if i + 1 < len(blocks):
+                    targets.append(i + 1)
+            else:
+                targets.append(index_of[target])
+        result.append(targets)
+    return result
+
+# Virtual registers live at the start and end of every block.
+def liveness(blocks, successors_of):
+    gen = []
+    kill = []
+    for _label, instructions in blocks:
+        used = set()
+        defined = set()
+        for instruction in instructions:
+            used.update(register for register in uses(instruction) if register not in defined)
+            register = definition(instruction)
+            if register is not None:
+                defined.add(register)
+        gen.append(used)
+        kill.append(defined)
+
+    live_in = [set() for _ in blocks]
+    live_out = [set() for _ in blocks]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(blocks))):
+            out = set()
+            for successor in successors_of[i]:
+                out |= live_in[successor]
+            new_in = gen[i] | (out - kill[i])
+            if out != live_out[i] or new_in != live_in[i]:
+                live_out[i] = out
+                live_in[i] = new_in
+                changed = True
+    return live_in, live_out
+
+def flatten(blocks):
+    code = []
+    for label, instructions in blocks:
+        if label is not None:
+            code.append(("label", label))
+        code.extend(instructions)
+    return code
+
+def remove_unreachable(blocks):
+    successors_of = block_successors(blocks)
+    reachable = set()
+    pending = [0]
+    while pending:
+        i = pending.pop()
+        if i in reachable or i >= len(blocks):
+            continue
+        reachable.add(i)
+        pending.extend(successors_of[i])
+    return [block for i, block in enumerate(blocks) if i in reachable]
+
+def remove_dead_instructions(blocks):
+    successors_of = block_successors(blocks)
+    _live_in, live_out = liveness(blocks, successors_of)
+    result = []
+    for i, (label, instructions) in enumerate(blocks):
+        live = set(live_out[i])
+        kept = []
+        for instruction in reversed(instructions):
+            register = definition(instruction)
+            if instruction[0] in PURE and register not in live:
+                continue
+            if instruction[0] == "mov" and instruction[1] == instruction[2]:
+                continue
+            if register is not None:
+                live.discard(register)
+            live.update(uses(instruction))
+            kept.append(instruction)
+        result.append([label, kept[::-1]])
+    return result
+
+def eliminate_dead_code(code):
+    while True:
+        blocks = remove_dead_instructions(remove_unreachable(basic_blocks(code)))
+        new = flatten(blocks)
+
+        # jumps to the very next instruction
+        result = []
+        for i, instruction in enumerate(new):
+            if instruction[0] == "branch" and instruction[4] == instruction[5]:
+                instruction = ("jump", instruction[4])
+            if instruction[0] == "jump" and i + 1 < len(new) and new[i + 1] == ("label", instruction[1]):
+                continue
+            result.append(instruction)
+
+        referenced = set()
+        for instruction in result:
+            for target in successors(instruction):
+                referenced.add(target)
+        result = [instruction for instruction in result
+            if instruction[0] != "label" or instruction[1] in referenced]
+
+        if result == code:
+            return result
+        code = result
+
+# The instruction writing `register` instead of the register it writes.
+def redefine(instruction, register):
+    if instruction[0] == "bin":
+        return instruction[:2] + (register,) + instruction[3:]
+    return (instruction[0], register) + instruction[2:]
+
+# `x = op ...; mov y, x` becomes `y = op ...` when x is read nowhere else.
+def coalesce_copies(code):
+    use_counts = {}
+    for instruction in code:
+        for register in uses(instruction):
+            use_counts[register] = use_counts.get(register, 0) + 1
+
+    result = []
+    for instruction in code:
+        previous = result[-1] if result else None
+        if (instruction[0] == "mov" and is_register(instruction[2]) and previous is not None
+                and previous[0] in ("const", "mov", "bin", "load", "read", "call")
+                and definition(previous) == instruction[2] and use_counts[instruction[2]] == 1):
+            result[-1] = redefine(previous, instruction[1])
+            continue
+        result.append(instruction)
+    return result
+
+def optimize(function):
+    function.code = coalesce_copies(eliminate_dead_code(propagate_constants(function.code)))
@@ -0,0 +1,365 @@
+#
+#   Lexer and parser of the C subset.
+#
+#   Supported: int (one 24-bit word), pointers, one dimensional arrays,
+#   functions, if/else, while, for, break, continue, return and the usual
+#   operators except the ternary one. Memory is word addressed, so pointer
+#   arithmetic never scales.
+#
+#   The syntax tree is made of tuples, the first element names the node:
+#       ("num", value)              ("var", name, line)
+#       ("unary", op, operand)      ("binary", op, left, right)
+#       ("and", left, right)        ("or", left, right)
+#       ("assign", target, value)   ("compound", op, target, value)
+#       ("incdec", op, prefix, target)
+#       ("call", name, arguments, line)   ("index", base, index)
+#       ("deref", pointer)          ("address", lvalue)
+#
+#       ("decl", [(name, size or None, initializer)])
+#       ("if", condition, then, else)   ("while", condition, body)
+#       ("for", init, condition, step, body)
+#       ("return", value)   ("break",)   ("continue",)
+#       ("block", statements)   ("expr", expression)
+#
+#   A program is a list of ("global", name, size, initializer) and
+#   ("function", name, parameters, body).
+#
+
+import re
+
+class CompileError(Exception):
+    def __init__(self, message, line = None):
+        if line is not None:
+            message = "line {}: {}".format(line, message)
+        super().__init__(message)
+
+KEYWORDS = {"int", "void", "if", "else", "while", "for", "return", "break", "continue"}
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>[ \t\r]+|//[^\n]*|/\*.*?\*/)
+  | (?P<newline>\n)
+  | (?P<number>0[xX][0-9a-fA-F]+|\d+)
+  | (?P<char>'(?:\\.|[^\\'])')
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op><<=|>>=|<<|>>|<=|>=|==|!=|&&|\|\||\+\+|--|\+=|-=|\*=|/=|%=|&=|\|=|\^=|[-+*/%&|^~!<>=(){}\[\];,])
+""", re.VERBOSE | re.DOTALL)
+
+CHAR_ESCAPES = {"n": 10, "t": 9, "r": 13, "0": 0, "\\": 92, "'": 39}
+
+# Splits the source into (kind, value, line) tokens.
+def tokenize(source):
+    tokens = []
+    line = 1
+    position = 0
+    while position < len(source):
+        match = TOKEN_PATTERN.match(source, position)
+        if match is None:
+            raise CompileError("unexpected character '{}'".format(source[position]), line)
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "newline":
+            line += 1
+        elif kind == "space":
+            line += text.count("\n")
+        elif kind == "number":
+            tokens.append(("num", int(text, 0), line))
+        elif kind == "char":
+            body = text[1:-1]
+            if body[0] == "\\":
+                if body[1] not in CHAR_ESCAPES:
+                    raise CompileError("unknown escape '{}'".format(body), line)
+                value = CHAR_ESCAPES[body[1]]
+            else:
+                value = ord(body)
+            tokens.append(("num", value, line))
+        elif kind == "name" and text in KEYWORDS:
+            tokens.append((text, text, line))
+        else:
+            tokens.append((kind if kind == "name" else text, text, line))
+        position = match.end()
+    tokens.append(("eof", None, line))
+    return tokens
+
+# binary operators by precedence, lowest first
+BINARY_LEVELS = [
+    ["|"], ["^"], ["&"], ["==", "!="], ["<", ">", "<=", ">="], ["<<", ">>"], ["+", "-"], ["*", "/", "%"],
+]
+ASSIGNMENTS = {"=": None, "+=": "+", "-=": "-", "*=": "*", "/=": "/", "%=": "%",
+    "&=": "&", "|=": "|", "^=": "^", "<<=": "<<", ">>=": ">>"}
+
+class Parser:
+    def __init__(self, source):
+        self.tokens = tokenize(source)
+        self.position = 0
+
+    @property
+    def kind(self):
+        return self.tokens[self.position][0]
+
+    @property
+    def line(self):
+        return self.tokens[self.position][2]
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def accept(self, kind):
+        if self.kind == kind:
+            return self.next()
+        return None
+
+    def expect(self, kind):
+        if self.kind != kind:
+            found = self.tokens[self.position][1]
+            raise CompileError("expected '{}' but found '{}'".format(kind, "end of file" if found is None else found), self.line)
+        return self.next()
+
+    #
+    #   Declarations
+    #
+
+    def program(self):
+        items = []
+        while self.kind != "eof":
+            if self.accept("void"):
+                self.pointers()
+                items.append(self.function(self.expect("name")[1]))
+                continue
+
+            self.expect("int")
+            self.pointers()
+            name = self.expect("name")[1]
+            if self.kind == "(":
+                items.append(self.function(name))
+                continue
+
+            while True:
+                size = self.array_size()
+                initializer = None
+                if self.accept("="):
+                    initializer = self.initializer(size)
+                items.append(("global", name, size, initializer))
+                if not self.accept(","):
+                    break
+                self.pointers()
+                name = self.expect("name")[1]
+            self.expect(";")
+        return items
+
+    def pointers(self):
+        while self.accept("*"):
+            pass
+
+    def array_size(self):
+        if not self.accept("["):
+            return None
+        size = self.expect("num")[1]
+        self.expect("]")
+        if size <= 0:
+            raise CompileError("array size must be positive", self.line)
+        return size
+
+    def initializer(self, size):
+        if size is None:
+            return self.expression()
+        self.expect("{")
+        values = []
+        while self.kind != "}":
+            values.append(self.expression())
+            if not self.accept(","):
+                break
+        self.expect("}")
+        if len(values) > size:
+            raise CompileError("too many initializers", self.line)
+        return values
+
+    def function(self, name):
+        self.expect("(")
+        parameters = []
+        if self.kind == "void" and self.tokens[self.position + 1][0] == ")":
+            self.next()
+        while self.kind != ")":
+            self.expect("int")
+            self.pointers()
+            parameters.append(self.expect("name")[1])
+            if not self.accept(","):
+                break
+        self.expect(")")
+        return ("function", name, parameters, self.block())
+
+    #
+    #   Statements
+    #
+
+    def block(self):
+        self.expect("{")
+        statements = []
+        while not self.accept("}"):
+            statements.append(self.statement())
+        return ("block", statements)
+
+    def declaration(self):
+        self.expect("int")
+        variables = []
+        while True:
+            self.pointers()
+            name = self.expect("name")[1]
+            size = self.array_size()
+            initializer = self.initializer(size) if self.accept("=") else None
+            variables.append((name, size, initializer))
+            if not self.accept(","):
+                break
+        self.expect(";")
+        return ("decl", variables)
+
+    def statement(self):
+        kind = self.kind
+        if kind == "int":
+            return self.declaration()
+        if kind == "{":
+            return self.block()
+        if kind == ";":
+            self.next()
+            return ("block", [])
+
+        if self.accept("if"):
+            self.expect("(")
+            condition = self.expression()
+            self.expect(")")
+            then = self.statement()
+            otherwise = self.statement() if self.accept("else") else None
+            return ("if", condition, then, otherwise)
+
+        if self.accept("while"):
+            self.expect("(")
+            condition = self.expression()
+            self.expect(")")
+            return ("while", condition, self.statement())
+
+        if self.accept("for"):
+            self.expect("(")
+            if self.kind == "int":
+                init = self.declaration()
+            else:
+                init = None if self.kind == ";" else ("expr", self.expression())
+                self.expect(";")
+            condition = None if self.kind == ";" else self.expression()
+            self.expect(";")
+            step = None if self.kind == ")" else self.expression()
+            self.expect(")")
+            return ("for", init, condition, step, self.statement())
+
+        if self.accept("return"):
+            value = None if self.kind == ";" else self.expression()
+            self.expect(";")
+            return ("return", value)
+
+        if kind in ("break", "continue"):
+            self.next()
+            self.expect(";")
+            return (kind,)
+
+        expression = self.expression()
+        self.expect(";")
+        return ("expr", expression)
+
+    #
+    #   Expressions
+    #
+
+    def expression(self):
+        target = self.logical_or()
+        if self.kind in ASSIGNMENTS:
+            line = self.line
+            op = ASSIGNMENTS[self.next()[0]]
+            value = self.expression()
+            check_lvalue(target, line)
+            if op is None:
+                return ("assign", target, value)
+            return ("compound", op, target, value)
+        return target
+
+    def logical_or(self):
+        left = self.logical_and()
+        while self.accept("||"):
+            left = ("or", left, self.logical_and())
+        return left
+
+    def logical_and(self):
+        left = self.binary(0)
+        while self.accept("&&"):
+            left = ("and", left, self.binary(0))
+        return left
+
+    def binary(self, level):
+        if level == len(BINARY_LEVELS):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.kind in BINARY_LEVELS[level]:
+            op = self.next()[0]
+            left = ("binary", op, left, self.binary(level + 1))
+        return left
+
+    def unary(self):
+        line = self.line
+        if self.kind in ("-", "!", "~"):
+            return ("unary", self.next()[0], self.unary())
+        if self.accept("+"):
+            return self.unary()
+        if self.accept("*"):
+            return ("deref", self.unary())
+        if self.accept("&"):
+            target = self.unary()
+            check_lvalue(target, line)
+            return ("address", target)
+        if self.kind in ("++", "--"):
+            op = self.next()[0]
+            target = self.unary()
+            check_lvalue(target, line)
+            return ("incdec", op, True, target)
+        return self.postfix()
+
+    def postfix(self):
+        expression = self.primary()
+        while True:
+            line = self.line
+            if self.accept("["):
+                index = self.expression()
+                self.expect("]")
+                expression = ("index", expression, index)
+            elif self.kind == "(" and expression[0] == "var":
+                self.next()
+                arguments = []
+                while self.kind != ")":
+                    arguments.append(self.expression())
+                    if not self.accept(","):
+                        break
+                self.expect(")")
+                expression = ("call", expression[1], arguments, line)
+            elif self.kind in ("++", "--"):
+                check_lvalue(expression, line)
+                expression = ("incdec", self.next()[0], False, expression)
+            else:
+                return expression
+
+    def primary(self):
+        if self.kind == "num":
+            return ("num", self.next()[1])
+        if self.kind == "name":
+            _kind, name, line = self.next()
+            return ("var", name, line)
+        if self.accept("("):
+            expression = self.expression()
+            self.expect(")")
+            return expression
+        found = self.tokens[self.position][1]
+        raise CompileError("unexpected '{}'".format("end of file" if found is None else found), self.line)
+
+def check_lvalue(expression, line):
+    if expression[0] not in ("var", "index", "deref"):
+        raise CompileError("expression is not assignable", line)
+
+def parse(source):
+    return Parser(source).program()
@@ -0,0 +1,110 @@
+#
+#   Linear-scan register allocation (Poletto & Sarkar).
+#
+#   Every virtual register gets one live interval, from the first to the last
+#   instruction it is live at, computed from block level liveness. The
+#   intervals are visited by start; an interval ending before the current one
+#   starts gives its register back. When all of REP - REZ are taken, the
+#   interval ending last is spilled to a slot in VARIABLE_MEM.
+#
+#   REA, REB and ACC are not allocated, the code generator uses them as the
+#   ALU's operands and as scratch registers.
+#
+
+from c_ir import TERMINATORS, definition, uses
+from c_optimize import block_successors, liveness
+
+REGISTERS = ["RE" + letter for letter in "PQRSTUVWXYZ"]
+
+class Allocation:
+    def __init__(self):
+        self.intervals = {}     # virtual register: [start, end]
+        self.registers = {}     # virtual register: register name
+        self.spilled = {}       # virtual register: address
+
+    # Virtual registers live before and after `position`, they survive a call there.
+    def live_across(self, position):
+        return [register for register, (start, end) in self.intervals.items() if start < position < end]
+
+# Splits the code into blocks, returns ([label or None, instructions], first index) pairs.
+def blocks_of(code):
+    blocks = []
+    start = 0
+    for i, instruction in enumerate(code):
+        if instruction[0] == "label" and i > start:
+            blocks.append((start, i))
+            start = i
+        if instruction[0] in TERMINATORS:
+            blocks.append((start, i + 1))
+            start = i + 1
+    if start < len(code):
+        blocks.append((start, len(code)))
+
+    result = []
+    for start, end in blocks:
+        label = code[start][1] if code[start][0] == "label" else None
+        result.append(([label, [instruction for instruction in code[start:end] if instruction[0] != "label"]], start, end))
+    return result
+
+def live_intervals(code):
+    ranges = blocks_of(code)
+    blocks = [block for block, _start, _end in ranges]
+    live_in, live_out = liveness(blocks, block_successors(blocks))
+
+    intervals = {}
+    def extend(register, position):
+        interval = intervals.get(register)
+        if interval is None:
+            intervals[register] = [position, position]
+        else:
+            interval[0] = min(interval[0], position)
+            interval[1] = max(interval[1], position)
+
+    for i, (_block, start, end) in enumerate(ranges):
+        for register in live_in[i]:
+            extend(register, start)
+        for register in live_out[i]:
+            extend(register, end - 1)
+        for position in range(start, end):
+            instruction = code[position]
+            for register in uses(instruction):
+                extend(register, position)
+            register = definition(instruction)
+            if register is not None:
+                extend(register, position)
+    return intervals
+
+# Allocates the registers of a function; `allocate_slot(register)` returns
+# the address of a spill slot.
+def allocate(code, allocate_slot, registers = REGISTERS):
+    allocation = Allocation()
+    allocation.intervals = live_intervals(code)
+
+    free = list(registers)
+    active = []     # virtual registers holding a register, by end
+    for register in sorted(allocation.intervals, key = lambda register: allocation.intervals[register][0]):
+        start, end = allocation.intervals[register]
+
+        for other in list(active):
+            if allocation.intervals[other][1] >= start:
+                break
+            active.remove(other)
+            free.append(allocation.registers[other])
+
+        if free:
+            # registers in a fixed order keep the output stable
+            free.sort(key = registers.index)
+            allocation.registers[register] = free.pop(0)
+            active.append(register)
+        else:
+            last = active[-1]
+            if allocation.intervals[last][1] > end:
+                allocation.registers[register] = allocation.registers.pop(last)
+                allocation.spilled[last] = allocate_slot(last)
+                active.remove(last)
+                active.append(register)
+            else:
+                allocation.spilled[register] = allocate_slot(register)
+        active.sort(key = lambda other: allocation.intervals[other][1])
+
+    return allocation
@@ -0,0 +1,54 @@
+#!python3
+#
+#   Compiles a small subset of C to assembly for newAssembler.py.
+#
+#   source -> c_parser (syntax tree) -> c_optimize.fold_program
+#          -> c_ir.lower (virtual register code) -> c_optimize.optimize
+#          -> c_codegen (linear-scan allocation, assembly)
+#
+#   Ex.: mini_c.py program.c program.asm
+#        mini_c.py program.c program.asm --ir       (prints the intermediate code)
+#
+
+import argparse
+import sys
+
+import c_codegen
+import c_ir
+import c_optimize
+import c_parser
+
+# Compiles the source, returns the assembly. `listing(function)` is called
+# with every function once its intermediate code is final.
+def compile_source(source, optimize = True, listing = None):
+    program = c_parser.parse(source)
+    if optimize:
+        program = c_optimize.fold_program(program)
+    functions, layout, initial = c_ir.lower(program)
+    for function in functions:
+        if optimize:
+            c_optimize.optimize(function)
+        if listing is not None:
+            listing(function)
+    return c_codegen.generate(functions, layout, initial)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compiles a C subset for the register based instruction set.")
+    parser.add_argument("source", help = "C source file")
+    parser.add_argument("output", help = "assembly file to write")
+    parser.add_argument("--no-opt", action = "store_true", help = "skip constant folding and dead code elimination")
+    parser.add_argument("--ir", action = "store_true", help = "print the intermediate code of every function")
+    args = parser.parse_args()
+
+    with open(args.source, "r", encoding = "utf-8") as file:
+        source = file.read()
+    listing = (lambda function: print(c_ir.format_function(function) + "\n")) if args.ir else None
+    try:
+        assembly = compile_source(source, not args.no_opt, listing)
+    except c_parser.CompileError as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
+
+    with open(args.output, "w", encoding = "utf-8") as file:
+        file.write(assembly)
+    print("{} lines written to {}".format(assembly.count("\n"), args.output))
@@ -0,0 +1,654 @@
+#!python3
+
+#
+#   Static timing of a Logisim circuit in gate levels.
+#
+#   Flattens all subcircuit instances, connects wires, splitters and
+#   subcircuit pins bit by bit, and computes the longest combinational path
+#   from every register output (and top level input) to every register
+#   input (and top level output). The worst paths are listed with the
+#   components they pass, the place to add pipelining or restructure logic.
+#
+#   Components count as the gate levels of a plain implementation from
+#   2-input gates, see `timing`: a 24-bit adder is a ripple carry adder
+#   (2 levels per bit), a multiplier an array multiplier, a divider a
+#   restoring array divider, memories are read through an address decoder.
+#   Registers, counters and the RAM's write side end paths, their outputs
+#   start new ones. Combinational loops are reported and cut.
+#
+#   Pin positions follow Logisim-evolution for the components used in
+#   24_bit_cpu.circ; --check lists ports that touch no wire, which points at
+#   a component this script places wrongly.
+#
+#   Ex.: critical_path.py 24_bit_cpu.circ
+#        critical_path.py 24_bit_cpu.circ --top 20 --circuit ALU_24Bit
+#        critical_path.py 24_bit_cpu.circ --check
+#
+
+import argparse
+import collections
+import math
+import sys
+import xml.etree.ElementTree as ET
+
+ENDPOINTS = 4       # endpoints listed per path
+
+class CircuitError(Exception):
+    pass
+
+#
+#   Geometry
+#
+
+# Moves `loc` by (dx, dy) given for an east facing component, like Logisim's Location.translate.
+def translate(loc, facing, dx, dy):
+    x, y = loc
+    if facing == "west":
+        return (x - dx, y - dy)
+    if facing == "south":
+        return (x - dy, y + dx)
+    if facing == "north":
+        return (x + dy, y - dx)
+    return (x + dx, y + dy)
+
+def parse_point(text):
+    x, y = text.strip("()").split(",")
+    return (int(x), int(y))
+
+# levels of a tree of 2-input gates combining `inputs` signals
+def tree(inputs):
+    return max(1, math.ceil(math.log2(inputs))) if inputs > 1 else 1
+
+# A component of a circuit definition.
+class Component:
+    def __init__(self, element):
+        self.name = element.get("name")
+        self.lib = element.get("lib")
+        self.loc = parse_point(element.get("loc"))
+        self.attributes = {a.get("name"): a.get("val") for a in element.findall("a") if a.get("name") != "contents"}
+
+    def get(self, name, default = None):
+        return self.attributes.get(name, default)
+
+    def width(self, name = "width", default = 1):
+        return int(self.attributes.get(name, default))
+
+    def facing(self):
+        return self.attributes.get("facing", "east")
+
+    def __str__(self):
+        label = self.get("label")
+        return "{}{}({},{})".format(self.name, " '{}'".format(label) if label else "", *self.loc)
+
+# A port: (name, location, "in" | "out", width).
+Port = collections.namedtuple("Port", "name loc direction width")
+
+def _gate_ports(component):
+    facing = component.facing()
+    inputs = int(component.get("inputs", 1 if component.name == "NOT Gate" else 2))
+    width = component.width()
+    ports = [Port("out", component.loc, "out", width)]
+    if component.name == "NOT Gate":
+        size = int(component.get("size", 30))
+        return ports + [Port("in0", translate(component.loc, facing, -size, 0), "in", width)]
+
+    # AbstractGate.getInputOffset of Logisim
+    size = int(component.get("size", 50))
+    length = size + (10 if component.name in ("XOR Gate", "XNOR Gate") else 0)
+    if inputs <= 3:
+        if size < 40:
+            start, distance, lower = -5, 10, 10
+        elif size < 60 or inputs <= 2:
+            start, distance, lower = -10, 20, 20
+        else:
+            start, distance, lower = -15, 30, 30
+    elif inputs == 4 and size >= 60:
+        start, distance, lower = -5, 20, 0
+    else:
+        start, distance, lower = -5, 10, 10
+    for index in range(inputs):
+        if inputs % 2:
+            dy = start * (inputs - 1) + distance * index
+        else:
+            dy = start * inputs + distance * index + (lower if index >= inputs // 2 else 0)
+        dx = length + (10 if component.get("negate{}".format(index)) == "true" else 0)
+        ports.append(Port("in{}".format(index), translate(component.loc, facing, -dx, dy), "in", width))
+    return ports
+
+def _buffer_ports(component):
+    facing = component.facing()
+    width = component.width()
+    side = -10 if component.get("control", "right") == "left" else 10
+    return [Port("out", component.loc, "out", width),
+            Port("in", translate(component.loc, facing, -20, 0), "in", width),
+            Port("control", translate(component.loc, facing, -10, side), "in", 1)]
+
+def _plexer_ports(component):
+    facing = component.facing()
+    select = component.width("select")
+    width = component.width()
+    count = 1 << select
+    top = component.get("selloc", "bl") == "tr"
+    demultiplexer = component.name == "Demultiplexer"
+    sign = 1 if demultiplexer else -1
+    many = "out" if demultiplexer else "in"
+    ports = [Port("out" if not demultiplexer else "in", component.loc, "in" if demultiplexer else "out", width)]
+    if count == 2:
+        offsets = [(sign * 30, -10), (sign * 30, 10)]
+        select_at = (sign * 20, -20 if top else 20)
+    else:
+        offsets = [(sign * 40, -(count // 2) * 10 + 10 * index) for index in range(count)]
+        select_at = (sign * 20, -(count // 2) * 10 if top else (count // 2) * 10)
+    for index, (dx, dy) in enumerate(offsets):
+        ports.append(Port("{}{}".format(many, index), translate(component.loc, facing, dx, dy), many, width))
+    ports.append(Port("select", translate(component.loc, facing, *select_at), "in", select))
+    return ports
+
+def _arithmetic_ports(component):
+    facing = component.facing()
+    width = component.width()
+    place = lambda dx, dy: translate(component.loc, facing, dx, dy)
+    if component.name == "Comparator":
+        return [Port("a", place(-40, -10), "in", width), Port("b", place(-40, 10), "in", width),
+                Port("gt", place(0, -10), "out", 1), Port("eq", place(0, 0), "out", 1), Port("lt", place(0, 10), "out", 1)]
+    if component.name == "Shifter":
+        return [Port("data", place(-40, -10), "in", width), Port("distance", place(-40, 10), "in", tree(width)),
+                Port("out", place(0, 0), "out", width)]
+    upper, lower = {
+        "Adder": (("carry_in", "in", 1), ("carry_out", "out", 1)),
+        "Subtractor": (("borrow_in", "in", 1), ("borrow_out", "out", 1)),
+        "Multiplier": (("carry_in", "in", width), ("carry_out", "out", width)),
+        "Divider": (("upper", "in", width), ("remainder", "out", width)),
+    }[component.name]
+    return [Port("a", place(-40, -10), "in", width), Port("b", place(-40, 10), "in", width),
+            Port("out", place(0, 0), "out", width),
+            Port(upper[0], place(-20, -20), upper[1], upper[2]), Port(lower[0], place(-20, 20), lower[1], lower[2])]
+
+# Logisim-evolution symbols ("logisim_evolution" appearance), ports relative to loc
+def _register_ports(component):
+    x, y = component.loc
+    width = component.width(default = 8)
+    return [Port("d", (x, y + 30), "in", width), Port("enable", (x, y + 50), "in", 1),
+            Port("clock", (x, y + 70), "in", 1), Port("clear", (x + 30, y + 90), "in", 1),
+            Port("q", (x + 60, y + 30), "out", width)]
+
+def _counter_ports(component):
+    x, y = component.loc
+    width = component.width(default = 8)
+    right = 190 + (width // 8) * 10
+    return [Port("clear", (x, y + 20), "in", 1), Port("load", (x, y + 30), "in", 1),
+            Port("up", (x, y + 50), "in", 1), Port("enable", (x, y + 70), "in", 1),
+            Port("clock", (x, y + 80), "in", 1), Port("d", (x, y + 110), "in", width),
+            Port("q", (x + right, y + 110), "out", width)]
+
+def _memory_ports(component):
+    x, y = component.loc
+    address = component.width("addrWidth", 8)
+    data = component.width("dataWidth", 8)
+    if component.name == "ROM":
+        return [Port("address", (x, y + 10), "in", address), Port("data_out", (x + 240, y + 60), "out", data)]
+    ports = [Port("address", (x, y + 10), "in", address), Port("write_enable", (x, y + 50), "in", 1),
+             Port("output_enable", (x, y + 60), "in", 1), Port("clock", (x, y + 70), "in", 1),
+             Port("data_in", (x, y + 80), "in", data), Port("data_out", (x + 240, y + 80), "out", data)]
+    if component.get("clearpin") == "true":
+        ports.append(Port("clear", (x + 40, y), "in", 1))
+    return ports
+
+def _single_port(direction):
+    def ports(component):
+        return [Port("out" if direction == "out" else "in", component.loc, direction, component.width())]
+    return ports
+
+def _pin_ports(component):
+    direction = "in" if component.get("type", "input") == "output" or component.get("output") == "true" else "out"
+    return [Port("pin", component.loc, direction, component.width())]
+
+# ends of a splitter, SplitterParameters of Logisim-evolution
+def _splitter_ends(component):
+    facing = component.facing()
+    fanout = int(component.get("fanout", 2))
+    appear = component.get("appear", "left")
+    justify = 0 if appear in ("center", "legacy") else 1 if appear == "right" else -1
+    gap = int(component.get("spacing", 1)) * 10
+    x, y = component.loc
+    if facing in ("north", "south"):
+        m = 1 if facing == "north" else -1
+        dx = gap * ((fanout + 1) // 2 - 1) if justify == 0 else -10 if m * justify < 0 else 10 + gap * (fanout - 1)
+        return [(x + dx - gap * index, y - m * 20) for index in range(fanout)]
+    m = -1 if facing == "west" else 1
+    dy = -gap * (fanout // 2) if justify == 0 else 10 if m * justify > 0 else -(10 + gap * (fanout - 1))
+    return [(x + m * 20, y + dy + gap * index) for index in range(fanout)]
+
+# end of every bit of the combined side, None where a bit is not connected
+def splitter_bits(component):
+    incoming = int(component.get("incoming", 2))
+    fanout = int(component.get("fanout", 2))
+    bits = []
+    for bit in range(incoming):
+        value = component.get("bit{}".format(bit))
+        if value is None:
+            bits.append(bit * fanout // incoming)
+        else:
+            bits.append(None if value == "none" else int(value))
+    return bits
+
+def _splitter_ports(component):
+    bits = splitter_bits(component)
+    ports = [Port("combined", component.loc, "in", len(bits))]
+    for end, loc in enumerate(_splitter_ends(component)):
+        ports.append(Port("end{}".format(end), loc, "in", max(1, bits.count(end))))
+    return ports
+
+PORTS = {
+    "AND Gate": _gate_ports, "OR Gate": _gate_ports, "XOR Gate": _gate_ports, "NAND Gate": _gate_ports,
+    "NOR Gate": _gate_ports, "XNOR Gate": _gate_ports, "NOT Gate": _gate_ports,
+    "Controlled Buffer": _buffer_ports,
+    "Multiplexer": _plexer_ports, "Demultiplexer": _plexer_ports,
+    "Adder": _arithmetic_ports, "Subtractor": _arithmetic_ports, "Multiplier": _arithmetic_ports,
+    "Divider": _arithmetic_ports, "Comparator": _arithmetic_ports, "Shifter": _arithmetic_ports,
+    "Register": _register_ports, "Counter": _counter_ports, "RAM": _memory_ports, "ROM": _memory_ports,
+    "Constant": _single_port("out"), "Clock": _single_port("out"), "Button": _single_port("out"),
+    "Pin": _pin_ports, "Splitter": _splitter_ports,
+}
+IGNORED = ("Text", "Probe", "Tunnel")
+
+#
+#   Timing
+#
+
+# Returns (arcs, sinks) of a component: an arc is (input ports, output ports,
+# gate levels, bitwise), bitwise arcs connect bit i to bit i only. Sinks are
+# inputs ending a path, outputs no arc drives start one.
+def timing(component, ports):
+    name = component.name
+    inputs = [port.name for port in ports if port.direction == "in"]
+    outputs = [port.name for port in ports if port.direction == "out"]
+    if name.endswith("Gate"):
+        return [(inputs, outputs, 1 if name == "NOT Gate" else tree(len(inputs)), True)], []
+    if name == "Controlled Buffer":
+        return [(["in"], ["out"], 1, True), (["control"], ["out"], 1, False)], []
+    if name == "Multiplexer":
+        data = [port for port in inputs if port != "select"]
+        return [(data, ["out"], 1 + tree(len(data)), True),
+                (["select"], ["out"], 2 + tree(len(data)), False)], []
+    if name == "Demultiplexer":
+        return [(["in"], outputs, 1, True), (["select"], outputs, 1 + tree(component.width("select") + 1), False)], []
+    width = component.width()
+    if name in ("Adder", "Subtractor", "Comparator"):
+        return [(inputs, outputs, 2 * width, False)], []
+    if name == "Multiplier":
+        return [(inputs, outputs, 4 * width, False)], []
+    if name == "Divider":
+        return [(inputs, outputs, 2 * width * width, False)], []
+    if name == "Shifter":
+        return [(inputs, outputs, 2 * tree(width), False)], []
+    if name in ("RAM", "ROM"):
+        address = component.width("addrWidth", 8)
+        read = [port for port in ("address", "output_enable") if port in inputs]
+        return [(read, ["data_out"], tree(address) + 1 + address, False)], inputs
+    # registers, counters and top level pins
+    return [], inputs
+
+#
+#   Circuits
+#
+
+class Circuit:
+    def __init__(self, element):
+        self.name = element.get("name")
+        self.components = [Component(comp) for comp in element.findall("comp")]
+        self.wires = [(parse_point(wire.get("from")), parse_point(wire.get("to"))) for wire in element.findall("wire")]
+
+        # instance ports of a custom appearance: (pin location, offset from the anchor)
+        self.appearance = []
+        appear = element.find("appear")
+        if appear is not None:
+            anchor = appear.find("circ-anchor")
+            ax, ay = int(anchor.get("x")), int(anchor.get("y"))
+            for port in appear.findall("circ-port"):
+                pin = tuple(int(value) for value in port.get("pin").split(","))
+                self.appearance.append((pin, (int(port.get("x")) - ax, int(port.get("y")) - ay)))
+
+        # points joined by wires
+        parent = {}
+        def find(point):
+            parent.setdefault(point, point)
+            while parent[point] != point:
+                parent[point] = parent[parent[point]]
+                point = parent[point]
+            return point
+        for start, end in self.wires:
+            parent[find(start)] = find(end)
+        self.find = find
+
+    def pins(self):
+        return {component.loc: component for component in self.components if component.name == "Pin"}
+
+# Reads the circuits of a .circ file, returns ({name: Circuit}, main circuit name).
+def read_circuits(file_name):
+    try:
+        root = ET.parse(file_name).getroot()
+    except ET.ParseError as error:
+        raise CircuitError("invalid circuit: {}".format(error)) from None
+    circuits = {element.get("name"): Circuit(element) for element in root.iter("circuit")}
+    main = root.find("main")
+    return circuits, main.get("name") if main is not None else next(iter(circuits))
+
+# Ports of a component placed in a circuit, subcircuit instances included.
+def component_ports(component, circuits):
+    if component.name in circuits and component.lib is None:
+        circuit = circuits[component.name]
+        pins = circuit.pins()
+        if not circuit.appearance:
+            raise CircuitError("subcircuit {} has no custom appearance".format(component.name))
+        ports = []
+        for pin, (dx, dy) in circuit.appearance:
+            inner = pins[pin]
+            direction = "out" if inner.get("type") == "output" else "in"
+            ports.append(Port("{},{}".format(*pin), translate(component.loc, component.facing(), dx, dy), direction, inner.width()))
+        return ports
+    if component.name in PORTS:
+        return PORTS[component.name](component)
+    return None
+
+# A flattened component: instance path, component, {port name: [bit nodes]}.
+Element = collections.namedtuple("Element", "path component bits")
+
+class Netlist:
+    def __init__(self, circuits):
+        self.circuits = circuits
+        self.parent = []
+        self.elements = []
+        self.unknown = collections.Counter()
+
+    def new_nodes(self, count):
+        start = len(self.parent)
+        self.parent.extend(range(start, start + count))
+        return list(range(start, start + count))
+
+    def find(self, node):
+        parent = self.parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, first, second):
+        self.parent[self.find(first)] = self.find(second)
+
+    # Adds the circuit `name`, `outside` maps its pin locations to the bit nodes of the instance ports.
+    def flatten(self, name, path = (), outside = None):
+        circuit = self.circuits[name]
+        placed = []
+        widths = collections.defaultdict(int)
+        for component in circuit.components:
+            if component.name in IGNORED:
+                continue
+            ports = component_ports(component, self.circuits)
+            if ports is None:
+                self.unknown[component.name] += 1
+                continue
+            placed.append((component, ports))
+            for port in ports:
+                net = circuit.find(port.loc)
+                widths[net] = max(widths[net], port.width)
+
+        nets = {net: self.new_nodes(width) for net, width in widths.items()}
+        bits = lambda port: nets[circuit.find(port.loc)][:port.width]
+        for component, ports in placed:
+            if component.name == "Splitter":
+                ends = [bits(port) for port in ports[1:]]
+                used = collections.Counter()
+                for bit, end in enumerate(splitter_bits(component)):
+                    if end is not None and end < len(ends):
+                        self.union(bits(ports[0])[bit], ends[end][used[end]])
+                        used[end] += 1
+            elif component.name == "Pin" and outside is not None:
+                for inner, outer in zip(bits(ports[0]), outside.get(component.loc, [])):
+                    self.union(inner, outer)
+            elif component.name in self.circuits and component.lib is None:
+                self.flatten(component.name, path + (component,),
+                    {parse_point(port.name): bits(port) for port in ports})
+            else:
+                self.elements.append(Element(path, component, {port.name: bits(port) for port in ports}))
+
+    def describe(self, element):
+        return " > ".join(str(component) for component in element.path + (element.component,))
+
+#
+#   Longest paths
+#
+
+# Graph of net bits and components: node -> successors, node weights in gate levels.
+# Components named in `without` are left out.
+def build_graph(netlist, without = ()):
+    successors = collections.defaultdict(set)
+    weight = {}
+    owner = {}              # component node -> element
+    sources = {}            # net node -> element starting paths there
+    sinks = []              # (element, port name, net nodes)
+    next_node = [len(netlist.parent)]
+
+    def core(element, levels):
+        node = next_node[0]
+        next_node[0] += 1
+        weight[node] = levels
+        owner[node] = element
+        return node
+
+    for element in netlist.elements:
+        component = element.component
+        if component.name in without:
+            continue
+        ports = {name: [netlist.find(node) for node in nodes] for name, nodes in element.bits.items()}
+        port_list = component_ports(component, netlist.circuits)
+        if component.name == "Pin" and not element.path:
+            direction = port_list[0].direction
+            arcs, ends = [], ["pin"] if direction == "in" else []
+        else:
+            arcs, ends = timing(component, port_list)
+        if component.name == "Constant":
+            continue
+
+        driven = set()
+        for inputs, outputs, levels, bitwise in arcs:
+            driven.update(outputs)
+            if bitwise:
+                for bit in range(max(len(ports[name]) for name in outputs)):
+                    node = core(element, levels)
+                    for name in inputs:
+                        if bit < len(ports[name]):
+                            successors[ports[name][bit]].add(node)
+                    for name in outputs:
+                        if bit < len(ports[name]):
+                            successors[node].add(ports[name][bit])
+            else:
+                node = core(element, levels)
+                for name in inputs:
+                    for net in ports[name]:
+                        successors[net].add(node)
+                for name in outputs:
+                    for net in ports[name]:
+                        successors[node].add(net)
+        for port in port_list:
+            if port.direction == "out" and port.name not in driven:
+                for net in ports[port.name]:
+                    sources.setdefault(net, element)
+        for name in ends:
+            sinks.append((element, name, ports[name]))
+    return successors, weight, owner, sources, sinks
+
+# Strongly connected components with more than one node (combinational loops), iteratively.
+def find_loops(successors):
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    loops = []
+    counter = 0
+    for root in list(successors):
+        if root in index:
+            continue
+        work = [(root, iter(successors.get(root, ())))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors.get(child, ()))))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    loop = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        loop.append(member)
+                        if member == node:
+                            break
+                    if len(loop) > 1:
+                        loops.append(set(loop))
+    return loops
+
+# Arrival levels from the sources, edges inside loops are cut. Returns (levels, predecessor).
+def arrival_levels(successors, weight, sources, loops):
+    in_loop = {}
+    for number, loop in enumerate(loops):
+        for node in loop:
+            in_loop[node] = number
+    cut = lambda node, child: node in in_loop and in_loop.get(child) == in_loop[node]
+
+    indegree = collections.Counter()
+    for node, children in successors.items():
+        for child in children:
+            if not cut(node, child):
+                indegree[child] += 1
+
+    levels = {node: 0 for node in sources}
+    predecessor = {}
+    ready = [node for node in set(successors) | set(sources) if indegree[node] == 0]
+    while ready:
+        node = ready.pop()
+        for child in successors.get(node, ()):
+            if cut(node, child):
+                continue
+            if node in levels:
+                arrival = levels[node] + weight.get(child, 0)
+                if arrival > levels.get(child, -1):
+                    levels[child] = arrival
+                    predecessor[child] = node
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    return levels, predecessor
+
+# Components along the path ending at `node`, the starting element first.
+def trace_path(node, predecessor, owner, sources):
+    path = []
+    while node is not None:
+        if node in owner:
+            path.append(owner[node])
+        elif node not in predecessor and node in sources:
+            path.append(sources[node])
+        node = predecessor.get(node)
+    return path[::-1]
+
+# Returns (netlist, paths, loops): paths are (levels, [(element, port)], [elements])
+# sorted worst first, endpoints reached by the same path are listed together.
+def analyze(circuits, top, without = ()):
+    if top not in circuits:
+        raise CircuitError("no circuit called '{}'".format(top))
+    netlist = Netlist(circuits)
+    netlist.flatten(top)
+    successors, weight, owner, sources, sinks = build_graph(netlist, without)
+    loops = find_loops(successors)
+    levels, predecessor = arrival_levels(successors, weight, sources, loops)
+
+    paths = collections.OrderedDict()
+    for element, name, nets in sinks:
+        reached = [net for net in nets if net in levels]
+        if not reached:
+            continue
+        worst = max(reached, key = lambda net: levels[net])
+        path = trace_path(worst, predecessor, owner, sources)
+        key = (levels[worst],) + tuple(id(step) for step in path)
+        paths.setdefault(key, (levels[worst], [], path))[1].append((element, name))
+    paths = sorted(paths.values(), key = lambda path: -path[0])
+    loop_elements = [sorted({netlist.describe(owner[node]) for node in loop if node in owner}) for loop in loops]
+    return netlist, paths, loop_elements
+
+# Ports touching neither a wire nor another port: (circuit, component, port).
+def unconnected_ports(circuits):
+    result = []
+    for circuit in circuits.values():
+        points = collections.Counter()
+        for start, end in circuit.wires:
+            points[start] += 1
+            points[end] += 1
+        placed = []
+        for component in circuit.components:
+            if component.name in IGNORED:
+                continue
+            ports = component_ports(component, circuits) or []
+            placed.append((component, ports))
+            for port in ports:
+                points[port.loc] += 1
+        for component, ports in placed:
+            for port in ports:
+                if points[port.loc] == 1:
+                    result.append((circuit.name, component, port))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Finds the longest combinational paths of a Logisim circuit in gate levels.")
+    parser.add_argument("circuit", help = "circuit file, e.g. 24_bit_cpu.circ")
+    parser.add_argument("--circuit", dest = "top", metavar = "NAME", help = "circuit to analyze (default: the main circuit)")
+    parser.add_argument("--top", dest = "count", type = int, default = 10, help = "number of paths to list (default 10)")
+    parser.add_argument("--without", metavar = "TYPE", action = "append", default = [],
+        help = "leave out a component type, e.g. Divider, to see the next worst paths")
+    parser.add_argument("--check", action = "store_true", help = "list component ports that touch no wire")
+    args = parser.parse_args()
+
+    try:
+        circuits, main_circuit = read_circuits(args.circuit)
+        if args.check:
+            for circuit, component, port in unconnected_ports(circuits):
+                print("{}: {} port {} at {} is not connected".format(circuit, component, port.name, port.loc))
+            return
+        netlist, paths, loops = analyze(circuits, args.top or main_circuit, set(args.without))
+    except (CircuitError, OSError) as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
+
+    for name, count in sorted(netlist.unknown.items()):
+        print("ignored {} x {} (no timing model)".format(count, name))
+    for loop in loops:
+        print("combinational loop, cut: {}".format("; ".join(loop)))
+    if not paths:
+        print("no register to register path found")
+        return
+
+    print("critical path: {} gate levels".format(paths[0][0]))
+    for levels, ends, path in paths[:args.count]:
+        print("\n{:>5} levels".format(levels))
+        for step in path:
+            print("        {}".format(netlist.describe(step)))
+        for element, port in ends[:ENDPOINTS]:
+            print("     -> {} ({})".format(netlist.describe(element), port))
+        if len(ends) > ENDPOINTS:
+            print("     -> and {} more endpoints".format(len(ends) - ENDPOINTS))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!python3
+
+#
+#   Writes assembled programs and microcode straight into the RAM and ROM
+#   components of a Logisim circuit, instead of loading them by hand with
+#   "Load Image".
+#
+#   The circuit is read in a single streaming pass with expat, no document
+#   tree is built. Only the byte range of each target's `contents` attribute
+#   is replaced, everything else is copied unchanged. The new contents are
+#   written in Logisim's run-length format ("N*value"), so a mostly empty
+#   16M-word ROM stays small.
+#
+#   Ex.: inject_image.py 24_bit_cpu.circ --rom bytecode/cpu_microcode.rom
+#        inject_image.py 24_bit_cpu.circ --ram program.o -o test.circ
+#        inject_image.py 24_bit_cpu.circ --rom cpu.rom --rom-at "(1000,320)"
+#
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import xml.parsers.expat
+
+import numpy as np
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+
+import load_rom
+
+RUN_LENGTH = 4      # shortest run written as "N*value"
+COLUMNS = 8         # values per line, like Logisim
+
+# defaults of Logisim's memory components
+DEFAULT_ADDR_WIDTH = 8
+DEFAULT_DATA_WIDTH = 8
+
+class InjectError(Exception):
+    pass
+
+#
+#   Images
+#
+
+# Reads a "v2.0 raw" image (save_rom output or an assembled program) into a uint32 array.
+def read_raw_image(file_name):
+    try:
+        return load_rom.read_file(file_name)
+    except load_rom.RawImageError as error:
+        raise InjectError(str(error)) from None
+
+# Yields the text of a `contents` attribute in pieces.
+def format_contents(words, addr_width, data_width):
+    words = np.asarray(words, dtype = np.uint32)
+    if len(words) > 1 << addr_width:
+        raise InjectError("image of {} words does not fit {} address bits".format(len(words), addr_width))
+    if len(words) and int(words.max()) >> data_width:
+        raise InjectError("image holds values wider than {} data bits".format(data_width))
+
+    yield "addr/data: {} {}\n".format(addr_width, data_width)
+
+    # trailing zeros are implied
+    used = np.flatnonzero(words)
+    words = words[:used[-1] + 1] if len(used) else words[:0]
+    if len(words) == 0:
+        return
+
+    starts = np.flatnonzero(words[1:] != words[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, len(words)))
+
+    line = []
+    for value, length in zip(words[starts].tolist(), lengths.tolist()):
+        value = "{:x}".format(value)
+        if length >= RUN_LENGTH:
+            line.append("{}*{}".format(length, value))
+        else:
+            line.extend([value] * length)
+        if len(line) >= COLUMNS:
+            rows = len(line) // COLUMNS * COLUMNS
+            yield "".join(" ".join(line[i:i + COLUMNS]) + "\n" for i in range(0, rows, COLUMNS))
+            line = line[rows:]
+    if line:
+        yield " ".join(line) + "\n"
+
+#
+#   Circuit
+#
+
+# A RAM or ROM component found in the circuit.
+class Component:
+    def __init__(self, name, loc, circuit, start, tag_end):
+        self.name = name
+        self.loc = loc
+        self.circuit = circuit
+        self.start = start              # offset of "<comp"
+        self.tag_end = tag_end          # offset after the "<comp ...>" tag
+        self.attributes = {}
+        self.contents = None            # (start, end) of the contents attribute
+        self.insert_at = tag_end        # where a missing contents attribute goes
+        self.attribute = None           # name of the attribute being parsed
+
+    def width(self, name, default):
+        return int(self.attributes.get(name, default))
+
+    def __str__(self):
+        return "{} at {} in {}".format(self.name, self.loc, self.circuit)
+
+# Finds the components called one of `names` in one streaming pass over `data`.
+def find_components(data, names):
+    components = []
+    circuit = [None]
+    current = [None]
+    parser = xml.parsers.expat.ParserCreate()
+
+    def tag_end(offset):
+        return data.index(b">", offset) + 1
+
+    def start_element(tag, attributes):
+        offset = parser.CurrentByteIndex
+        if tag == "circuit":
+            circuit[0] = attributes.get("name")
+        elif tag == "comp" and attributes.get("name") in names:
+            current[0] = Component(attributes["name"], attributes.get("loc"), circuit[0], offset, tag_end(offset))
+        elif tag == "a" and current[0] is not None:
+            component = current[0]
+            name = attributes.get("name")
+            component.attributes[name] = attributes.get("val")
+            component.attribute = name
+            if name == "contents":
+                component.contents = (offset, None)
+
+    def end_element(tag):
+        component = current[0]
+        if component is None:
+            return
+        if tag == "comp":
+            components.append(component)
+            current[0] = None
+        elif tag == "a":
+            end = tag_end(parser.CurrentByteIndex)
+            if component.contents is not None and component.contents[1] is None:
+                component.contents = (component.contents[0], end)
+            elif component.contents is None:
+                # Logisim keeps the attributes sorted, contents follows addrWidth/appearance/...
+                if component.attribute < "contents":
+                    component.insert_at = end
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    try:
+        parser.Parse(data, True)
+    except xml.parsers.expat.ExpatError as error:
+        raise InjectError("invalid circuit: {}".format(error)) from None
+    return components
+
+# Picks the single component called `name`, or the one at `loc`.
+def select_component(components, name, loc = None):
+    matches = [component for component in components if component.name == name
+        and (loc is None or component.loc == loc)]
+    if len(matches) == 1:
+        return matches[0]
+    if not matches:
+        raise InjectError("no {} component{}".format(name, " at " + loc if loc else ""))
+    raise InjectError("several {} components, pick one with its location: {}".format(
+        name, ", ".join(component.loc for component in matches)))
+
+# Writes `data` to `file`, replacing the contents of every component in `images` ({component: words}).
+def write_circuit(file, data, images):
+    position = 0
+    for component in sorted(images, key = lambda component: component.start):
+        words = images[component]
+        addr_width = component.width("addrWidth", DEFAULT_ADDR_WIDTH)
+        data_width = component.width("dataWidth", DEFAULT_DATA_WIDTH)
+
+        if component.contents is not None:
+            start, end = component.contents
+            file.write(data[position:start])
+        else:
+            start = end = component.insert_at
+            file.write(data[position:start])
+            indent = data[data.rindex(b"\n", 0, component.start) + 1:component.start]
+            file.write(b"\n" + indent + b"  ")
+
+        file.write(b'<a name="contents">')
+        for text in format_contents(words, addr_width, data_width):
+            file.write(text.encode("ascii"))
+        file.write(b"</a>")
+        position = end
+    file.write(data[position:])
+
+# Replaces the contents of the RAM/ROM components of `circuit_file`.
+# `images` is a list of (component name, location or None, words).
+def inject(circuit_file, images, output_file = None):
+    with open(circuit_file, "rb") as file:
+        data = file.read()
+
+    components = find_components(data, {name for name, _loc, _words in images})
+    selected = {}
+    for name, loc, words in images:
+        selected[select_component(components, name, loc)] = words
+
+    # written next to the target and renamed, so a failure never leaves half a circuit
+    output_file = output_file or circuit_file
+    directory = os.path.dirname(os.path.abspath(output_file))
+    handle, temp_name = tempfile.mkstemp(dir = directory, suffix = ".circ")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            write_circuit(file, data, selected)
+        if os.path.exists(output_file):
+            shutil.copymode(output_file, temp_name)
+        os.replace(temp_name, output_file)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+    return list(selected)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Writes images into the RAM/ROM components of a Logisim circuit.")
+    parser.add_argument("circuit", help = "circuit file, e.g. 24_bit_cpu.circ")
+    parser.add_argument("--ram", metavar = "IMAGE", help = "assembled program for the RAM")
+    parser.add_argument("--rom", metavar = "IMAGE", help = "microcode for the ROM")
+    parser.add_argument("--ram-at", metavar = "LOC", help = "location of the RAM if there are several, e.g. \"(2020,1300)\"")
+    parser.add_argument("--rom-at", metavar = "LOC", help = "location of the ROM if there are several")
+    parser.add_argument("-o", "--output", help = "output circuit (default: overwrite the input)")
+    args = parser.parse_args()
+
+    if not args.ram and not args.rom:
+        parser.error("nothing to inject, give --ram and/or --rom")
+
+    try:
+        images = []
+        if args.ram:
+            images.append(("RAM", args.ram_at, read_raw_image(args.ram)))
+        if args.rom:
+            images.append(("ROM", args.rom_at, read_raw_image(args.rom)))
+        for component in inject(args.circuit, images, args.output):
+            print("updated {}".format(component))
+    except (InjectError, OSError) as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
@@ -0,0 +1,391 @@
+#!python3
+
+#
+#   Fuzz farm for the toolchain.
+#
+#   Generates random programs from the grammar of assemblyCompilerv2.py
+#   (labels, `.var` variables, `#decimal` and `0x` literals, `[address]`
+#   operands, strings), assembles them in-process and runs them on a pool of
+#   worker processes.
+#   A program fails when
+#     - the assembler or a simulator crashes or emits an invalid word,
+#     - disassembling the program (disassembler.py) and assembling the
+#       source again does not give the same program words,
+#     - the microcode simulator ends with other registers, RAM, device
+#       output or cycles than the instruction level simulator (--optimized
+#       adds the merged microcode of optimize_microcode.py, its cycles differ
+#       on purpose).
+#   Jumps go to any label, so programs may loop until --max-instructions.
+#   Every program is generated from (--seed, number): --replay NUMBER prints
+#   its source and the results of every level again.
+#
+#   Ex.: fuzz_farm.py --programs 10000
+#        fuzz_farm.py --programs 1000000 --workers 16 --save failures/
+#        fuzz_farm.py --seed 3 --replay 4711
+#
+
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import string
+import sys
+import time
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "Simulator"))
+
+import numpy as np
+
+import assemblyCompilerv2
+import disassembler
+import generate_cpu_microcode
+import optimize_microcode
+import simulator
+from devices import DISPLAY_PORT, TERMINAL_PORT, DeviceBus
+from memory import PAGE_WORDS
+from microcode_simulator import REGISTERS, MicrocodeError, MicrocodeSimulator
+
+DATA_START = assemblyCompilerv2.PARTITIONS["VARIABLE_MEM"][0]
+DATA_WORDS = 32
+BUFFER_MEM = assemblyCompilerv2.PARTITIONS["BUFFER_MEM"]
+WORD_MASK = simulator.WORD_MASK
+
+RETURNS = ("rts", "rtc", "rtz")
+LABEL_START = string.ascii_lowercase + "_"
+LABEL_CHARS = LABEL_START + string.digits
+# characters of strings, whitespace is written as `\s` and `\n`
+STRING_CHARS = [char for char in assemblyCompilerv2.CHARACTER_SET if char not in " \n$\\"] + ["\\s", "\\n"]
+
+#
+#   Programs
+#
+
+def random_value(rng):
+    return rng.choice([0, 1, 0xF, 0xFFFF, WORD_MASK, rng.randrange(WORD_MASK + 1), rng.randrange(64)])
+
+def random_label(rng, taken):
+    while True:
+        name = rng.choice(LABEL_START) + "".join(rng.choice(LABEL_CHARS) for _i in range(rng.randrange(8)))
+        if name not in taken and name not in assemblyCompilerv2.INSTRUCTION_SET:
+            taken.add(name)
+            return name
+
+# A number as `#decimal` or `0x` literal in either case.
+def number_operand(rng, value):
+    style = rng.randrange(3)
+    if style == 0:
+        return "#{}".format(value)
+    if style == 1:
+        return "0x{:04x}".format(value)
+    return "0x{:X}".format(value)
+
+def operand_text(rng, kind, labels, variables):
+    if kind == "target":
+        return rng.choice(labels)
+    if kind == "address":
+        if rng.randrange(2):
+            name, size = rng.choice(variables)
+            offset = rng.randrange(size)
+            return "{}+{}".format(name, number_operand(rng, offset)) if offset else name
+        return number_operand(rng, DATA_START + rng.randrange(DATA_WORDS))
+    if rng.randrange(8) == 0:
+        return rng.choice(labels)
+    return number_operand(rng, random_value(rng))
+
+def random_string(rng):
+    return "$" + "".join(rng.choice(STRING_CHARS) for _i in range(1 + rng.randrange(6))) + "$"
+
+# Source of a random program of `length` instructions ending with `halt`.
+# `forms` are the (mnemonic, bracket, operand kinds) the grammar offers.
+def random_source(rng, forms, length):
+    taken = set()
+    labels = [random_label(rng, taken) for _i in range(1 + length // 6)]
+    # variables (.var) inside the data words
+    variables = [(random_label(rng, taken), 1 + rng.randrange(4)) for _i in range(1 + rng.randrange(4))]
+    # label -> instruction it is placed before, `length` is the final `halt`
+    placed = collections.defaultdict(list)
+    for label in labels:
+        placed[rng.randrange(length + 1)].append(label)
+
+    lines = [".var {} #{}".format(name, size) for name, size in variables]
+    for index in range(length + 1):
+        lines += [":" + label for label in placed[index]]
+        if index == length:
+            lines.append("    halt")
+            break
+
+        mnemonic, bracket, kinds = rng.choice(forms)
+        if mnemonic in RETURNS:
+            # C has to hold the start of an instruction
+            lines.append("    lpc " + rng.choice(labels))
+        if mnemonic == "out" and not bracket and rng.randrange(10) == 0:
+            lines.append("    out " + random_string(rng))
+            continue
+
+        operands = [operand_text(rng, kind, labels, variables) for kind in kinds]
+        if bracket:
+            operands[0] = "[" + operands[0] + "]"
+        lines.append("    " + " ".join([mnemonic] + operands))
+    return "\n".join(lines) + "\n"
+
+class FuzzError(Exception):
+    pass
+
+# Assembles `source` like assemblyCompilerv2.py does.
+# Returns (program words, {address: word} of the strings).
+def assemble(source, superinstructions):
+    memory = assemblyCompilerv2.MEMORY
+    _tokens, grammar, _allocations, _free = assemblyCompilerv2.assemble(source, superinstructions)
+
+    strings = {}
+    for address in range(BUFFER_MEM[0], BUFFER_MEM[1]):
+        if memory[address] != "0000":
+            strings[address] = memory[address]
+
+    words = []
+    for address, word in enumerate(grammar):
+        try:
+            value = int(word, 16)
+        except ValueError:
+            raise FuzzError("invalid word '{}' at 0x{:04x}".format(word, address)) from None
+        if value > WORD_MASK:
+            raise FuzzError("word '{}' at 0x{:04x} is wider than 24 bits".format(word, address))
+        words.append(value)
+    return words, {address: int(word, 16) for address, word in strings.items()}
+
+#
+#   Simulator levels
+#
+
+# Result of one level: (registers, non-zero RAM words, device events, instructions, cycles).
+def run_microcode(microcode, program, max_instructions):
+    words, strings, data = program
+    cpu = MicrocodeSimulator(microcode)
+    cpu.load(words)
+    cpu.load(data, DATA_START)
+    for address, word in strings.items():
+        cpu.ram[address] = word
+    cpu.run(max_instructions)
+    return cpu.registers(), cpu.memory(), cpu.events, cpu.instructions, cpu.cycles
+
+# The instruction level simulator, reused for every program of a worker.
+class InstructionLevel:
+    def __init__(self, instruction_set):
+        self.events = []
+        bus = DeviceBus()
+        bus.attach(TERMINAL_PORT, optimize_microcode.Recorder(self.events, "terminal"))
+        bus.attach(DISPLAY_PORT, optimize_microcode.Recorder(self.events, "display"))
+        self.cpu = simulator.Simulator(bus, instruction_set)
+        self.empty = self.cpu.snapshot()
+
+    def run(self, program, max_instructions):
+        words, strings, data = program
+        cpu = self.cpu
+        cpu.restore(self.empty)
+        cpu.reset()
+        del self.events[:]
+        cpu.load(words)
+        cpu.load(data, DATA_START)
+        for address, word in strings.items():
+            cpu.load([word], address)
+        cpu.run(max_instructions)
+
+        memory = {}
+        for page in cpu.memory.resident_pages():
+            start = page * PAGE_WORDS
+            block = cpu.memory.array[start:start + PAGE_WORDS]
+            for offset in np.flatnonzero(block):
+                memory[start + int(offset)] = int(block[offset])
+        registers = {name: int(getattr(cpu, name)) for name in REGISTERS}
+        return registers, memory, list(self.events), cpu.instructions, cpu.cycles
+
+# First difference between two level results, None if they agree.
+def difference(reference, result, compare_cycles):
+    names = ("registers", "RAM", "device output", "instructions", "cycles")
+    for name, expected, found in zip(names, reference, result):
+        if name == "cycles" and not compare_cycles:
+            continue
+        if expected == found:
+            continue
+        if isinstance(expected, dict):
+            key = min(key for key in set(expected) | set(found) if expected.get(key) != found.get(key))
+            return "{} differ at {}: {} != {}".format(name, key, expected.get(key), found.get(key))
+        return "{} differ: {} != {}".format(name, expected, found)
+    return None
+
+#
+#   Workers
+#
+
+# Everything a worker process needs, built once per process.
+class Fuzzer:
+    def __init__(self, optimized, length, max_instructions):
+        instruction_set = generate_cpu_microcode.instruction_set
+        self.instruction_set = instruction_set
+        self.superinstructions = assemblyCompilerv2.loadSuperinstructions()
+        table = disassembler.opcode_table(instruction_set)
+        self.forms = sorted(set((parts[0][0], parts[0][1], tuple(parts[0][2]))
+            for parts in table.values() if len(parts) == 1 and parts[0][0] != "halt"))
+
+        self.levels = [("microcode", generate_cpu_microcode.generate_microcode(generate_cpu_microcode.fetch, instruction_set), True)]
+        if optimized:
+            merged, _report = optimize_microcode.optimize_instruction_set(instruction_set)
+            self.levels.append(("merged microcode", generate_cpu_microcode.generate_microcode(generate_cpu_microcode.fetch, merged), False))
+        self.instruction_level = InstructionLevel(instruction_set)
+        self.length = length
+        self.max_instructions = max_instructions
+
+    def source(self, seed, number):
+        rng = random.Random((seed << 32) | number)
+        source = random_source(rng, self.forms, self.length)
+        data = [random_value(rng) for _i in range(DATA_WORDS)]
+        return source, data
+
+    # Runs program `number`, returns (failures, results by level) where a
+    # failure is (kind, message).
+    def check(self, seed, number):
+        source, data = self.source(seed, number)
+        try:
+            words, strings = assemble(source, self.superinstructions)
+        except Exception as error:
+            return [("assembler", "{}: {}".format(type(error).__name__, error))], {}
+
+        failures = []
+        try:
+            again, _strings = assemble(disassembler.disassemble(words, self.instruction_set), self.superinstructions)
+            if again != words:
+                address = next((i for i, (a, b) in enumerate(zip(words, again)) if a != b), min(len(words), len(again)))
+                failures.append(("round trip", "word 0x{:04x} differs after disassembling ({} -> {} words)".format(
+                    address, len(words), len(again))))
+        except Exception as error:
+            failures.append(("round trip", "{}: {}".format(type(error).__name__, error)))
+
+        program = (words, strings, data)
+        results = {}
+        try:
+            results["instruction level"] = self.instruction_level.run(program, self.max_instructions)
+        except Exception as error:
+            failures.append(("simulator", "instruction level: {}: {}".format(type(error).__name__, error)))
+        for name, microcode, compare_cycles in self.levels:
+            try:
+                results[name] = run_microcode(microcode, program, self.max_instructions)
+            except Exception as error:
+                kind = "simulator" if isinstance(error, MicrocodeError) else "crash"
+                failures.append((kind, "{}: {}: {}".format(name, type(error).__name__, error)))
+                continue
+            if "instruction level" in results:
+                message = difference(results["instruction level"], results[name], compare_cycles)
+                if message is not None:
+                    failures.append(("divergence", "{}: {}".format(name, message)))
+        return failures, results
+
+    # Runs `count` programs from `first`, returns (programs, instructions, failures)
+    # with failures as (number, kind, message).
+    def run_batch(self, seed, first, count):
+        failures = []
+        instructions = 0
+        for number in range(first, first + count):
+            program_failures, results = self.check(seed, number)
+            failures += [(number, kind, message) for kind, message in program_failures]
+            if "instruction level" in results:
+                instructions += results["instruction level"][3]
+        return count, instructions, failures
+
+_FUZZER = None
+
+def _init_worker(optimized, length, max_instructions):
+    global _FUZZER
+    _FUZZER = Fuzzer(optimized, length, max_instructions)
+
+def _run_batch(task):
+    return _FUZZER.run_batch(*task)
+
+# Yields the result of every batch, on `workers` processes.
+def run_farm(args, tasks):
+    if args.workers == 1:
+        _init_worker(args.optimized, args.length, args.max_instructions)
+        for task in tasks:
+            yield _run_batch(task)
+        return
+    with multiprocessing.Pool(args.workers, _init_worker, (args.optimized, args.length, args.max_instructions)) as pool:
+        for result in pool.imap_unordered(_run_batch, tasks):
+            yield result
+
+def replay(args):
+    fuzzer = Fuzzer(args.optimized, args.length, args.max_instructions)
+    source, _data = fuzzer.source(args.seed, args.replay)
+    print(source, end = "")
+    failures, results = fuzzer.check(args.seed, args.replay)
+    for name, (registers, memory, events, instructions, cycles) in results.items():
+        print("{:<18} {} instructions, {} cycles, {} RAM words, {} device events".format(
+            name, instructions, cycles, len(memory), len(events)))
+        print("{:<18} {}".format("", " ".join("{}={:x}".format(key, value) for key, value in registers.items())))
+    for kind, message in failures:
+        print("!! {}: {} !!".format(kind, message))
+    if failures:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Fuzzes the assembler, the disassembler and the simulators with random programs.")
+    parser.add_argument("--programs", type = int, default = 1000, help = "number of programs (default 1000)")
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1, help = "worker processes (default: one per core)")
+    parser.add_argument("--seed", type = int, default = 1, help = "seed of the programs (default 1)")
+    parser.add_argument("--length", type = int, default = 40, help = "instructions per program (default 40)")
+    parser.add_argument("--max-instructions", type = int, default = 2000,
+        help = "instructions run per program and level (default 2000)")
+    parser.add_argument("--batch", type = int, default = 50, help = "programs per task of a worker (default 50)")
+    parser.add_argument("--optimized", action = "store_true", help = "also run the merged microcode of optimize_microcode.py")
+    parser.add_argument("--save", metavar = "DIR", help = "write the source of every failing program to DIR")
+    parser.add_argument("--replay", metavar = "NUMBER", type = int, help = "print and check a single program")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        replay(args)
+        return
+    if args.workers < 1 or args.batch < 1:
+        print("!! --workers and --batch must be at least 1 !!")
+        sys.exit(1)
+
+    tasks = [(args.seed, first, min(args.batch, args.programs - first)) for first in range(0, args.programs, args.batch)]
+    failures = []
+    programs = 0
+    instructions = 0
+    started = time.perf_counter()
+    reported = started
+    for count, batch_instructions, batch_failures in run_farm(args, tasks):
+        programs += count
+        instructions += batch_instructions
+        for failure in batch_failures:
+            if len(failures) < 20:
+                print("!! program {}: {}: {} !!".format(*failure))
+        failures += batch_failures
+        if time.perf_counter() - reported > 10:
+            reported = time.perf_counter()
+            print("{} programs, {} failures, {:.1f} programs/s per core".format(
+                programs, len(failures), programs / (reported - started) / min(args.workers, os.cpu_count() or 1)))
+
+    elapsed = time.perf_counter() - started
+    cores = min(args.workers, os.cpu_count() or 1)
+    kinds = collections.Counter(kind for _number, kind, _message in failures)
+    print("{} programs ({} instructions on the instruction level) in {:.1f}s on {} workers".format(
+        programs, instructions, elapsed, args.workers))
+    print("{:.1f} programs/s, {:.1f} programs/s per core".format(programs / elapsed, programs / elapsed / cores))
+    print("failures: {}".format(", ".join("{} {}".format(count, kind) for kind, count in sorted(kinds.items())) or "none"))
+
+    if args.save and failures:
+        os.makedirs(args.save, exist_ok = True)
+        fuzzer = Fuzzer(False, args.length, args.max_instructions)
+        for number in sorted(set(number for number, _kind, _message in failures)):
+            source, _data = fuzzer.source(args.seed, number)
+            with open(os.path.join(args.save, "{}_{}.asm".format(args.seed, number)), "w") as file:
+                file.write(source)
+        print("failing programs written to {}".format(args.save))
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,9 @@ class MicroInstructions(Enum):
     RAM_Read = 0x8
     RAM_Write = 0x10
 
+    StackPointerIncrement = 0x20
+    StackPointerDecrement = 0x40
+
     # Outputs TODO
 
     # Inputs TODO
@@ -0,0 +1,69 @@
+#
+#   Meaning of the control word bits used by generate_cpu_microcode.py.
+#
+#   Every bit either drives the bus ("out"), latches the bus at the end of
+#   the step ("in") or does neither. `reads` is the state a bit depends on
+#   during the step, `writes` the state it changes at the clock edge.
+#
+#   The display and terminal take the RAM word at MAR directly (that is why
+#   `tw`/`dw` work without a bus driver in their last step), the nibble unit
+#   puts 4 bits of A on the bus, SUBTRACT and HIGH_NIBBLE select what the ALU
+#   and the nibble unit output.
+#
+
+# bit: (name, bus role, reads, writes)
+CONTROL_BITS = {
+    0:  ("OUT_IN", "in", (), ("OUT",)),
+    1:  ("PC_IN", "in", (), ("PC",)),
+    2:  ("PC_OUT", "out", ("PC",), ()),
+    3:  ("PC_INC", None, ("PC",), ("PC",)),
+    4:  ("STEP_RESET", None, (), ()),
+    5:  ("IR_IN", "in", (), ("IR",)),
+    6:  ("RAM_OUT", "out", ("MAR", "RAM"), ()),
+    7:  ("RAM_IN", "in", ("MAR",), ("RAM",)),
+    8:  ("MAR_IN", "in", (), ("MAR",)),
+    10: ("B_IN", "in", (), ("B",)),
+    11: ("SUBTRACT", None, (), ()),
+    12: ("ALU_OUT", "out", ("A", "B"), ()),
+    13: ("A_OUT", "out", ("A",), ()),
+    14: ("A_IN", "in", (), ("A",)),
+    15: ("HALT", None, (), ("HALT",)),
+    16: ("FLAGS_IN", None, ("A", "B"), ("FLAGS",)),
+    17: ("C_OUT", "out", ("C",), ()),
+    18: ("C_IN", "in", (), ("C",)),
+    22: ("DISPLAY_CLEAR", None, (), ("DISPLAY",)),
+    23: ("DISPLAY_WRITE", None, ("MAR", "RAM"), ("DISPLAY",)),
+    24: ("TERMINAL_CLEAR", None, (), ("TERMINAL",)),
+    25: ("TERMINAL_WRITE", None, ("MAR", "RAM"), ("TERMINAL",)),
+    29: ("NIBBLE_OUT", "out", ("A",), ()),
+    30: ("HIGH_NIBBLE", None, (), ()),
+}
+
+BITS = {name: 1 << bit for bit, (name, _role, _reads, _writes) in CONTROL_BITS.items()}
+KNOWN_MASK = sum(BITS.values())
+
+# bits changing what another bit does within the same step: modifier -> modified bits
+MODIFIERS = {
+    BITS["SUBTRACT"]: BITS["ALU_OUT"] | BITS["FLAGS_IN"],
+    BITS["HIGH_NIBBLE"]: BITS["NIBBLE_OUT"],
+}
+
+def bit_names(word):
+    return [name for bit, (name, _role, _reads, _writes) in sorted(CONTROL_BITS.items()) if word >> bit & 1]
+
+def unknown_bits(word):
+    return word & ~KNOWN_MASK
+
+# Bits of `word` driving the bus.
+def drivers(word):
+    return [name for bit, (name, role, _reads, _writes) in CONTROL_BITS.items() if role == "out" and word >> bit & 1]
+
+# Whether a bit of `word` latches the bus.
+def reads_bus(word):
+    return any(role == "in" and word >> bit & 1 for bit, (_name, role, _reads, _writes) in CONTROL_BITS.items())
+
+def reads(word):
+    return {state for bit, (_name, _role, states, _writes) in CONTROL_BITS.items() if word >> bit & 1 for state in states}
+
+def writes(word):
+    return {state for bit, (_name, _role, _reads, states) in CONTROL_BITS.items() if word >> bit & 1 for state in states}
@@ -0,0 +1,183 @@
+#!python3
+
+#
+#   Bit usage of the microcode control words and a narrower encoding of them.
+#
+#   Collects the distinct control words of newGenerator.py (or, with
+#   --generator old, of generate_cpu_microcode.py, or of any ROM image with
+#   --rom) and reports which bits are ever set, which bits always change
+#   together and which never appear in the same word.
+#
+#   Bits that always change together become one signal. Signals that never
+#   appear together are packed into one field holding the number of the
+#   signal that is on (0 for none), so a field of n signals takes
+#   log2(n + 1) bits instead of n. The proposed word is checked by encoding
+#   and decoding every control word; the decoder mapping (field code ->
+#   original bits) can be written as JSON.
+#
+#   Ex.: control_word_usage.py
+#        control_word_usage.py --generator old
+#        control_word_usage.py --rom bytecode/cpu_microcode.rom -o decoder.json
+#
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+import load_rom
+
+class ControlWordError(Exception):
+    pass
+
+# Distinct control words and the names of the known bits of a generator.
+def generator_words(generator):
+    if generator == "new":
+        import newGenerator
+        from Clean.MicroInstructions import MicroInstructions
+        microcode = newGenerator.generate_microcode(newGenerator.instruction_set)
+        names = {member.value: member.name for member in MicroInstructions}
+        for name in ("REG_SRC_EN", "REG_DEST_LD"):
+            names[getattr(newGenerator, name)] = name
+        names = {value.bit_length() - 1: name for value, name in names.items() if value & (value - 1) == 0}
+        return sorted({step['flag'] for step in microcode.values()} | {0}), names
+
+    import generate_cpu_microcode
+    from control_bits import CONTROL_BITS
+    microcode = generate_cpu_microcode.generate_microcode(generate_cpu_microcode.fetch, generate_cpu_microcode.instruction_set)
+    names = {bit: name for bit, (name, _role, _reads, _writes) in CONTROL_BITS.items()}
+    return sorted({step['flag'] for step in microcode} | {0}), names
+
+def rom_words(file_name):
+    try:
+        return np.unique(load_rom.read_file(file_name)).tolist(), {}
+    except load_rom.RawImageError as error:
+        raise ControlWordError(str(error)) from None
+
+def bit_label(bit, names):
+    return "{}({})".format(names[bit], bit) if bit in names else str(bit)
+
+# {bit: set of word indices (as an int bitmap)} of the bits set in any word.
+def bit_columns(words):
+    columns = {}
+    for index, word in enumerate(words):
+        bit = 0
+        while word >> bit:
+            if word >> bit & 1:
+                columns[bit] = columns.get(bit, 0) | 1 << index
+            bit += 1
+    return columns
+
+# Merges the bits set in exactly the same words: [(mask of the bits, column)].
+def signals(columns):
+    merged = {}
+    for bit, column in sorted(columns.items()):
+        merged[column] = merged.get(column, 0) | 1 << bit
+    return [(mask, column) for column, mask in merged.items()]
+
+# Packs signals that never appear in the same word into fields, the most
+# used signals first: [[mask, ...], ...]
+def pack_fields(signal_list):
+    fields = []
+    for mask, column in sorted(signal_list, key = lambda signal: (-bin(signal[1]).count("1"), signal[0])):
+        for field in fields:
+            if all(column & other == 0 for _mask, other in field):
+                field.append((mask, column))
+                break
+        else:
+            fields.append([(mask, column)])
+    return [[mask for mask, _column in field] for field in fields]
+
+# Bit offset and width of every field.
+def field_layout(fields):
+    layout = []
+    offset = 0
+    for field in fields:
+        width = len(field).bit_length()     # codes 0 (none) .. len(field)
+        layout.append((offset, width))
+        offset += width
+    return layout
+
+def encode(word, fields, layout):
+    encoded = 0
+    for field, (offset, _width) in zip(fields, layout):
+        for code, mask in enumerate(field, 1):
+            if word & mask:
+                encoded |= code << offset
+                break
+    return encoded
+
+def decode(encoded, fields, layout):
+    word = 0
+    for field, (offset, width) in zip(fields, layout):
+        code = encoded >> offset & ((1 << width) - 1)
+        if code:
+            word |= field[code - 1]
+    return word
+
+def bits_of(mask):
+    return [bit for bit in range(mask.bit_length()) if mask >> bit & 1]
+
+def report(words, names, fields, layout):
+    used = 0
+    for word in words:
+        used |= word
+    width = max(used.bit_length(), 1)
+    narrow = sum(field_width for _offset, field_width in layout)
+
+    lines = ["{} distinct control words, {} bits wide, {} bits used".format(len(words), width, bin(used).count("1"))]
+    unused = [bit for bit in range(width) if not used >> bit & 1]
+    lines.append("never set: " + (" ".join(bit_label(bit, names) for bit in unused) or "-"))
+    together = [mask for field in fields for mask in field if mask & (mask - 1)]
+    lines.append("always together: " + (", ".join(" ".join(bit_label(bit, names) for bit in bits_of(mask)) for mask in together) or "-"))
+
+    lines.append("")
+    lines.append("{:<6} {:>5}  {}".format("field", "bits", "codes (0 = none)"))
+    for number, (field, (offset, field_width)) in enumerate(zip(fields, layout)):
+        position = str(offset) if field_width == 1 else "{}-{}".format(offset, offset + field_width - 1)
+        codes = ["{}={}".format(code, "+".join(bit_label(bit, names) for bit in bits_of(mask))) for code, mask in enumerate(field, 1)]
+        lines.append("{:<6} {:>5}  {}".format(number, position, " ".join(codes)))
+
+    lines.append("")
+    lines.append("field encoded word: {} bits instead of {} ({} hex digits instead of {}, {:.0f}% smaller ROM)".format(
+        narrow, width, (narrow + 3) // 4, (width + 3) // 4, 100 - 100 * ((narrow + 3) // 4) / ((width + 3) // 4)))
+    lines.append("a table of the distinct words would take {} bits per step plus a {} word decoder ROM".format(
+        max(len(words) - 1, 1).bit_length(), len(words)))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description = "Reports the bit usage of the microcode control words and proposes a narrower encoding.")
+    parser.add_argument("--generator", choices = ("new", "old"), default = "new",
+        help = "microcode of newGenerator.py (default) or generate_cpu_microcode.py")
+    parser.add_argument("--rom", help = "read the control words from this ROM image instead")
+    parser.add_argument("-o", "--output", help = "write the decoder mapping to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        words, names = rom_words(args.rom) if args.rom else generator_words(args.generator)
+    except (OSError, ControlWordError) as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
+
+    fields = pack_fields(signals(bit_columns(words)))
+    layout = field_layout(fields)
+    for word in words:
+        if decode(encode(word, fields, layout), fields, layout) != word:
+            print("!! 0x{:x} does not survive the encoding !!".format(word))
+            sys.exit(1)
+
+    for line in report(words, names, fields, layout):
+        print(line)
+
+    if args.output:
+        mapping = {
+            "width": sum(width for _offset, width in layout),
+            "fields": [{"offset": offset, "width": width, "codes": {str(code): mask for code, mask in enumerate(field, 1)}}
+                for field, (offset, width) in zip(fields, layout)],
+        }
+        with open(args.output, "w") as file:
+            json.dump(mapping, file, indent = 4)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 #!python3
 
+import json
+import os
 import save_rom
 import sys
 
@@ -214,6 +216,20 @@ instruction_set = [
     # RTS -> [ load C-Register , save position-value ]
 ]
 
+# Fused instruction pairs written by superinstructions.py, added to the
+# instruction set when the file exists.
+SUPERINSTRUCTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "superinstructions.json")
+
+# Reads the fused instructions of `file_name` as instruction set entries.
+def load_superinstructions(file_name = SUPERINSTRUCTIONS_FILE):
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name, "r") as file:
+        fused = json.load(file)['fused']
+    return [dict(variant, op_code = instruction['op_code']) for instruction in fused for variant in instruction['variants']]
+
+instruction_set += load_superinstructions()
+
 # Converts a value to an array if the value is not an array yet.
 def cast_array(value):
     return value if isinstance(value, list) else [value]
@@ -291,30 +307,49 @@ def fill_microcode_addresses(microcode):
 
     return filled_microcode
 
-# sys.argv.append("-v")
-# sys.argv.append("test")
+if __name__ == "__main__":
+    # sys.argv.append("-v")
+    # sys.argv.append("test")
 
-# Validates the arguments.
-arguments_num = len(sys.argv)
-if(arguments_num <= 1 or arguments_num > 3):
-    print(" Invalid arguments.\n Ex.: generate_cpu_microcode.py [-v] your_filename.rom")
-    print("   -v   Verbose mode (optional)\n")
-    exit(1)
+    # Phase statistics: --stats prints time and peak memory per phase,
+    # --profile FILE also writes a cProfile dump.
+    from phase_stats import PhaseStats
+    stats_enabled = "--stats" in sys.argv
+    if stats_enabled:
+        sys.argv.remove("--stats")
+    profile_file = None
+    if "--profile" in sys.argv and sys.argv.index("--profile") + 1 < len(sys.argv):
+        position = sys.argv.index("--profile")
+        profile_file = sys.argv[position + 1]
+        del sys.argv[position:position + 2]
+    stats = PhaseStats(stats_enabled, profile_file)
 
-# Gets the arguments values.
-verbose = (arguments_num == 3 and sys.argv[1] == '-v')
-file_name = sys.argv[2 if arguments_num == 3 else 1]
+    # Validates the arguments.
+    arguments_num = len(sys.argv)
+    if(arguments_num <= 1 or arguments_num > 3):
+        print(" Invalid arguments.\n Ex.: generate_cpu_microcode.py [-v] [--stats] [--profile FILE] your_filename.rom")
+        print("   -v         Verbose mode (optional)")
+        print("   --stats    Time and peak memory of every phase (optional)")
+        print("   --profile  Writes a cProfile dump of the phases to FILE (optional)\n")
+        exit(1)
 
-# Generates the codes table.
-microcode = generate_microcode(fetch, instruction_set)
-microcode = fill_microcode_addresses(microcode)
-if verbose:
-    print_microcode(microcode)
+    # Gets the arguments values.
+    verbose = (arguments_num == 3 and sys.argv[1] == '-v')
+    file_name = sys.argv[2 if arguments_num == 3 else 1]
 
-# Saves the code table in a ROM file.
-instruction_size = 32 # bytes
-save_rom.save_file(
-    file_name,
-    [instruction_step["flag"] for instruction_step in microcode],
-    instruction_size)
+    # Generates the codes table.
+    with stats.phase("generate"):
+        microcode = generate_microcode(fetch, instruction_set)
+    with stats.phase("fill"):
+        microcode = fill_microcode_addresses(microcode)
+    if verbose:
+        print_microcode(microcode)
 
+    # Saves the code table in a ROM file.
+    instruction_size = 32 # bytes
+    with stats.phase("save"):
+        save_rom.save_file(
+            file_name,
+            [instruction_step["flag"] for instruction_step in microcode],
+            instruction_size)
+    stats.report()
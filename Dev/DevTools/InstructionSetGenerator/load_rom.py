@@ -0,0 +1,177 @@
+#
+#   Reads Logisim "v2.0 raw" images (save_rom.py output, assembled programs,
+#   images saved by Logisim) into a uint32 array.
+#
+#   Files of equally wide words without runs, like save_rom writes them, are
+#   read as one (words, digits) character matrix. Everything else - words of
+#   different widths, "N*value" runs - is split into fields with NumPy in
+#   chunks, nothing is parsed word by word. Zero runs are not written into
+#   the (zeroed) result, so a long run up to a high address costs nothing.
+#
+#   Ex.: words = load_rom.read_file("bytecode/cpu_microcode.rom")
+#
+
+import numpy as np
+
+HEADER = b"v2.0 raw"
+CHUNK_BYTES = 1 << 23       # text parsed at once by the general parser
+
+class RawImageError(Exception):
+    pass
+
+_HEX_VALUES = np.full(256, 0xFF, dtype = np.uint8)
+for _digit, _char in enumerate(b"0123456789abcdef"):
+    _HEX_VALUES[_char] = _digit
+    _HEX_VALUES[bytes([_char]).upper()[0]] = _digit
+
+_WHITESPACE = bytes.maketrans(b"\t\r\n\v\f", b"     ")
+_SPACE = ord(" ")
+_STAR = ord("*")
+
+# Converts the rows of `digits` (an (n, width) array of hex characters) to words.
+# Returns None if a character is not a hex digit or a word is wider than 32 bits.
+def _parse_hex_rows(digits):
+    values = _HEX_VALUES[digits]
+    if values.size and values.max() == 0xFF:
+        return None
+    if values.shape[1] % 2:
+        values = np.concatenate((np.zeros((len(values), 1), dtype = np.uint8), values), axis = 1)
+    # two digits make a byte, the bytes are read as one big endian number
+    packed = (values[:, 0::2] << 4) | values[:, 1::2]
+    size = packed.shape[1]
+    if size > 4:
+        return None
+    words = np.zeros((len(packed), 4), dtype = np.uint8)
+    words[:, 4 - size:] = packed
+    return words.view(">u4").reshape(-1).astype(np.uint32)
+
+# Reads a body of equally wide words separated by whitespace, None if it is not one.
+def _parse_fixed_width(body):
+    # a single space between the words, none around them
+    text = np.frombuffer(body.translate(_WHITESPACE), dtype = np.uint8)
+    space = text == _SPACE
+    keep = ~space
+    keep[1:] |= space[1:] & ~space[:-1]
+    text = text[keep]
+    if len(text) and text[-1] == _SPACE:
+        text = text[:-1]
+    if len(text) and text[0] == _SPACE:
+        text = text[1:]
+    if len(text) == 0:
+        return np.zeros(0, dtype = np.uint32)
+
+    # every field has exactly `width` digits: the separators sit every width + 1
+    # characters and there are no others
+    space = text == _SPACE
+    width = int(np.argmax(space)) or len(text)
+    if (len(text) + 1) % (width + 1) or int(space.sum()) != len(text) // (width + 1) \
+            or not space[width::width + 1].all():
+        return None
+    digits = np.frombuffer(body.translate(None, b" \t\r\n\v\f"), dtype = np.uint8)
+    return _parse_hex_rows(digits.reshape(-1, width))
+
+# Splits normalized text (single byte separators) into fields and parses them.
+# Returns (values, counts) or None if the text is malformed.
+def _parse_fields(text):
+    text = np.frombuffer(text, dtype = np.uint8)
+    star = text == _STAR
+    field = ~(star | (text == _SPACE))
+    edges = np.diff(np.concatenate(([False], field, [False])).view(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return np.zeros(0, dtype = np.uint32), np.zeros(0, dtype = np.int64)
+
+    # "count*value": a count is directly followed by '*' and its value
+    is_count = np.zeros(len(starts), dtype = bool)
+    is_count[:-1] = star[ends[:-1]]
+    if star.sum() != is_count.sum():
+        return None
+    counted = np.flatnonzero(is_count)
+    if len(counted) and (counted[-1] == len(starts) - 1 or is_count[counted + 1].any()
+            or (starts[counted + 1] != ends[counted] + 1).any()):
+        return None
+
+    # fields of one width are parsed together as a character matrix
+    lengths = ends - starts
+    numbers = np.zeros(len(starts), dtype = np.int64)
+    for decimal in (False, True):
+        kind = is_count if decimal else ~is_count
+        for length in np.flatnonzero(np.bincount(lengths[kind])).tolist():
+            selected = np.flatnonzero(kind & (lengths == length))
+            characters = text[starts[selected, None] + np.arange(length)]
+            if not decimal:
+                values = _parse_hex_rows(characters)
+                if values is None:
+                    return None
+                numbers[selected] = values
+                continue
+            digits = _HEX_VALUES[characters]
+            if length > 18 or (digits > 9).any():
+                return None
+            numbers[selected] = digits.astype(np.int64) @ (10 ** np.arange(length - 1, -1, -1, dtype = np.int64))
+
+    counts = np.ones(len(starts), dtype = np.int64)
+    counts[counted + 1] = numbers[counted]
+    keep = ~is_count
+    return numbers[keep].astype(np.uint32), counts[keep]
+
+# Parses the body with the general parser, in chunks split at whitespace.
+def _parse_runs(body):
+    body = body.translate(_WHITESPACE)
+    values = []
+    counts = []
+    position = 0
+    while position < len(body):
+        end = body.find(b" ", position + CHUNK_BYTES)
+        end = len(body) if end < 0 else end
+        fields = _parse_fields(body[position:end])
+        if fields is None:
+            return None
+        values.append(fields[0])
+        counts.append(fields[1])
+        position = end
+    if not values:
+        return np.zeros(0, dtype = np.uint32)
+
+    values = np.concatenate(values)
+    counts = np.concatenate(counts)
+    words = np.zeros(int(counts.sum()), dtype = np.uint32)
+    # only runs of non-zero values are written
+    used = np.flatnonzero(values)
+    lengths = counts[used]
+    firsts = (np.cumsum(counts) - counts)[used]
+    offsets = np.cumsum(lengths) - lengths
+    words[np.repeat(firsts - offsets, lengths) + np.arange(int(lengths.sum()))] = np.repeat(values[used], lengths)
+    return words
+
+# Finds the first malformed word of a body the fast parsers rejected.
+def _find_error(body):
+    for token in body.split():
+        count, _, value = token.rpartition(b"*")
+        try:
+            if int(value, 16) >> 32 or (b"*" in token and int(count) < 0):
+                raise ValueError()
+        except ValueError:
+            return "invalid word '{}'".format(token.decode("ascii", "replace"))
+    return "malformed image"
+
+# Parses the text of a "v2.0 raw" image (bytes, with the header line).
+def parse_image(data, name = "image"):
+    header, _, body = data.partition(b"\n")
+    if header.strip() != HEADER:
+        raise RawImageError("{}: not a 'v2.0 raw' image".format(name))
+
+    words = None
+    if b"*" not in body:
+        words = _parse_fixed_width(body)
+    if words is None:
+        words = _parse_runs(body)
+    if words is None:
+        raise RawImageError("{}: {}".format(name, _find_error(body)))
+    return words
+
+# Reads a "v2.0 raw" image file into a uint32 array.
+def read_file(file_name):
+    with open(file_name, "rb") as file:
+        return parse_image(file.read(), file_name)
@@ -1,6 +1,7 @@
 import sys
 import save_rom
 from pprint import pprint
+from Clean.MicroInstructions import MicroInstructions, Registers
 
 # --- Control Word Bit Definitions ---
 # The register control signals are now separated:
@@ -13,6 +14,20 @@ from pprint import pprint
 
 REG_SRC_EN = 1 << 22  # Read from register (R_src outputs data)
 REG_DEST_LD = 1 << 23 # Store to register (R_dest loads data)
+REG_SHIFT = 18        # Bits 18-21: register addressed by the control word (like PC in FETCH)
+
+# The memory and stack pointer bits of Clean/MicroInstructions.py. The stack pointer
+# counts like the program counter, on bits 5 and 6; the circuit does not wire them
+# to SP yet (see docs/InstructionSet.md).
+RAM_ADDRESS_LOAD = MicroInstructions.RAM_Address_Load.value
+RAM_READ = MicroInstructions.RAM_Read.value
+RAM_WRITE = MicroInstructions.RAM_Write.value
+PC_INCREMENT = 0x010000 | MicroInstructions.EnablePC.value
+SP_INCREMENT = MicroInstructions.StackPointerIncrement.value
+SP_DECREMENT = MicroInstructions.StackPointerDecrement.value
+
+SP = Registers.SP.value
+PC = Registers.PC.value
  
 FETCH = [0x7C0004, 0x01000B]
 INSTRUCTION_END = [0x000800] 
@@ -34,6 +49,33 @@ MOV_STEPS = [
     REG_DEST_LD   # Step 3: R_dest (IR[12-15]) loads from data bus
 ]
 
+# --- CALL / RTS Microcode Sequences ---
+# SP points to the next free word of the stack (SYSTEM_MEM, set with `ldi SP, 0xf001`)
+# and grows upwards. CALL pushes the address of its operand word, RTS pops it and
+# steps over the operand, so a nested call costs the same fixed steps as any other.
+CALL_STEPS = [
+    REG_SRC_EN | SP << REG_SHIFT | RAM_ADDRESS_LOAD,            # SP -> MAR
+    REG_SRC_EN | PC << REG_SHIFT | RAM_WRITE | SP_INCREMENT,    # PC -> RAM[SP], SP + 1
+    REG_SRC_EN | PC << REG_SHIFT | RAM_ADDRESS_LOAD,            # PC -> MAR
+    REG_DEST_LD | PC << REG_SHIFT | RAM_READ                    # target -> PC
+]
+# --- JP / JPZ / JPC Microcode Sequences ---
+# The target follows the instruction word. The conditional jumps share one
+# opcode; the variant of the other flag state steps over the target.
+JP_STEPS = [
+    REG_SRC_EN | PC << REG_SHIFT | RAM_ADDRESS_LOAD,            # PC -> MAR
+    REG_DEST_LD | PC << REG_SHIFT | RAM_READ                    # target -> PC
+]
+SKIP_STEPS = [
+    PC_INCREMENT                                                # over the target
+]
+RTS_STEPS = [
+    SP_DECREMENT,                                               # SP - 1
+    REG_SRC_EN | SP << REG_SHIFT | RAM_ADDRESS_LOAD,            # SP -> MAR
+    REG_DEST_LD | PC << REG_SHIFT | RAM_READ,                   # RAM[SP] -> PC
+    PC_INCREMENT                                                # over the operand of the CALL
+]
+
 instruction_set = [
     {   
         'name': 'nop',
@@ -61,7 +103,7 @@ instruction_set = [
     {
         'name': 'ldi_addr', # loading immediate from RAM location into register
         'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
-        'steps': generateInstruction() # TODO
+        'steps': generateInstruction([0x7C0004, 0x01000E, 0x800008])
     },
     
     {
@@ -97,9 +139,65 @@ instruction_set = [
         'steps': generateInstruction([0x883000])
     },
     {
-        'name': 'div',
+        'name': 'shift',
         'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
         'steps': generateInstruction([0x884000])
+    },
+
+    # subroutines
+    {
+        'name': 'call', # pushing the return address and jumping to the operand
+        'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction(CALL_STEPS)
+    },
+    {
+        'name': 'rts', # returning to the address on top of the stack
+        'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction(RTS_STEPS)
+    },
+
+    # added after the subroutines, so the opcodes above stay the same
+    {
+        'name': 'and',
+        'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction([0x885000])
+    },
+    {
+        'name': 'or',
+        'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction([0x886000])
+    },
+    {
+        'name': 'xor',
+        'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction([0x887000])
+    },
+
+    # jumps, the _zf0/_zf1 and _cf0/_cf1 variants share the opcode of their instruction
+    {
+        'name': 'jp',
+        'flags': {'c': [0, 1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction(JP_STEPS)
+    },
+    {
+        'name': 'jpz_zf0',
+        'flags': {'c': [0, 1], 'z': [0], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction(SKIP_STEPS)
+    },
+    {
+        'name': 'jpz_zf1',
+        'flags': {'c': [0, 1], 'z': [1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction(JP_STEPS)
+    },
+    {
+        'name': 'jpc_cf0',
+        'flags': {'c': [0], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction(SKIP_STEPS)
+    },
+    {
+        'name': 'jpc_cf1',
+        'flags': {'c': [1], 'z': [0, 1], 'l': [0, 1], 'g': [0, 1]},
+        'steps': generateInstruction(JP_STEPS)
     }
 ]
 
@@ -131,16 +229,28 @@ def create_instruction_microcode(instruction):
                         
     return microcode_steps
 
+# flag variants of one instruction, they share its opcode
+VARIANT_SUFFIXES = ("_zf0", "_zf1", "_cf0", "_cf1")
+
+def base_name(name):
+    return name.rsplit("_", 1)[0] if name.endswith(VARIANT_SUFFIXES) else name
+
 instructions = {}
 def generate_microcode(instruction_set):
     global instructions
     currentOpCode = 0
     
+    opcodes = {}
     microcode = {}
     for instruction in instruction_set:
-        instruction['op_code'] = currentOpCode
-        instructions[instruction['name']] = f"0x{currentOpCode:06X}"
-        currentOpCode += 1
+        name = base_name(instruction['name'])
+        if name in opcodes:
+            instruction['op_code'] = opcodes[name]
+        else:
+            opcodes[name] = currentOpCode
+            instruction['op_code'] = currentOpCode
+            instructions[name] = f"0x{currentOpCode:06X}"
+            currentOpCode += 1
         steps = create_instruction_microcode(instruction)
         for step in steps:
             if step['address'] in microcode:
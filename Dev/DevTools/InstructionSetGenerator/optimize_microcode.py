@@ -0,0 +1,262 @@
+#!python3
+
+#
+#   Shortens the microcode of generate_cpu_microcode.py by merging steps.
+#
+#   Two adjacent execute steps become one when doing both in the same clock
+#   cycle gives the same result (see control_bits.py for the bit model):
+#     - the second step does not read state the first one writes
+#       (MAR before RAM_OUT, PC_INC before PC_OUT, B_IN before the ALU, ...)
+#     - they do not write the same state
+#     - at most one source drives the bus and every step latching the bus
+#       still sees the value it saw before
+#     - SUBTRACT / HIGH_NIBBLE stay the same for the step using them
+#   Steps without any effect (RAM_OUT nobody latches, empty steps) are
+#   dropped and `fin_inst` is folded into the last execute step. The fetch
+#   steps are shared by all opcodes and stay as they are.
+#
+#   --verify runs random programs on the microcode simulator with both
+#   microcodes and on the instruction level simulator, and compares the
+#   registers, the RAM and the device output.
+#
+#   Ex.: optimize_microcode.py                          (report only)
+#        optimize_microcode.py --verify 200
+#        optimize_microcode.py -o bytecode/cpu_microcode_fast.rom
+#
+
+import argparse
+import copy
+import os
+import random
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "Simulator"))
+
+import numpy as np
+
+import generate_cpu_microcode
+import save_rom
+import simulator
+from control_bits import BITS, MODIFIERS, drivers, reads, reads_bus, unknown_bits, writes
+from devices import DISPLAY_PORT, TERMINAL_PORT, Device, DeviceBus
+from microcode_simulator import MicrocodeError, MicrocodeSimulator
+
+FETCH_STEPS = len(generate_cpu_microcode.fetch)
+STEP_RESET = BITS["STEP_RESET"]
+
+# Whether a step changes anything.
+def has_effect(word):
+    return bool(writes(word) or word & STEP_RESET or unknown_bits(word))
+
+# Why two adjacent steps cannot be done in one cycle, None if they can.
+def merge_conflict(first, second):
+    if unknown_bits(first) or unknown_bits(second):
+        return "unknown control bits"
+    if first & STEP_RESET:
+        return "the first step ends the instruction"
+    if writes(first) & reads(second):
+        return "reads {} written by the step before".format(", ".join(sorted(writes(first) & reads(second))))
+    if writes(first) & writes(second):
+        return "both write {}".format(", ".join(sorted(writes(first) & writes(second))))
+
+    merged = first | second
+    sources = set(drivers(first)) | set(drivers(second))
+    if len(sources) > 1:
+        return "bus driven by {}".format(" and ".join(sorted(sources)))
+    for word in (first, second):
+        if reads_bus(word) and set(drivers(word)) != sources:
+            return "the bus value changes"
+        for modifier, modified in MODIFIERS.items():
+            if word & modified and word & modifier != merged & modifier:
+                return "the ALU/nibble mode changes"
+    return None
+
+# Returns the merged steps of one instruction.
+def optimize_steps(steps):
+    body = [word for word in steps[FETCH_STEPS:] if has_effect(word)]
+    merged = []
+    for word in body:
+        if merged and merge_conflict(merged[-1], word) is None:
+            merged[-1] |= word
+        else:
+            merged.append(word)
+    return steps[:FETCH_STEPS] + merged
+
+# Returns (optimized copy of the instruction set, report rows). A row is
+# (name, op_code, steps before, steps after, note).
+def optimize_instruction_set(instruction_set):
+    optimized = copy.deepcopy(instruction_set)
+    report = []
+    for instruction in optimized:
+        steps = generate_cpu_microcode.cast_array(instruction['flags'])
+        note = ""
+        conditional = not isinstance(instruction['cf'], list) or not isinstance(instruction['zf'], list)
+        if conditional and any("FLAGS" in writes(word) for word in steps):
+            # later steps would be read from the entry of the new flags
+            new_steps = steps
+            note = "kept, writes the flags it is selected by"
+        else:
+            new_steps = optimize_steps(steps)
+        instruction['flags'] = new_steps
+        report.append((instruction['name'], instruction['op_code'], len(steps), len(new_steps), note))
+    return optimized, report
+
+def print_report(report):
+    print("{:<14} {:>6} {:>7} {:>6} {:>6}".format("instruction", "opcode", "before", "after", "saved"))
+    for name, op_code, before, after, note in report:
+        print("{:<14} {:>6} {:>7} {:>6} {:>6}  {}".format(name, "0x{:02x}".format(op_code), before, after, before - after, note))
+    before = sum(row[2] for row in report)
+    after = sum(row[3] for row in report)
+    print("{} steps -> {} steps, {:.2f} -> {:.2f} cycles per instruction on average".format(
+        before, after, before / len(report), after / len(report)))
+
+#
+#   Verification
+#
+
+DATA_START = 0x100
+DATA_WORDS = 32
+
+# Number of operand words of every instruction, counted from its PC increments.
+def operand_counts(instruction_set):
+    counts = {}
+    for instruction in instruction_set:
+        steps = generate_cpu_microcode.cast_array(instruction['flags'])[FETCH_STEPS:]
+        count = sum(1 for word in steps if word & BITS["PC_INC"])
+        base = instruction['name'].rsplit("_", 1)[0] if instruction['name'].endswith(("_0", "_1", "_zf0", "_zf1", "_cf0", "_cf1")) else instruction['name']
+        counts[base] = (instruction['op_code'], max(count, counts.get(base, (0, 0))[1]))
+    return counts
+
+# Kind of every operand word of `name` ("target", "address" or "value"),
+# fused pairs (superinstructions.py) take the operands of both instructions.
+def operand_kinds(counts, name):
+    kinds = []
+    for part in name.split("+"):
+        if part in ("jp_addr", "jpz_addr", "jpc_addr", "lb", "lbz", "lbc", "lpc_num"):
+            kind = "target"
+        elif part.endswith("_addr") or part in ("spc",):
+            kind = "address"
+        else:
+            kind = "value"
+        kinds += [kind] * counts[part][1]
+    return kinds
+
+# Builds a random program ending with `halt` whose jumps only go forward.
+def random_program(counts, rng, length = 60):
+    values = lambda: rng.choice([0, 1, 0xF, 0xFFFFFF, rng.randrange(1 << 24), rng.randrange(64)])
+    names = [name for name in counts if name != "halt"]
+    plan = []
+    for _ in range(length):
+        name = rng.choice(names)
+        if name.split("+")[-1] in ("rts", "rtc", "rtz"):
+            # C has to hold the start of an instruction
+            plan.append(("lpc_num", "forward"))
+        plan.append((name, None))
+
+    # jump targets, returns are only reached through the `lpc_num` before them
+    starts = []
+    address = 0
+    for name, _kind in plan:
+        starts.append(None if name.split("+")[-1] in ("rts", "rtc", "rtz") else address)
+        address += 1 + counts[name][1]
+    end = address
+
+    words = []
+    for index, (name, kind) in enumerate(plan):
+        words.append(counts[name][0])
+        for operand in operand_kinds(counts, name):
+            if kind == "forward" or operand == "target":
+                words.append(rng.choice([start for start in starts[index + 1:] if start is not None] + [end]))
+            elif operand == "address":
+                words.append(DATA_START + rng.randrange(DATA_WORDS))
+            else:
+                words.append(values())
+    words.append(counts["halt"][0])
+    data = [values() for _ in range(DATA_WORDS)]
+    return words, data
+
+# Records what the instruction level simulator sends to a device.
+class Recorder(Device):
+    def __init__(self, events, device):
+        self.events = events
+        self.device = device
+
+    def write(self, word):
+        self.events.append((self.device, "write", word))
+
+    def clear(self):
+        self.events.append((self.device, "clear", 0))
+
+# Runs `programs` random programs, returns a list of differences (empty if none)
+# and the cycles of both microcodes.
+def verify(instruction_set, optimized, programs, seed = 1):
+    original_rom = generate_cpu_microcode.generate_microcode(generate_cpu_microcode.fetch, instruction_set)
+    optimized_rom = generate_cpu_microcode.generate_microcode(generate_cpu_microcode.fetch, optimized)
+    counts = operand_counts(instruction_set)
+    rng = random.Random(seed)
+
+    differences = []
+    cycles = [0, 0]
+    for number in range(programs):
+        words, data = random_program(counts, rng)
+        results = []
+        for i, rom in enumerate((original_rom, optimized_rom)):
+            cpu = MicrocodeSimulator(rom)
+            cpu.load(words)
+            cpu.load(data, DATA_START)
+            try:
+                cpu.run(len(words) * 4)
+            except MicrocodeError as error:
+                differences.append("program {}: {}".format(number, error))
+            cycles[i] += cpu.cycles
+            results.append((cpu.registers(), cpu.memory(), cpu.events, cpu.instructions))
+
+        events = []
+        bus = DeviceBus()
+        bus.attach(TERMINAL_PORT, Recorder(events, "terminal"))
+        bus.attach(DISPLAY_PORT, Recorder(events, "display"))
+        cpu = simulator.Simulator(bus, instruction_set)
+        cpu.load(words)
+        cpu.load(data, DATA_START)
+        cpu.run(results[0][3])
+        used = np.flatnonzero(cpu.memory.array)
+        memory = {int(address): int(cpu.memory.array[address]) for address in used}
+        registers = {name: int(getattr(cpu, name)) for name in results[0][0]}
+        results.append((registers, memory, events, cpu.instructions))
+
+        for name, (registers, memory, events, instructions) in zip(("optimized", "instruction level"), results[1:]):
+            if (registers, memory, events, instructions) != results[0]:
+                differences.append("program {}: {} simulation differs: {} {}".format(
+                    number, name, registers, results[0][0]))
+    return differences, cycles
+
+def main():
+    parser = argparse.ArgumentParser(description = "Merges microcode steps of generate_cpu_microcode.py.")
+    parser.add_argument("-o", "--output", metavar = "ROM", help = "write the optimized microcode ROM")
+    parser.add_argument("--verify", metavar = "PROGRAMS", type = int, nargs = "?", const = 100,
+        help = "compare both microcodes on random programs (default 100)")
+    args = parser.parse_args()
+
+    instruction_set = generate_cpu_microcode.instruction_set
+    optimized, report = optimize_instruction_set(instruction_set)
+    print_report(report)
+
+    if args.verify:
+        differences, cycles = verify(instruction_set, optimized, args.verify)
+        for difference in differences[:20]:
+            print("!! {} !!".format(difference))
+        print("{} programs: {} -> {} cycles ({:.1f}% fewer){}".format(
+            args.verify, cycles[0], cycles[1], 100 * (1 - cycles[1] / max(cycles[0], 1)),
+            ", {} differences".format(len(differences)) if differences else ", identical results"))
+        if differences:
+            sys.exit(1)
+
+    if args.output:
+        microcode = generate_cpu_microcode.generate_microcode(generate_cpu_microcode.fetch, optimized)
+        microcode = generate_cpu_microcode.fill_microcode_addresses(microcode)
+        save_rom.save_file(args.output, [step["flag"] for step in microcode], 32)
+        print("optimized microcode written to {}".format(args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#
+#   Phase timing for the build tools (--stats of assemblyCompilerv2.py,
+#   newAssembler.py and generate_cpu_microcode.py).
+#
+#   Every phase records its wall time and the peak of the memory allocated
+#   while it ran (tracemalloc). With a profile file the phases also run under
+#   cProfile, the statistics are written to the file and the most expensive
+#   functions are printed after the table.
+#   A disabled PhaseStats does nothing, so the tools always call it.
+#
+#   Ex.: stats = PhaseStats(enabled = True, profile = "build.prof")
+#        with stats.phase("tokenize"):
+#            tokens = tokenizer(source)
+#        stats.report()
+#
+
+import contextlib
+import cProfile
+import pstats
+import time
+import tracemalloc
+
+PROFILE_LINES = 15      # functions printed from the profile
+
+class PhaseStats:
+    def __init__(self, enabled = False, profile = None):
+        self.enabled = enabled or profile is not None
+        self.profile = profile
+        self.profiler = cProfile.Profile() if profile is not None else None
+        self.phases = []    # (name, seconds, peak bytes)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if self.profiler is not None:
+            self.profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            if self.profiler is not None:
+                self.profiler.disable()
+            peak = tracemalloc.get_traced_memory()[1] - start_memory
+            self.phases.append((name, seconds, max(peak, 0)))
+
+    # Prints the table of the phases and writes the profile.
+    def report(self):
+        if not self.enabled:
+            return
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        total = sum(seconds for _name, seconds, _peak in self.phases)
+        print("{:<22} {:>10} {:>7} {:>12}".format("phase", "time", "share", "peak memory"))
+        for name, seconds, peak in self.phases:
+            print("{:<22} {:>9.4f}s {:>6.1f}% {:>12}".format(name, seconds, 100 * seconds / (total or 1), format_bytes(peak)))
+        print("{:<22} {:>9.4f}s".format("total", total))
+
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile)
+            print("\nprofile written to {}, top {} functions by cumulative time:".format(self.profile, PROFILE_LINES))
+            pstats.Stats(self.profiler).sort_stats("cumulative").print_stats(PROFILE_LINES)
+
+def format_bytes(count):
+    for unit in ("B", "KiB", "MiB"):
+        if count < 1024:
+            return "{:.1f} {}".format(count, unit) if unit != "B" else "{} B".format(count)
+        count /= 1024
+    return "{:.1f} GiB".format(count)
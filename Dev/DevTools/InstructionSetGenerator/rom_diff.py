@@ -0,0 +1,212 @@
+#!python3
+
+#
+#   Compares two microcode ROM images and lists the differences per
+#   instruction instead of per text line.
+#
+#   Both images are memory-mapped. Images written by save_rom.py with the
+#   same word width have every word at a fixed byte offset, so they are
+#   compared byte for byte in one NumPy pass and only the differing words
+#   are parsed. Other images (runs, different widths) are read with
+#   load_rom.py and compared word for word, also in one pass.
+#
+#   Every differing address is split into opcode, flags and step with the
+#   address layout of newGenerator.py (flags << 20 | opcode << 4 | step,
+#   flags = c z l g) or, with --layout old, of generate_cpu_microcode.py
+#   (opcode << 5 | c << 4 | z << 3 | step). The flag states sharing one
+#   change are merged into patterns, '-' meaning either value.
+#
+#   Ex.: rom_diff.py bytecode/cpu_microcode.rom new_microcode.rom
+#        rom_diff.py old.rom new.rom --layout old
+#
+
+import argparse
+import collections
+import mmap
+import sys
+
+import numpy as np
+
+import load_rom
+from control_bits import bit_names
+
+# layout: (flag names, step bits, opcode shift, opcode mask, flag shift)
+LAYOUTS = {
+    "new": ("czlg", 4, 4, 0xFFFF, 20),
+    "old": ("cz", 3, 5, 0xFFFF, 3),
+}
+
+_HEX_VALUES = np.full(256, 0xFF, dtype = np.uint8)
+for _digit, _char in enumerate(b"0123456789abcdef"):
+    _HEX_VALUES[_char] = _digit
+    _HEX_VALUES[bytes([_char]).upper()[0]] = _digit
+
+class RomDiffError(Exception):
+    pass
+
+# Opcode -> instruction name of the generator of a layout.
+def instruction_names(layout):
+    if layout == "new":
+        import newGenerator
+        newGenerator.generate_microcode(newGenerator.instruction_set)
+        return {instruction['op_code']: newGenerator.base_name(instruction['name']) for instruction in newGenerator.instruction_set}
+
+    import generate_cpu_microcode
+    names = {}
+    for instruction in generate_cpu_microcode.instruction_set:
+        name = instruction['name']
+        if name.endswith(("_0", "_1", "_zf0", "_zf1", "_cf0", "_cf1")):
+            name = name.rsplit("_", 1)[0]
+        names.setdefault(instruction['op_code'], name)
+    return names
+
+#
+#   Reading and comparing
+#
+
+# (body start, digits, words per line, word count) of an image written by
+# save_rom.py, None if its words are not at fixed offsets.
+def fixed_layout(data):
+    start = data.find(b"\n") + 1
+    if start == 0 or data[:start].strip() != load_rom.HEADER:
+        raise RomDiffError("not a 'v2.0 raw' image")
+    end = data.find(b"\n", start)
+    line = data[start:end if end >= 0 else len(data)]
+    fields = line.split(b" ")
+    digits = len(fields[0])
+    cols = len(line) // (digits + 1) if digits else 0
+    if digits == 0 or line != b"".join(field + b" " for field in fields[:cols]) or any(len(field) != digits for field in fields[:cols]):
+        return None
+
+    line_bytes = cols * (digits + 1) + 1
+    body = np.frombuffer(data, dtype = np.uint8, offset = start)
+    lines, rest = divmod(len(body), line_bytes)
+    if rest % (digits + 1):
+        return None
+    # the separators must be where the first line has them
+    pattern = np.frombuffer(line + b"\n", dtype = np.uint8)
+    separators = pattern == ord(" ")
+    separators[-1] = True
+    full = body[:lines * line_bytes].reshape(lines, line_bytes)
+    if not (full[:, separators] == pattern[separators]).all() or not (body[lines * line_bytes + digits::digits + 1] == ord(" ")).all():
+        return None
+    return start, digits, cols, lines * cols + rest // (digits + 1)
+
+# Words of an image of fixed layout at the word indices `indices`.
+def words_at(data, layout, indices):
+    start, digits, cols, _count = layout
+    line_bytes = cols * (digits + 1) + 1
+    offsets = start + indices // cols * line_bytes + indices % cols * (digits + 1)
+    text = np.frombuffer(data, dtype = np.uint8)[offsets[:, None] + np.arange(digits)]
+    values = _HEX_VALUES[text].astype(np.uint32)
+    if values.size and values.max() == 0xFF:
+        raise RomDiffError("invalid word in the image")
+    return (values << (4 * np.arange(digits - 1, -1, -1, dtype = np.uint32))).sum(axis = 1, dtype = np.uint32)
+
+# Returns (addresses, old words, new words) of the words differing between the images.
+def compare(first, second):
+    layouts = (fixed_layout(first), fixed_layout(second))
+    if layouts[0] is not None and layouts[0] == layouts[1] and len(first) == len(second):
+        changed = np.flatnonzero(np.frombuffer(first, dtype = np.uint8) != np.frombuffer(second, dtype = np.uint8))
+        start, digits, cols, _count = layouts[0]
+        line_bytes = cols * (digits + 1) + 1
+        relative = changed[changed >= start] - start
+        addresses = np.unique(relative // line_bytes * cols + relative % line_bytes // (digits + 1))
+        return addresses, words_at(first, layouts[0], addresses), words_at(second, layouts[1], addresses)
+
+    words = []
+    for data in (first, second):
+        try:
+            words.append(load_rom.parse_image(bytes(data)))
+        except load_rom.RawImageError as error:
+            raise RomDiffError(str(error)) from None
+    size = max(len(words[0]), len(words[1]))
+    words = [np.pad(image, (0, size - len(image))) for image in words]
+    addresses = np.flatnonzero(words[0] != words[1])
+    return addresses, words[0][addresses], words[1][addresses]
+
+def compare_files(first_name, second_name):
+    with open(first_name, "rb") as first_file, open(second_name, "rb") as second_file:
+        with mmap.mmap(first_file.fileno(), 0, access = mmap.ACCESS_READ) as first, \
+                mmap.mmap(second_file.fileno(), 0, access = mmap.ACCESS_READ) as second:
+            return compare(first, second)
+
+#
+#   Report
+#
+
+# Merges flag states ("1001") differing in one flag into patterns ("100-").
+def merge_states(states):
+    patterns = set(states)
+    merged = True
+    while merged:
+        merged = False
+        for pattern in sorted(patterns):
+            for position, flag in enumerate(pattern):
+                if flag == "-":
+                    continue
+                other = pattern[:position] + ("1" if flag == "0" else "0") + pattern[position + 1:]
+                if other in patterns:
+                    patterns -= {pattern, other}
+                    patterns.add(pattern[:position] + "-" + pattern[position + 1:])
+                    merged = True
+                    break
+            if merged:
+                break
+    return sorted(patterns)
+
+# Names of the bits a change sets and clears.
+def changed_bits(layout, old, new):
+    if layout == "old":
+        return ["+" + name for name in bit_names(new & ~old)] + ["-" + name for name in bit_names(old & ~new)]
+    return ["+{}".format(bit) for bit in range(32) if (new & ~old) >> bit & 1] + \
+        ["-{}".format(bit) for bit in range(32) if (old & ~new) >> bit & 1]
+
+# Groups the differences: {opcode: {(step, old, new): [flag states]}}.
+def group(layout, addresses, old_words, new_words):
+    flag_names, step_bits, opcode_shift, opcode_mask, flag_shift = LAYOUTS[layout]
+    addresses = addresses.astype(np.uint64)
+    steps = (addresses & ((1 << step_bits) - 1)).tolist()
+    opcodes = ((addresses >> opcode_shift) & opcode_mask).tolist()
+    flags = ((addresses >> flag_shift) & ((1 << len(flag_names)) - 1)).tolist()
+
+    groups = collections.defaultdict(lambda: collections.defaultdict(list))
+    for op_code, step, flag, old, new in zip(opcodes, steps, flags, old_words.tolist(), new_words.tolist()):
+        groups[op_code][(step, old, new)].append(format(flag, "0{}b".format(len(flag_names))))
+    return groups
+
+def report(layout, groups, names):
+    flag_names = LAYOUTS[layout][0]
+    lines = []
+    for op_code in sorted(groups):
+        changes = groups[op_code]
+        words = sum(len(states) for states in changes.values())
+        lines.append("{} (0x{:02x}): {} words".format(names.get(op_code, "?"), op_code, words))
+        for (step, old, new), states in sorted(changes.items()):
+            patterns = merge_states(states)
+            flags = "any" if patterns == ["-" * len(flag_names)] else " ".join(patterns)
+            lines.append("    step {:>2}  {} {:<9}  0x{:06x} -> 0x{:06x}  {}".format(
+                step, flag_names, flags, old, new, " ".join(changed_bits(layout, old, new))))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description = "Lists the differences of two microcode ROM images per instruction.")
+    parser.add_argument("first", help = "ROM image (v2.0 raw)")
+    parser.add_argument("second", help = "ROM image (v2.0 raw)")
+    parser.add_argument("--layout", choices = sorted(LAYOUTS), default = "new",
+        help = "address layout: newGenerator.py (default) or generate_cpu_microcode.py")
+    args = parser.parse_args()
+
+    try:
+        addresses, old_words, new_words = compare_files(args.first, args.second)
+    except (OSError, ValueError, RomDiffError) as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
+
+    groups = group(args.layout, addresses, old_words, new_words)
+    for line in report(args.layout, groups, instruction_names(args.layout)):
+        print(line)
+    print("{} words differ in {} instructions".format(len(addresses), len(groups)))
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,96 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SHARD_WORDS = 1 << 20   # words per shard formatted by one worker
+
+HEX_DIGITS = b"0123456789abcdef"
+
+# Formats codes the slow way, one word at a time.
+def format_codes(codes_table, digits, cols, col = 0):
+    text = []
+    for code in codes_table:
+        col += 1
+        text.append("{:0x}".format(code).rjust(digits, "0") + " ")
+        if(col > cols - 1):
+            col = 0
+            text.append("\n")
+    return "".join(text).encode("utf-8")
+
+# Formats codes with NumPy, the output is the same as format_codes'.
+# `codes` has to start at the beginning of a line.
+def format_codes_numpy(codes, digits, cols):
+    codes = np.asarray(codes, dtype = np.uint64)
+    if len(codes) and int(codes.max()) >> (4 * digits):
+        # wider words than `digits` would be cut
+        return format_codes(codes.tolist(), digits, cols)
+
+    shifts = np.arange(4 * (digits - 1), -1, -4, dtype = np.uint64)
+    text = np.empty((len(codes), digits + 1), dtype = np.uint8)
+    text[:, :digits] = np.frombuffer(HEX_DIGITS, dtype = np.uint8)[(codes[:, None] >> shifts) & 0xF]
+    text[:, digits] = ord(" ")
+
+    # a newline after every full line
+    full = len(codes) // cols * cols
+    lines = np.empty((full // cols, cols * (digits + 1) + 1), dtype = np.uint8)
+    lines[:, :-1] = text[:full].reshape(len(lines), cols * (digits + 1))
+    lines[:, -1] = ord("\n")
+    return lines.tobytes() + text[full:].tobytes()
+
+# Formats one shard into its own file, runs in a worker process.
+def save_shard(file_name, codes, digits, cols):
+    with open(file_name, "wb") as file:
+        file.write(format_codes_numpy(codes, digits, cols))
+    return file_name
+
+# Appends the file `source` to the open file `target`.
+def append_file(target, source):
+    with open(source, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if hasattr(os, "sendfile"):
+            target.flush()
+            offset = 0
+            while offset < size:
+                offset += os.sendfile(target.fileno(), file.fileno(), offset, size - offset)
+        else:
+            shutil.copyfileobj(file, target)
+
 # Saves the codes table in a ROM file.
 # file_name:   the ROM file name
 # codes_table: the code table to be saved into the ROM file
 # instruction_size: the instruction size in bytes
 # cols: the number of columns
-def save_file(file_name, codes_table, instruction_size, cols = 8):
-    file = open(file_name, "w+", encoding="utf-8")
-    file.write("v2.0 raw\n")
-    col = 0
-    instruction_size = int(instruction_size / 4)
-    for code in codes_table:
-        col += 1
-        instruction = "{:0x}".format(code).rjust(instruction_size, "0")
-        file.write("{} ".format(instruction))
-        if(col > cols - 1):
-            col = 0
-            file.write("\n")
-    file.close()
+# workers: the number of processes formatting large tables (default: one per core)
+def save_file(file_name, codes_table, instruction_size, cols = 8, workers = None):
+    digits = int(instruction_size / 4)
+    workers = workers or os.cpu_count() or 1
+
+    with open(file_name, "wb") as file:
+        file.write(b"v2.0 raw\n")
+        if np is None:
+            file.write(format_codes(codes_table, digits, cols))
+            return
+
+        # shards start at the beginning of a line, so every shard is formatted on its own
+        codes = np.asarray(codes_table, dtype = np.uint64)
+        shard_words = SHARD_WORDS // cols * cols
+        if workers < 2 or len(codes) <= shard_words:
+            for start in range(0, len(codes), shard_words):
+                file.write(format_codes_numpy(codes[start:start + shard_words], digits, cols))
+            return
+
+        with tempfile.TemporaryDirectory(dir = os.path.dirname(os.path.abspath(file_name))) as directory:
+            with ProcessPoolExecutor(workers) as pool:
+                shards = [
+                    pool.submit(save_shard, os.path.join(directory, "{:06d}".format(index)),
+                        codes[start:start + shard_words], digits, cols)
+                    for index, start in enumerate(range(0, len(codes), shard_words))
+                ]
+                for shard in shards:
+                    append_file(file, shard.result())
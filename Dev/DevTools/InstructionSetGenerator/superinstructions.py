@@ -0,0 +1,208 @@
+#!python3
+
+#
+#   Profile guided superinstructions for generate_cpu_microcode.py.
+#
+#   Counts how often two instructions run one after the other (the second
+#   one following the operands of the first) in execution traces of the
+#   simulator and gives the most frequent pairs a fused opcode of their own:
+#   fetch, the steps of the first instruction, the steps of the second one
+#   and one `fin_inst`. A fused pair saves the fetch of the second
+#   instruction, its `fin_inst` and one program word. The operands of both
+#   instructions follow the fused opcode in their original order.
+#
+#   The steps of both parts are merged like optimize_microcode.py does so
+#   more pairs fit into the 8 steps of an opcode. The microcode of the second
+#   instruction is looked up with the flags the first one left, so `sub` +
+#   `jpz` gets one variant per flag state; the first instruction must not be
+#   conditional, jump or halt.
+#
+#   The result is written to superinstructions.json, generate_cpu_microcode.py
+#   adds the fused opcodes to the instruction set and assemblyCompilerv2.py
+#   rewrites matching pairs into them (not across labels).
+#
+#   Ex.: simulator.py program.o --trace program.trace
+#        superinstructions.py program.trace other.trace --top 8
+#        superinstructions.py program.trace --verify 200
+#
+
+import argparse
+import collections
+import copy
+import json
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "Simulator"))
+
+import generate_cpu_microcode
+import optimize_microcode
+from control_bits import BITS
+from execution_trace import TraceError, TraceReader
+from microcode_simulator import MAX_STEPS
+
+FETCH_STEPS = len(generate_cpu_microcode.fetch)
+FIRST_FREE_OPCODE = 0x1e
+LAST_OPCODE = 0xff
+
+class SuperinstructionError(Exception):
+    pass
+
+# Instruction set without fused entries, grouped by base name:
+# name -> [entries of every flag variant].
+def base_instructions(instruction_set):
+    instructions = collections.OrderedDict()
+    for instruction in instruction_set:
+        name = instruction['name']
+        if "+" in name:
+            continue
+        base = name.rsplit("_", 1)[0] if name.endswith(("_0", "_1", "_zf0", "_zf1", "_cf0", "_cf1")) else name
+        instructions.setdefault(base, []).append(instruction)
+    return instructions
+
+def is_conditional(entries):
+    return len(entries) > 1 or not isinstance(entries[0]['cf'], list) or not isinstance(entries[0]['zf'], list)
+
+# Why `first` cannot be followed by another instruction inside one opcode, None if it can.
+def first_conflict(entries):
+    steps = generate_cpu_microcode.cast_array(entries[0]['flags'])
+    if is_conditional(entries):
+        return "conditional"
+    if any(word & (BITS["PC_IN"] | BITS["HALT"]) for word in steps):
+        return "jumps or halts"
+    if steps[-1] != BITS["STEP_RESET"] or any(word & BITS["STEP_RESET"] for word in steps[:-1]):
+        return "does not end with fin_inst"
+    return None
+
+# Steps of `first` followed by `second` in one opcode.
+def fuse_steps(first, second, merge_parts):
+    fetch = list(generate_cpu_microcode.fetch)
+    head = generate_cpu_microcode.cast_array(first)[:-1]
+    tail = generate_cpu_microcode.cast_array(second)[FETCH_STEPS:]
+    if merge_parts:
+        return optimize_microcode.optimize_steps(head + tail)
+    # the flags of the second part change with the first, so both are merged on their own
+    return optimize_microcode.optimize_steps(head) + optimize_microcode.optimize_steps(fetch + tail)[FETCH_STEPS:]
+
+# Returns the entries (one per flag variant of `second`) of the fused pair.
+def fuse(instructions, first, second, op_code):
+    conflict = first_conflict(instructions[first])
+    if conflict is not None:
+        raise SuperinstructionError("'{}' {}".format(first, conflict))
+
+    variants = []
+    name = first + "+" + second
+    for entry in instructions[second]:
+        steps = fuse_steps(instructions[first][0]['flags'], entry['flags'], not is_conditional(instructions[second]))
+        if len(steps) > MAX_STEPS:
+            raise SuperinstructionError("'{}' needs {} steps".format(name, len(steps)))
+        variants.append({
+            'name': name + entry['name'][len(second):],
+            'op_code': op_code, 'cf': copy.copy(entry['cf']), 'zf': copy.copy(entry['zf']),
+            'flags': steps
+        })
+    return variants
+
+# Opcode -> (base name, operand words) of the instructions.
+def opcode_table(instructions):
+    counts = optimize_microcode.operand_counts([entry for entries in instructions.values() for entry in entries])
+    return {op_code: (name, operands) for name, (op_code, operands) in counts.items()}
+
+# Counts the pairs of instructions running one after the other in the traces.
+def count_pairs(trace_files, opcodes):
+    pairs = collections.Counter()
+    for file_name in trace_files:
+        reader = TraceReader(file_name)
+        try:
+            previous = None
+            for record in reader.records():
+                if previous is not None and previous.op_code in opcodes and record.op_code in opcodes:
+                    name, operands = opcodes[previous.op_code]
+                    if record.pc == previous.pc + 1 + operands:
+                        pairs[(name, opcodes[record.op_code][0])] += 1
+                previous = record
+        finally:
+            reader.close()
+    return pairs
+
+# Fuses the `top` most frequent pairs that fit into an opcode.
+# Returns (fused instructions, report rows (first, second, count, note)).
+def select_pairs(instructions, pairs, top):
+    fused = []
+    report = []
+    op_code = FIRST_FREE_OPCODE
+    for (first, second), count in pairs.most_common():
+        if len(fused) == top:
+            break
+        try:
+            variants = fuse(instructions, first, second, op_code)
+        except SuperinstructionError as error:
+            report.append((first, second, count, "skipped: {}".format(error)))
+            continue
+        if op_code > LAST_OPCODE:
+            raise SuperinstructionError("no free opcode left for '{}+{}'".format(first, second))
+
+        # cycles of the pair without fusing, per flag variant of the second instruction
+        separate = len(instructions[first][0]['flags']) + min(len(entry['flags']) for entry in instructions[second])
+        saved = separate - max(len(variant['flags']) for variant in variants)
+        fused.append({
+            'name': first + "+" + second, 'op_code': op_code, 'count': count,
+            'first': instructions[first][0]['op_code'], 'second': instructions[second][0]['op_code'],
+            'variants': variants
+        })
+        report.append((first, second, count, "0x{:02x}, {} cycles saved per pair".format(op_code, saved)))
+        op_code += 1
+    return fused, report
+
+# Writes the fused instructions and the operand counts the assembler needs.
+def save_superinstructions(file_name, instructions, fused):
+    operands = {str(op_code): count for op_code, (_name, count) in sorted(opcode_table(instructions).items())}
+    for instruction in fused:
+        for variant in instruction['variants']:
+            del variant['op_code']
+    with open(file_name, "w") as file:
+        json.dump({'operands': operands, 'fused': fused}, file, indent = 1)
+        file.write("\n")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Fuses the most frequent instruction pairs of execution traces.")
+    parser.add_argument("traces", nargs = "+", help = "traces written by simulator.py --trace")
+    parser.add_argument("--top", type = int, default = 8, help = "number of pairs to fuse (default 8)")
+    parser.add_argument("-o", "--output", default = generate_cpu_microcode.SUPERINSTRUCTIONS_FILE,
+        help = "file read by the generator and the assembler (default superinstructions.json)")
+    parser.add_argument("--verify", metavar = "PROGRAMS", type = int, nargs = "?", const = 100,
+        help = "run random programs with the fused opcodes on the microcode and instruction level simulators")
+    parser.add_argument("--dry-run", action = "store_true", help = "only print the selected pairs")
+    args = parser.parse_args()
+
+    instructions = base_instructions(generate_cpu_microcode.instruction_set)
+    try:
+        pairs = count_pairs(args.traces, opcode_table(instructions))
+        fused, report = select_pairs(instructions, pairs, args.top)
+    except (OSError, TraceError, SuperinstructionError) as error:
+        print("!! {} !!".format(error))
+        sys.exit(1)
+
+    total = sum(pairs.values())
+    print("{:<26} {:>10} {:>7}".format("pair", "count", "share"))
+    for first, second, count, note in report:
+        print("{:<26} {:>10} {:>6.1f}%  {}".format(first + " " + second, count, 100 * count / max(total, 1), note))
+
+    if args.verify:
+        instruction_set = [entry for entries in instructions.values() for entry in entries]
+        instruction_set += [variant for instruction in fused for variant in instruction['variants']]
+        differences, _cycles = optimize_microcode.verify(instruction_set, instruction_set, args.verify)
+        for difference in differences[:20]:
+            print("!! {} !!".format(difference))
+        print("{} programs: {}".format(args.verify,
+            "{} differences".format(len(differences)) if differences else "identical results"))
+        if differences:
+            sys.exit(1)
+
+    if not args.dry_run:
+        save_superinstructions(args.output, instructions, fused)
+        print("{} fused instructions written to {}".format(len(fused), args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!python3
+
+#
+#   Debug server for the simulator.
+#
+#   Listens on a local TCP socket and takes one command per line:
+#     step [N]                 runs N instructions (default 1), reports how many ran
+#     continue                 runs until a breakpoint, a watchpoint, halt or `stop`
+#     stop                     interrupts `continue`
+#     regs                     prints the registers
+#     mem ADDR [COUNT]         prints COUNT words from ADDR (default 8)
+#     break ADDR / delete ADDR sets / removes a breakpoint
+#     watch ADDR [COUNT]       stops after an instruction writing to ADDR..ADDR+COUNT-1
+#     unwatch ADDR [COUNT]
+#     list                     prints the breakpoints and watchpoints
+#     symbols                  prints the symbols of the .map file
+#     quit                     closes the connection, the server waits for the next one
+#   ADDR is a number (0x1f, #31, 31), a label or allocation of the .map file
+#   the assembler writes next to the image, or `name+offset`, inside the RAM. Every reply ends
+#   with a line starting with "ok" or "error".
+#
+#   Breakpoints and watchpoints are flags in bytearrays indexed by address,
+#   allocated once. While none are set `continue` runs the plain dispatch loop
+#   of the simulator, so there is no cost per instruction.
+#
+#   Ex.: debugger.py program.o --port 6502
+#        nc localhost 6502
+#
+
+import argparse
+import bisect
+import os
+import select
+import socket
+import sys
+
+from devices import DeviceBus, Terminal, Keyboard, Clock, TERMINAL_PORT, DISPLAY_PORT, KEYBOARD_PORT, CLOCK_PORT
+from framebuffer import Framebuffer
+from memory import RAM_WORDS
+from simulator import FRAME_INSTRUCTIONS, STATE, Simulator, SimulatorError, read_program
+
+DEFAULT_PORT = 6502
+MAX_DUMP_WORDS = 4096
+
+class DebuggerError(Exception):
+    pass
+
+# Reads the labels (':name') and allocations of an assembler .map file,
+# returns [(address, size or None, name)] sorted by address.
+def read_symbols(file_name):
+    symbols = []
+    with open(file_name, "r") as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) < 4 or not fields[0].startswith("0x"):
+                continue
+            name = " ".join(fields[3:])
+            if name.startswith("$"):
+                continue
+            size = None if fields[1] == "-" else int(fields[1])
+            symbols.append((int(fields[0], 16), size, name.lstrip(":")))
+    return sorted(symbols)
+
+class Debugger:
+    def __init__(self, simulator, symbols = ()):
+        self.simulator = simulator
+        self.breakpoints = bytearray(RAM_WORDS)
+        self.watchpoints = bytearray(RAM_WORDS)
+        self.break_count = 0
+        self.watch_count = 0
+        self.symbols = list(symbols)
+        self.addresses = [address for address, _size, _name in self.symbols]
+        self.by_name = {name: address for address, _size, name in self.symbols}
+
+    #
+    #   Addresses and symbols
+    #
+
+    def address(self, text):
+        name, plus, offset = text.partition("+")
+        if name in self.by_name:
+            address = self.by_name[name] + (self.number(offset) if plus else 0)
+        else:
+            address = self.number(text)
+        if address < 0 or address >= RAM_WORDS:
+            raise DebuggerError("'{}' is outside of the RAM (0 - 0x{:06x})".format(text, RAM_WORDS - 1))
+        return address
+
+    @staticmethod
+    def number(text):
+        try:
+            if text.startswith("#"):
+                return int(text[1:])
+            return int(text, 0)
+        except ValueError:
+            raise DebuggerError("unknown address '{}'".format(text)) from None
+
+    # "name+offset" of the symbol at or before `address`, None if there is none.
+    def symbolize(self, address):
+        index = bisect.bisect_right(self.addresses, address) - 1
+        if index < 0:
+            return None
+        start, size, name = self.symbols[index]
+        if size is not None and address >= start + size:
+            return None
+        return name if address == start else "{}+{}".format(name, address - start)
+
+    def describe(self, address):
+        symbol = self.symbolize(address)
+        return "0x{:06x}".format(address) + (" <{}>".format(symbol) if symbol else "")
+
+    #
+    #   Commands
+    #
+
+    def registers(self):
+        cpu = self.simulator
+        return ["pc={}".format(self.describe(cpu.pc))] + \
+            ["{}=0x{:06x}".format(name, int(getattr(cpu, name))) for name in STATE if name != "pc"]
+
+    def memory(self, address, count):
+        lines = []
+        for start in range(address, min(address + count, RAM_WORDS), 8):
+            words = self.simulator.memory.read_block(start, min(8, address + count - start))
+            lines.append("{}: {}".format(self.describe(start), " ".join("{:06x}".format(int(word)) for word in words)))
+        return lines
+
+    def set_flags(self, bitmap, address, count, value):
+        changed = 0
+        for position in range(address, min(address + count, RAM_WORDS)):
+            if bitmap[position] != value:
+                bitmap[position] = value
+                changed += 1
+        return changed if value else -changed
+
+    def step(self, count):
+        cpu = self.simulator
+        if cpu.halted:
+            return ["halted"]
+        # the first instruction runs even on a breakpoint, later ones stop there
+        executed, hit = cpu.run_debug(count, self.breakpoints, self.watchpoints)
+        cpu.bus.sync()
+        return [self.stop_reason(hit, executed)]
+
+    # Runs until something stops the program, `interrupted()` is polled between slices.
+    def resume(self, interrupted):
+        cpu = self.simulator
+        first = True
+        while not cpu.halted:
+            if self.break_count or self.watch_count:
+                count = FRAME_INSTRUCTIONS
+                if not first and self.breakpoints[cpu.pc]:
+                    return [self.stop_reason(("break", cpu.pc))]
+                _executed, hit = cpu.run_debug(count, self.breakpoints, self.watchpoints)
+                cpu.bus.sync()
+                if hit is not None:
+                    return [self.stop_reason(hit)]
+            else:
+                # nothing to check: the plain dispatch loop
+                cpu.run(FRAME_INSTRUCTIONS)
+            first = False
+            if interrupted():
+                return [self.stop_reason(("stop", cpu.pc))]
+        return [self.stop_reason(None)]
+
+    # `executed` is the number of instructions a step ran, without it the
+    # instructions since the start are reported.
+    def stop_reason(self, hit, executed = None):
+        cpu = self.simulator
+        if hit is None:
+            state = "halted" if cpu.halted else "stepped"
+            count = cpu.instructions if executed is None else executed
+            return "{} at {}, {} instructions".format(state, self.describe(cpu.pc), count)
+        if hit[0] == "watch":
+            _kind, address, old, new = hit
+            return "watchpoint {}: 0x{:06x} -> 0x{:06x}, stopped at {}".format(
+                self.describe(address), old, new, self.describe(cpu.pc))
+        if hit[0] == "break":
+            return "breakpoint at {}".format(self.describe(hit[1]))
+        return "stopped at {}".format(self.describe(hit[1]))
+
+    # Runs one command line, returns the reply lines (the last one is "ok" or
+    # "error ..."). `interrupted` is polled while the program runs.
+    def command(self, line, interrupted = lambda: False):
+        fields = line.split()
+        if not fields:
+            return ["ok"]
+        name, arguments = fields[0].lower(), fields[1:]
+        try:
+            if name in ("step", "s"):
+                lines = self.step(self.number(arguments[0]) if arguments else 1)
+            elif name in ("continue", "c"):
+                lines = self.resume(interrupted)
+            elif name == "stop":
+                lines = []
+            elif name in ("regs", "r"):
+                lines = [" ".join(self.registers())]
+            elif name in ("mem", "m"):
+                if not arguments:
+                    raise DebuggerError("mem ADDR [COUNT]")
+                count = self.number(arguments[1]) if len(arguments) > 1 else 8
+                lines = self.memory(self.address(arguments[0]), min(count, MAX_DUMP_WORDS))
+            elif name in ("break", "b", "delete"):
+                if not arguments:
+                    raise DebuggerError("{} ADDR".format(name))
+                address = self.address(arguments[0])
+                self.break_count += self.set_flags(self.breakpoints, address, 1, 0 if name == "delete" else 1)
+                lines = ["{} {}".format("deleted" if name == "delete" else "breakpoint", self.describe(address))]
+            elif name in ("watch", "w", "unwatch"):
+                if not arguments:
+                    raise DebuggerError("{} ADDR [COUNT]".format(name))
+                address = self.address(arguments[0])
+                count = self.number(arguments[1]) if len(arguments) > 1 else 1
+                self.watch_count += self.set_flags(self.watchpoints, address, count, 0 if name == "unwatch" else 1)
+                lines = ["{} {} ({} words)".format("unwatched" if name == "unwatch" else "watching", self.describe(address), count)]
+            elif name in ("list", "l"):
+                lines = ["break " + self.describe(address) for address in self.flagged(self.breakpoints, self.break_count)]
+                lines += ["watch " + self.describe(address) for address in self.flagged(self.watchpoints, self.watch_count)]
+            elif name == "symbols":
+                lines = ["0x{:06x} {}".format(address, name) for address, _size, name in self.symbols]
+            else:
+                raise DebuggerError("unknown command '{}'".format(name))
+        except (DebuggerError, SimulatorError) as error:
+            return ["error {}".format(error)]
+        return lines + ["ok"]
+
+    # Addresses set in a bitmap, found without walking it while it is empty.
+    @staticmethod
+    def flagged(bitmap, count):
+        addresses = []
+        position = bitmap.find(1) if count else -1
+        while position >= 0:
+            addresses.append(position)
+            position = bitmap.find(1, position + 1)
+        return addresses
+
+# Serves one client after the other on host:port.
+def serve(debugger, host, port):
+    server = socket.create_server((host, port))
+    print("debugger listening on {}:{}".format(host, port))
+    try:
+        while True:
+            connection, _peer = server.accept()
+            with connection:
+                serve_client(debugger, connection)
+    finally:
+        server.close()
+
+def serve_client(debugger, connection):
+    reader = connection.makefile("r", encoding = "ascii", errors = "replace", newline = "\n")
+    pending = []
+
+    # a "stop" sent while the program runs interrupts it, other lines wait
+    def interrupted():
+        while select.select([connection], [], [], 0)[0]:
+            line = reader.readline()
+            if not line:
+                return True
+            if line.strip().lower() == "stop":
+                return True
+            pending.append(line)
+        return False
+
+    while True:
+        line = pending.pop(0) if pending else reader.readline()
+        if not line or line.strip().lower() == "quit":
+            break
+        reply = debugger.command(line, interrupted)
+        connection.sendall(("\n".join(reply) + "\n").encode("ascii", "replace"))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Runs a program under a debug server on a local TCP socket.")
+    parser.add_argument("image", help = "'v2.0 raw' image written by the assembler or a packed image (snapshot)")
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT, help = "TCP port (default {})".format(DEFAULT_PORT))
+    parser.add_argument("--host", default = "127.0.0.1", help = "address to listen on (default 127.0.0.1)")
+    parser.add_argument("--map", help = "symbols written by the assembler (default: the image with .map)")
+    args = parser.parse_args()
+
+    bus = DeviceBus()
+    bus.attach(TERMINAL_PORT, Terminal())
+    bus.attach(DISPLAY_PORT, Framebuffer(None))
+    bus.attach(KEYBOARD_PORT, Keyboard(None))
+    bus.attach(CLOCK_PORT, Clock(True))
+    simulator = Simulator(bus)
+
+    map_file = args.map or os.path.splitext(args.image)[0] + ".map"
+    try:
+        state, image = read_program(args.image)
+        symbols = read_symbols(map_file) if args.map or os.path.exists(map_file) else []
+    except (OSError, ValueError, SimulatorError) as error:
+        bus.close()
+        print("!! {} !!".format(error))
+        sys.exit(1)
+    if state is None:
+        simulator.load(image)
+    else:
+        simulator.load_pages(image)
+        simulator.set_state(state)
+
+    try:
+        serve(Debugger(simulator, symbols), args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.close()
+
+if __name__ == "__main__":
+    main()
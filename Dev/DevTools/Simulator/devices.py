@@ -0,0 +1,253 @@
+#
+#   Expansion port device bus.
+#
+#   Every expansion port (EP0 - EPF, register addresses 0x10 - 0x1F) can hold a
+#   device object. The CPU side of a device (read/write/clear) only touches
+#   in-memory buffers, the slow part (terminal output, keyboard input, reading
+#   the wall clock) runs on an asyncio loop in a background thread, so device
+#   I/O never blocks the execution loop.
+#
+
+import asyncio
+import calendar
+import collections
+import sys
+import threading
+import time
+
+EXPANSION_PORTS = range(0x10, 0x20)
+
+# default port assignment of the simulator
+TERMINAL_PORT = 0x10    # EP0
+DISPLAY_PORT = 0x11     # EP1
+KEYBOARD_PORT = 0x12    # EP2
+CLOCK_PORT = 0x13       # EP3
+
+class Device:
+    bus = None          # set when the device is attached
+    uses_loop = False   # whether the device needs the I/O loop to run
+
+    # Value the CPU reads from the port.
+    def read(self):
+        return 0
+
+    # Word the CPU writes to the port.
+    def write(self, word):
+        pass
+
+    # Clear line of the device (`tc`, `dc`).
+    def clear(self):
+        pass
+
+    # Called by the CPU thread between two slices of instructions.
+    def sync(self):
+        pass
+
+    # Started on the I/O loop when the bus starts.
+    async def start(self):
+        pass
+
+    # Runs on the I/O loop when the bus is closed, used to flush buffered output.
+    async def stop(self):
+        pass
+
+    # Releases the device's resources after the I/O loop has stopped.
+    def close(self):
+        pass
+
+class DeviceBus:
+    def __init__(self):
+        self.ports = [None] * len(EXPANSION_PORTS)
+        self.cycle_source = None    # returns the CPU's cycle count, set by the simulator
+        self.clock_hz = 1
+        self.loop = None
+        self.thread = None
+
+    def attach(self, port, device):
+        if port not in EXPANSION_PORTS:
+            raise ValueError("0x{:02x} is not an expansion port".format(port))
+        self.ports[port - EXPANSION_PORTS[0]] = device
+        device.bus = self
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(device.start(), self.loop).result()
+        elif device.uses_loop:
+            self.start()
+        return device
+
+    def device(self, port):
+        return self.ports[port & 0xF]
+
+    def devices(self):
+        return [device for device in self.ports if device is not None]
+
+    def read(self, port):
+        device = self.ports[port & 0xF]
+        return device.read() if device is not None else 0
+
+    def write(self, port, word):
+        device = self.ports[port & 0xF]
+        if device is not None:
+            device.write(word)
+
+    def clear(self, port):
+        device = self.ports[port & 0xF]
+        if device is not None:
+            device.clear()
+
+    def sync(self):
+        for device in self.ports:
+            if device is not None:
+                device.sync()
+
+    # Seconds of CPU time elapsed at the hardware clock speed.
+    def virtual_seconds(self):
+        if self.cycle_source is None:
+            return 0.0
+        return self.cycle_source() / self.clock_hz
+
+    #
+    #   I/O loop
+    #
+
+    # Starts the I/O loop and every attached device.
+    def start(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target = self.loop.run_forever, name = "device-io", daemon = True)
+        self.thread.start()
+        for device in self.devices():
+            asyncio.run_coroutine_threadsafe(device.start(), self.loop).result()
+
+    # Flushes and stops every device, then the I/O loop. The devices keep
+    # their state, `start` runs them again.
+    def stop(self):
+        if self.loop is None:
+            return
+        for device in self.devices():
+            asyncio.run_coroutine_threadsafe(device.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.thread = None
+
+    # Stops the I/O loop and releases the devices.
+    def close(self):
+        self.stop()
+        for device in self.devices():
+            device.close()
+
+#
+#   Devices
+#
+
+# Output terminal (`tw`, `tc`).
+# Characters are buffered and written to the stream in batches by the I/O loop.
+class Terminal(Device):
+    CLEAR = None
+    uses_loop = True
+
+    def __init__(self, stream = None, interval = 0.02):
+        self.stream = stream if stream is not None else sys.stdout
+        self.interval = interval
+        self.buffer = collections.deque()
+        self.task = None
+
+    def write(self, word):
+        self.buffer.append(word & 0x7F)
+
+    def clear(self):
+        self.buffer.append(Terminal.CLEAR)
+
+    async def start(self):
+        self.task = asyncio.ensure_future(self._flush_periodically())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        buffer = self.buffer
+        if not buffer:
+            return
+        text = []
+        while buffer:
+            char = buffer.popleft()
+            if char is Terminal.CLEAR:
+                text.append("\x1b[2J\x1b[H" if self.stream.isatty() else "\f")
+            else:
+                text.append(chr(char))
+        self.stream.write("".join(text))
+        self.stream.flush()
+
+# Keyboard, reading returns the next character or 0 if none is waiting.
+# Input comes from `feed` or is read from `stream` line by line.
+class Keyboard(Device):
+    def __init__(self, stream = None):
+        self.stream = stream
+        self.uses_loop = stream is not None
+        self.buffer = collections.deque()
+        self.reader = None
+
+    def read(self):
+        buffer = self.buffer
+        return buffer.popleft() if buffer else 0
+
+    def feed(self, text):
+        self.buffer.extend(ord(char) & 0x7F for char in text)
+
+    async def start(self):
+        if self.stream is None or self.reader is not None:
+            return
+
+        # reading a console blocks, so a daemon thread reads the lines, once
+        # for all starts of the I/O loop (deque appends are thread safe)
+        def read_lines():
+            for line in self.stream:
+                self.feed(line)
+
+        self.reader = threading.Thread(target = read_lines, name = "keyboard", daemon = True)
+        self.reader.start()
+
+# Clock displaying the UTC time.
+# Reading returns the time of day packed as hours << 12 | minutes << 6 | seconds.
+# With `virtual` the time advances with the CPU's cycles at the hardware clock
+# speed instead of the wall clock, starting at `start` (seconds since the epoch).
+class Clock(Device):
+    def __init__(self, virtual = False, start = None):
+        self.virtual = virtual
+        self.uses_loop = not virtual
+        self.start_time = start if start is not None else calendar.timegm(time.gmtime())
+        self.value = Clock.pack(self.start_time)
+        self.task = None
+
+    @staticmethod
+    def pack(seconds):
+        seconds = int(seconds) % 86400
+        return (seconds // 3600) << 12 | (seconds // 60 % 60) << 6 | seconds % 60
+
+    def read(self):
+        if self.virtual and self.bus is not None:
+            return Clock.pack(self.start_time + self.bus.virtual_seconds())
+        return self.value
+
+    async def start(self):
+        if not self.virtual:
+            self.task = asyncio.ensure_future(self._tick())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    # Updates the cached wall clock time once per second.
+    async def _tick(self):
+        while True:
+            self.value = Clock.pack(time.time())
+            await asyncio.sleep(1 - time.time() % 1)
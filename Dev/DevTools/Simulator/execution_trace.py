@@ -0,0 +1,303 @@
+#!python3
+
+#
+#   Binary execution trace.
+#
+#   Every executed instruction becomes a small record:
+#       opcode      1 byte
+#       changes     1 byte      bit 0-3 A, B, C, OUT changed, bit 4 flags changed, bit 5 memory written
+#       pc          varint      zigzag delta to the previous instruction's pc
+#       cycles      varint      clock cycles of the instruction
+#       registers   varint      zigzag delta per changed register
+#       flags       1 byte      carry | zero << 1
+#       memory      varint count, then per write: zigzag address delta, varint value
+#
+#   Records are collected in chunks. Each chunk starts from the full register
+#   state written in its header, so it can be decoded on its own, and is
+#   compressed with zlib by a background thread. An index of all chunks at the
+#   end of the file lets a reader jump to any instruction or cycle.
+#
+#   File layout, little endian:
+#       magic b"CPU24TRC", u32 version
+#       chunks  u32 compressed size, zlib(CHUNK_HEADER + records)
+#       index   per chunk: u64 offset, u64 first instruction, u64 first cycle, u32 records
+#       footer  u64 index offset, u32 chunk count, b"TRCINDEX"
+#
+#   Ex.: execution_trace.py program.trace --from-cycle 120000 --count 20
+#
+
+import argparse
+import bisect
+import queue
+import struct
+import threading
+import zlib
+
+TRACE_MAGIC = b"CPU24TRC"
+INDEX_MAGIC = b"TRCINDEX"
+TRACE_VERSION = 1
+
+CHUNK_RECORDS = 65536
+
+# state in front of every chunk: pc, a, b, c, out, flags, first instruction, first cycle
+CHUNK_HEADER = struct.Struct("<IIIIIBQQ")
+INDEX_ENTRY = struct.Struct("<QQQI")
+FOOTER = struct.Struct("<QI8s")
+
+REGISTERS = ('a', 'b', 'c', 'out')
+FLAGS_CHANGED = 1 << 4
+MEMORY_WRITTEN = 1 << 5
+
+class TraceError(Exception):
+    pass
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _zigzag(value):
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+def _unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+# Streams a trace to `file_name`, compression and writing run in a background thread.
+class TraceWriter:
+    def __init__(self, file_name, chunk_records = CHUNK_RECORDS):
+        self.file = open(file_name, "wb")
+        self.file.write(TRACE_MAGIC + struct.pack("<I", TRACE_VERSION))
+        self.chunk_records = chunk_records
+        self.index = []
+        self.writes = []        # memory writes of the current instruction
+
+        self.chunks = queue.Queue(maxsize = 8)
+        self.thread = threading.Thread(target = self._write_chunks, name = "trace-writer", daemon = True)
+        self.thread.start()
+
+        self.records = 0
+        self.cycles = 0
+        self.chunk = None
+
+    # Captures the state before the first traced instruction.
+    def start(self, simulator):
+        self.records = simulator.instructions
+        self.cycles = simulator.cycles
+        self.pc = simulator.pc
+        self.registers = [getattr(simulator, name) for name in REGISTERS]
+        self.flags = simulator.carry | simulator.zero << 1
+        self._begin_chunk()
+
+    def _begin_chunk(self):
+        self.chunk = bytearray(CHUNK_HEADER.pack(self.pc, *self.registers, self.flags, self.records, self.cycles))
+        self.chunk_first = (self.records, self.cycles)
+        self.chunk_count = 0
+        self.address = 0
+
+    # Appends the record of the instruction at `pc` that was just executed.
+    def record(self, pc, op_code, cycles, simulator):
+        chunk = self.chunk
+        registers = self.registers
+        changes = 0
+        deltas = []
+
+        for index, name in enumerate(REGISTERS):
+            value = getattr(simulator, name)
+            if value != registers[index]:
+                changes |= 1 << index
+                deltas.append(_zigzag(value - registers[index]))
+                registers[index] = value
+
+        flags = simulator.carry | simulator.zero << 1
+        if flags != self.flags:
+            changes |= FLAGS_CHANGED
+            self.flags = flags
+        writes = self.writes
+        if writes:
+            changes |= MEMORY_WRITTEN
+
+        chunk.append(op_code & 0xFF)
+        chunk.append(changes)
+        _write_varint(chunk, _zigzag(pc - self.pc))
+        _write_varint(chunk, cycles)
+        for delta in deltas:
+            _write_varint(chunk, delta)
+        if changes & FLAGS_CHANGED:
+            chunk.append(flags)
+        if writes:
+            _write_varint(chunk, len(writes))
+            for address, value in writes:
+                _write_varint(chunk, _zigzag(address - self.address))
+                _write_varint(chunk, value)
+                self.address = address
+            writes.clear()
+
+        self.pc = pc
+        self.records += 1
+        self.cycles += cycles
+        self.chunk_count += 1
+        if self.chunk_count >= self.chunk_records:
+            self._end_chunk()
+            self._begin_chunk()
+
+    def _end_chunk(self):
+        if self.chunk_count:
+            self.chunks.put((bytes(self.chunk), self.chunk_first, self.chunk_count))
+
+    def _write_chunks(self):
+        while True:
+            item = self.chunks.get()
+            if item is None:
+                return
+            data, (first_record, first_cycle), count = item
+            compressed = zlib.compress(data, 6)
+            self.index.append((self.file.tell(), first_record, first_cycle, count))
+            self.file.write(struct.pack("<I", len(compressed)))
+            self.file.write(compressed)
+
+    def close(self):
+        if self.chunk is not None:
+            self._end_chunk()
+            self.chunk = None
+        self.chunks.put(None)
+        self.thread.join()
+
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(index_offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+# A decoded record, registers and flags hold the state after the instruction.
+class TraceRecord:
+    __slots__ = ('instruction', 'cycle', 'pc', 'op_code', 'cycles', 'a', 'b', 'c', 'out', 'carry', 'zero', 'writes')
+
+    def __repr__(self):
+        writes = " ".join("[0x{:06x}]=0x{:06x}".format(address, value) for address, value in self.writes)
+        return "{:>10} {:>12} pc=0x{:06x} op=0x{:02x} a=0x{:06x} b=0x{:06x} c=0x{:06x} out=0x{:06x} c{} z{} {}".format(
+            self.instruction, self.cycle, self.pc, self.op_code, self.a, self.b, self.c, self.out,
+            self.carry, self.zero, writes).rstrip()
+
+class TraceReader:
+    def __init__(self, file_name):
+        self.file = open(file_name, "rb")
+        if self.file.read(8) != TRACE_MAGIC:
+            raise TraceError("{}: not a trace file".format(file_name))
+
+        self.file.seek(-FOOTER.size, 2)
+        index_offset, count, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != INDEX_MAGIC:
+            raise TraceError("{}: trace has no index, the writer was not closed".format(file_name))
+        self.file.seek(index_offset)
+        data = self.file.read(count * INDEX_ENTRY.size)
+        self.index = [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+        self.first_records = [entry[1] for entry in self.index]
+        self.first_cycles = [entry[2] for entry in self.index]
+
+    def __len__(self):
+        if not self.index:
+            return 0
+        return self.index[-1][1] + self.index[-1][3] - self.index[0][1]
+
+    def _chunk(self, number):
+        offset = self.index[number][0]
+        self.file.seek(offset)
+        size, = struct.unpack("<I", self.file.read(4))
+        return zlib.decompress(self.file.read(size))
+
+    # Decodes the chunk `number`, yielding its records.
+    def _decode(self, number):
+        data = self._chunk(number)
+        pc, a, b, c, out, flags, instruction, cycle = CHUNK_HEADER.unpack_from(data)
+        registers = [a, b, c, out]
+        address = 0
+        offset = CHUNK_HEADER.size
+        end = len(data)
+
+        while offset < end:
+            record = TraceRecord()
+            record.op_code = data[offset]
+            changes = data[offset + 1]
+            offset += 2
+            delta, offset = _read_varint(data, offset)
+            pc += _unzigzag(delta)
+            record.cycles, offset = _read_varint(data, offset)
+            for index in range(4):
+                if changes & (1 << index):
+                    delta, offset = _read_varint(data, offset)
+                    registers[index] += _unzigzag(delta)
+            if changes & FLAGS_CHANGED:
+                flags = data[offset]
+                offset += 1
+            writes = []
+            if changes & MEMORY_WRITTEN:
+                count, offset = _read_varint(data, offset)
+                for _ in range(count):
+                    delta, offset = _read_varint(data, offset)
+                    address += _unzigzag(delta)
+                    value, offset = _read_varint(data, offset)
+                    writes.append((address, value))
+
+            record.instruction = instruction
+            record.cycle = cycle
+            record.pc = pc
+            record.a, record.b, record.c, record.out = registers
+            record.carry = flags & 1
+            record.zero = flags >> 1
+            record.writes = writes
+            yield record
+
+            instruction += 1
+            cycle += record.cycles
+
+    # Yields the records starting at instruction number `instruction`.
+    def records(self, instruction = 0):
+        number = max(bisect.bisect_right(self.first_records, instruction) - 1, 0)
+        for chunk in range(number, len(self.index)):
+            for record in self._decode(chunk):
+                if record.instruction >= instruction:
+                    yield record
+
+    # Yields the records starting at the instruction running during clock cycle `cycle`.
+    def records_from_cycle(self, cycle):
+        number = max(bisect.bisect_right(self.first_cycles, cycle) - 1, 0)
+        for chunk in range(number, len(self.index)):
+            for record in self._decode(chunk):
+                if record.cycle + record.cycles > cycle:
+                    yield record
+
+    def close(self):
+        self.file.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Prints records of a binary execution trace.")
+    parser.add_argument("trace", help = "trace file written by simulator.py --trace")
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument("--from-instruction", type = int, default = 0)
+    start.add_argument("--from-cycle", type = int)
+    parser.add_argument("--count", type = int, default = 50, help = "number of records to print")
+    args = parser.parse_args()
+
+    reader = TraceReader(args.trace)
+    print("{} records in {} chunks".format(len(reader), len(reader.index)))
+    if args.from_cycle is not None:
+        records = reader.records_from_cycle(args.from_cycle)
+    else:
+        records = reader.records(args.from_instruction)
+    for number, record in enumerate(records):
+        if number >= args.count:
+            break
+        print(record)
+    reader.close()
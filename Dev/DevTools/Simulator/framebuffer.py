@@ -0,0 +1,236 @@
+#!python3
+
+#
+#   Framebuffer of the 256x256 display.
+#
+#   The pixels live in a multiprocessing.shared_memory block so a viewer in
+#   another process can read them without copying. The simulator writes pixels
+#   straight into the block and only keeps track of the rectangle that changed
+#   since the last frame was presented.
+#
+#   Shared memory layout:
+#       header  8 x uint32  [frame, x0, y0, x1, y1, closed, 0, 0]
+#       pixels  256 x 256 x uint8, row-major (y, x)
+#
+#   Ex.: framebuffer.py <shared memory name> frames/ --format png
+#
+
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from devices import Device
+
+WIDTH = 256
+HEIGHT = 256
+
+HEADER_FIELDS = 8
+HEADER_SIZE = HEADER_FIELDS * 4
+FRAME, X0, Y0, X1, Y1, CLOSED = range(6)
+
+# Splits a display word into its (x, y, value) fields.
+#   bits 0-7    x coordinate
+#   bits 8-15   y coordinate
+#   bits 16-23  pixel value (0 = off)
+def decode_pixel(word):
+    return word & 0xFF, (word >> 8) & 0xFF, (word >> 16) & 0xFF
+
+# Opens an existing shared memory block without handing it to the resource
+# tracker, which would otherwise unlink it when the viewer exits.
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        memory = shared_memory.SharedMemory(name = name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+class Framebuffer(Device):
+    # Creates a new framebuffer, or attaches to the one called `name` when
+    # `create` is False.
+    def __init__(self, name = None, create = True):
+        if create:
+            self.shared_memory = shared_memory.SharedMemory(
+                name = name, create = True, size = HEADER_SIZE + WIDTH * HEIGHT)
+        else:
+            self.shared_memory = _attach_shared_memory(name)
+        self.owner = create
+
+        buffer = self.shared_memory.buf
+        self.header = np.ndarray((HEADER_FIELDS,), dtype = np.uint32, buffer = buffer)
+        self.pixels = np.ndarray((HEIGHT, WIDTH), dtype = np.uint8, buffer = buffer, offset = HEADER_SIZE)
+        # flat view used for single pixel writes, much cheaper than indexing the ndarray
+        self._flat = buffer[HEADER_SIZE:HEADER_SIZE + WIDTH * HEIGHT]
+
+        if create:
+            self.header[:] = 0
+            self.pixels[:] = 0
+        self._reset_dirty()
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    @property
+    def frame(self):
+        return int(self.header[FRAME])
+
+    def _reset_dirty(self):
+        self.x0 = WIDTH
+        self.y0 = HEIGHT
+        self.x1 = -1
+        self.y1 = -1
+
+    # Handles a `dw` word: sets the addressed pixel to its value.
+    def write(self, word):
+        x = word & 0xFF
+        y = (word >> 8) & 0xFF
+        self._flat[(y << 8) | x] = (word >> 16) & 0xFF
+
+        if x < self.x0:
+            self.x0 = x
+        if x > self.x1:
+            self.x1 = x
+        if y < self.y0:
+            self.y0 = y
+        if y > self.y1:
+            self.y1 = y
+
+    # Handles a `dc`: clears the whole display.
+    def clear(self):
+        self.pixels[:] = 0
+        self.x0 = 0
+        self.y0 = 0
+        self.x1 = WIDTH - 1
+        self.y1 = HEIGHT - 1
+
+    # The rectangle changed since the last presented frame as (x0, y0, x1, y1),
+    # both corners inclusive, or None when nothing changed.
+    def dirty_rect(self):
+        if self.x1 < 0:
+            return None
+        return (self.x0, self.y0, self.x1, self.y1)
+
+    # Publishes the pending changes as a new frame.
+    # Returns the dirty rectangle of that frame, or None if nothing changed.
+    def present(self):
+        rect = self.dirty_rect()
+        if rect is None:
+            return None
+
+        self.header[X0:Y1 + 1] = rect
+        self.header[FRAME] += 1
+        self._reset_dirty()
+        return rect
+
+    def sync(self):
+        self.present()
+
+    def close(self):
+        if self.owner:
+            self.header[CLOSED] = 1
+        # the views have to be dropped before the mapping can be closed
+        del self.header, self.pixels
+        self._flat.release()
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
+
+#
+#   Frame dumps
+#
+
+def _png_chunk(kind, data):
+    chunk = kind + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xFFFFFFFF)
+
+# Encodes 8-bit grayscale pixels as PNG.
+def encode_png(pixels):
+    height, width = pixels.shape
+    rows = np.zeros((height, width + 1), dtype = np.uint8)  # filter byte 0 in front of every row
+    rows[:, 1:] = pixels
+    return (b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(rows.tobytes(), 6))
+        + _png_chunk(b"IEND", b""))
+
+# Encodes 8-bit grayscale pixels as binary PPM.
+def encode_ppm(pixels):
+    height, width = pixels.shape
+    return b"P6\n%d %d\n255\n" % (width, height) + np.repeat(pixels, 3, axis = 1).tobytes()
+
+ENCODERS = {"png": encode_png, "ppm": encode_ppm}
+
+# Collects changed frames and writes them to `directory` in batches.
+class FrameDumper:
+    def __init__(self, directory, format = "png", batch_size = 32):
+        if format not in ENCODERS:
+            raise ValueError("unknown frame format '{}'".format(format))
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.format = format
+        self.batch_size = batch_size
+        self.pending = []
+        self.last_frame = None
+        self.written = 0
+
+    # Copies the current frame if it has not been captured yet.
+    def capture(self, framebuffer):
+        frame = framebuffer.frame
+        if frame == self.last_frame or frame == 0:
+            return False
+
+        self.last_frame = frame
+        self.pending.append((frame, framebuffer.pixels.copy()))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        encode = ENCODERS[self.format]
+        for frame, pixels in self.pending:
+            file_name = os.path.join(self.directory, "frame_{:06d}.{}".format(frame, self.format))
+            with open(file_name, "wb") as file:
+                file.write(encode(pixels))
+        self.written += len(self.pending)
+        self.pending = []
+
+#
+#   Viewer process
+#
+
+# Attaches to a running simulator's framebuffer and dumps every new frame
+# until the simulator closes it.
+def view(name, directory, format, interval):
+    framebuffer = Framebuffer(name, create = False)
+    dumper = FrameDumper(directory, format)
+    try:
+        while not framebuffer.header[CLOSED]:
+            dumper.capture(framebuffer)
+            time.sleep(interval)
+        dumper.capture(framebuffer)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dumper.flush()
+        framebuffer.close()
+    return dumper.written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Dumps the frames of a running simulator's display.")
+    parser.add_argument("name", help = "shared memory name printed by the simulator")
+    parser.add_argument("directory", help = "output directory")
+    parser.add_argument("--format", choices = sorted(ENCODERS), default = "png")
+    parser.add_argument("--interval", type = float, default = 0.02, help = "polling interval in seconds")
+    args = parser.parse_args()
+
+    written = view(args.name, args.directory, args.format, args.interval)
+    print("{} frames written to {}".format(written, args.directory))
+    sys.exit(0)
@@ -0,0 +1,199 @@
+#
+#   RAM of the simulator.
+#
+#   The 16M words of RAM live in an anonymous, private mmap: untouched pages
+#   cost nothing and a forked process shares them copy-on-write. Writes are
+#   tracked per page, so snapshots only copy pages that hold data and a
+#   restore only copies back the pages written since the snapshot. Images are
+#   copied straight from their buffers and all-zero pages are left untouched.
+#
+#   Packed image format (snapshots and images on disk), little endian:
+#       magic       8 bytes     b"CPU24IMG"
+#       version     u32
+#       registers   u32 count, then count x (16 byte name, u64 value)
+#       pages       u32 count, then count x (u32 page index, PAGE_WORDS x 3 byte word)
+#
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+RAM_WORDS = 1 << 24
+PAGE_BITS = 12
+PAGE_WORDS = 1 << PAGE_BITS
+PAGE_BYTES = PAGE_WORDS * 4
+PAGES = RAM_WORDS >> PAGE_BITS
+
+IMAGE_MAGIC = b"CPU24IMG"
+IMAGE_VERSION = 1
+
+class ImageError(Exception):
+    pass
+
+def _anonymous_mmap(size):
+    if hasattr(mmap, "MAP_PRIVATE"):
+        return mmap.mmap(-1, size, flags = mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+    return mmap.mmap(-1, size)
+
+# Memory content at the time of a snapshot: {page index: page bytes}.
+class MemorySnapshot:
+    def __init__(self, pages):
+        self.pages = pages
+
+class Memory:
+    def __init__(self):
+        self.buffer = _anonymous_mmap(RAM_WORDS * 4)
+        self.words = memoryview(self.buffer).cast("I")      # fast single word access
+        self.array = np.frombuffer(self.buffer, dtype = np.uint32)   # bulk access
+        self.resident = bytearray(PAGES)    # pages that hold data
+        self.dirty = bytearray(PAGES)       # pages written since `base` was taken
+        self.base = None
+
+    # Marks the pages of [address, address + count) as written.
+    def mark(self, address, count = 1):
+        first = address >> PAGE_BITS
+        last = (address + count - 1) >> PAGE_BITS
+        for page in range(first, last + 1):
+            self.dirty[page] = 1
+            self.resident[page] = 1
+
+    def write_block(self, address, words):
+        words = np.asarray(words, dtype = np.uint32)
+        if address < 0 or address + len(words) > RAM_WORDS:
+            raise ValueError("block of {} words at 0x{:06x} exceeds the RAM".format(len(words), address))
+        if len(words) == 0:
+            return
+        self.array[address:address + len(words)] = words & 0xFFFFFF
+        self.mark(address, len(words))
+
+    # Copies an image to `address`. `data` is any buffer of little endian
+    # 32-bit words (bytes, a memoryview of a file mapping, an array) and is
+    # read in place. Pages that would only receive zeros are skipped, so a
+    # sparse image touches no more pages than it fills.
+    def map_words(self, address, data):
+        words = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype = "<u4")
+        if address < 0 or address + len(words) > RAM_WORDS:
+            raise ValueError("block of {} words at 0x{:06x} exceeds the RAM".format(len(words), address))
+
+        end = address + len(words)
+        start = address
+        while start < end:
+            stop = min(end, ((start >> PAGE_BITS) + 1) << PAGE_BITS)
+            chunk = words[start - address:stop - address]
+            page = start >> PAGE_BITS
+            # pages never written hold zeros already
+            if self.resident[page] or chunk.any():
+                self.array[start:stop] = chunk & 0xFFFFFF
+                self.mark(start, stop - start)
+            start = stop
+
+    def read_block(self, address, count):
+        return self.array[address:address + count].copy()
+
+    def resident_pages(self):
+        return [page for page in range(PAGES) if self.resident[page]]
+
+    def _page_view(self, page):
+        start = page * PAGE_BYTES
+        return memoryview(self.buffer)[start:start + PAGE_BYTES]
+
+    # Copies the pages that hold data. Later writes are tracked against it.
+    def snapshot(self):
+        snapshot = MemorySnapshot({page: bytes(self._page_view(page)) for page in self.resident_pages()})
+        self.base = snapshot
+        self.dirty[:] = bytes(PAGES)
+        return snapshot
+
+    def restore(self, snapshot):
+        if snapshot is self.base:
+            # only the pages written since the snapshot differ
+            pages = [page for page in range(PAGES) if self.dirty[page]]
+        else:
+            pages = set(self.resident_pages()) | set(snapshot.pages)
+
+        empty = bytes(PAGE_BYTES)
+        for page in pages:
+            self._page_view(page)[:] = snapshot.pages.get(page, empty)
+            self.resident[page] = page in snapshot.pages
+
+        self.base = snapshot
+        self.dirty[:] = bytes(PAGES)
+
+    def clear(self):
+        self.restore(MemorySnapshot({}))
+
+#
+#   Packed images
+#
+
+# Packs 24-bit words into 3 bytes each.
+def pack_words(words):
+    return np.ascontiguousarray(words, dtype = "<u4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+def unpack_words(data):
+    packed = np.frombuffer(data, dtype = np.uint8).reshape(-1, 3)
+    words = np.zeros((len(packed), 4), dtype = np.uint8)
+    words[:, :3] = packed
+    return words.view("<u4").reshape(-1)
+
+# Writes registers ({name: value}) and pages ({page index: page bytes}) as a packed image.
+def write_image(file_name, registers, pages):
+    with open(file_name, "wb") as file:
+        file.write(IMAGE_MAGIC + struct.pack("<I", IMAGE_VERSION))
+        file.write(struct.pack("<I", len(registers)))
+        for name, value in registers.items():
+            file.write(struct.pack("<16sQ", name.encode("ascii"), value))
+        file.write(struct.pack("<I", len(pages)))
+        for page in sorted(pages):
+            file.write(struct.pack("<I", page))
+            file.write(pack_words(np.frombuffer(pages[page], dtype = np.uint32)))
+
+# Reads a packed image, returns (registers, pages) like `write_image` takes them.
+# The file is mapped and the pages are unpacked in one step, every page is a
+# memoryview into the unpacked words.
+def read_image(file_name):
+    with open(file_name, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ImageError("{}: not a packed image".format(file_name))
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            registers, page_indices, unpacked = unpack_image(file_name, data)
+
+    words = memoryview(unpacked.reshape(-1))
+    pages = {}
+    for i, page in enumerate(page_indices):
+        if page >= PAGES:
+            raise ImageError("{}: page {} is outside of the RAM".format(file_name, page))
+        pages[page] = words[i * PAGE_BYTES:(i + 1) * PAGE_BYTES]
+    return registers, pages
+
+# Registers, page indices and the unpacked words of the pages of an image.
+# Nothing returned refers to `data`, so the mapping can be closed afterwards.
+def unpack_image(file_name, data):
+    if data[:8] != IMAGE_MAGIC:
+        raise ImageError("{}: not a packed image".format(file_name))
+    version, = struct.unpack_from("<I", data, 8)
+    if version != IMAGE_VERSION:
+        raise ImageError("{}: unsupported image version {}".format(file_name, version))
+
+    offset = 12
+    count, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    registers = {}
+    for _ in range(count):
+        name, value = struct.unpack_from("<16sQ", data, offset)
+        registers[name.rstrip(b"\0").decode("ascii")] = value
+        offset += 24
+
+    count, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    record = np.dtype([("page", "<u4"), ("words", np.uint8, (PAGE_WORDS * 3,))])
+    if len(data) < offset + count * record.itemsize:
+        raise ImageError("{}: image is truncated".format(file_name))
+    records = np.frombuffer(data, dtype = record, count = count, offset = offset)
+
+    # 3 byte words straight out of the mapping into 4 byte words
+    unpacked = np.zeros((count, PAGE_WORDS, 4), dtype = np.uint8)
+    unpacked[:, :, :3] = records["words"].reshape(count, PAGE_WORDS, 3)
+    return registers, records["page"].tolist(), unpacked
@@ -0,0 +1,146 @@
+#
+#   Clock step level simulator of the CPU.
+#
+#   Runs the microcode itself: every clock cycle looks up the control word
+#   for (opcode, carry, zero, step) and applies its bits as described in
+#   control_bits.py - the bus is driven, the ALU computes, registers latch at
+#   the clock edge. Used to check that a changed microcode (see
+#   optimize_microcode.py) still does what the original does.
+#
+#   ROM address: opcode << 5 | carry << 4 | zero << 3 | step
+#
+
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+
+from control_bits import BITS, unknown_bits
+
+WORD_BITS = 24
+WORD_MASK = (1 << WORD_BITS) - 1
+MAX_STEPS = 8           # 3 bit step counter
+
+# registers compared between runs
+REGISTERS = ('pc', 'a', 'b', 'c', 'out', 'carry', 'zero', 'halted')
+
+class MicrocodeError(Exception):
+    pass
+
+class MicrocodeSimulator:
+    # `microcode` is the step list of generate_cpu_microcode.generate_microcode.
+    def __init__(self, microcode):
+        self.rom = {step['address']: step['flag'] for step in microcode}
+        self.ram = {}
+        self.events = []        # ("terminal" | "display", "write" | "clear", word)
+        self.pc = 0
+        self.mar = 0
+        self.ir = 0
+        self.a = 0
+        self.b = 0
+        self.c = 0
+        self.out = 0
+        self.carry = 0
+        self.zero = 0
+        self.halted = False
+        self.step = 0
+        self.cycles = 0
+        self.instructions = 0
+
+    def load(self, words, address = 0):
+        for offset, word in enumerate(words):
+            self.ram[address + offset] = word & WORD_MASK
+
+    def registers(self):
+        return {name: int(getattr(self, name)) for name in REGISTERS}
+
+    # Non-zero RAM words.
+    def memory(self):
+        return {address: word for address, word in self.ram.items() if word}
+
+    # Runs until `halt` or until `max_instructions` instructions have finished.
+    def run(self, max_instructions = None):
+        while not self.halted and (max_instructions is None or self.instructions < max_instructions):
+            self.clock()
+        return self.instructions
+
+    # Executes one microcode step.
+    def clock(self):
+        op_code = self.ir & 0xFF
+        address = op_code << 5 | self.carry << 4 | self.zero << 3 | self.step
+        word = self.rom.get(address)
+        if word is None:
+            raise MicrocodeError("no microcode for opcode 0x{:02x} step {} (pc 0x{:06x})".format(op_code, self.step, self.pc))
+        if unknown_bits(word):
+            raise MicrocodeError("unknown control bits 0x{:x} at 0x{:05x}".format(unknown_bits(word), address))
+
+        # during the step: everything reads the values from before the edge
+        subtract = word & BITS["SUBTRACT"]
+        total = self.a + (((~self.b & WORD_MASK) + 1) if subtract else self.b)
+        alu = total & WORD_MASK
+        memory = self.ram.get(self.mar, 0)
+
+        sources = []
+        if word & BITS["PC_OUT"]:
+            sources.append(self.pc)
+        if word & BITS["RAM_OUT"]:
+            sources.append(memory)
+        if word & BITS["ALU_OUT"]:
+            sources.append(alu)
+        if word & BITS["A_OUT"]:
+            sources.append(self.a)
+        if word & BITS["C_OUT"]:
+            sources.append(self.c)
+        if word & BITS["NIBBLE_OUT"]:
+            sources.append((self.a >> 4) & 0xF if word & BITS["HIGH_NIBBLE"] else self.a & 0xF)
+        if len(sources) > 1:
+            raise MicrocodeError("bus conflict at 0x{:05x}".format(address))
+        bus = sources[0] if sources else 0
+
+        # at the clock edge
+        if word & BITS["PC_IN"] and word & BITS["PC_INC"]:
+            raise MicrocodeError("PC loaded and incremented at 0x{:05x}".format(address))
+        mar = self.mar
+        if word & BITS["OUT_IN"]:
+            self.out = bus
+        if word & BITS["PC_IN"]:
+            self.pc = bus
+        if word & BITS["PC_INC"]:
+            self.pc = (self.pc + 1) & WORD_MASK
+        if word & BITS["IR_IN"]:
+            self.ir = bus
+        if word & BITS["RAM_IN"]:
+            self.ram[mar] = bus
+        if word & BITS["MAR_IN"]:
+            self.mar = bus
+        if word & BITS["B_IN"]:
+            self.b = bus
+        if word & BITS["A_IN"]:
+            self.a = bus
+        if word & BITS["FLAGS_IN"]:
+            self.carry = (total >> WORD_BITS) & 1
+            self.zero = int(alu == 0)
+        if word & BITS["C_IN"]:
+            self.c = bus
+        if word & BITS["DISPLAY_CLEAR"]:
+            self.events.append(("display", "clear", 0))
+        if word & BITS["DISPLAY_WRITE"]:
+            self.events.append(("display", "write", memory))
+        if word & BITS["TERMINAL_CLEAR"]:
+            self.events.append(("terminal", "clear", 0))
+        if word & BITS["TERMINAL_WRITE"]:
+            self.events.append(("terminal", "write", memory))
+
+        self.cycles += 1
+        if word & BITS["HALT"]:
+            # the clock stops, the instruction counts as finished
+            self.halted = True
+            self.instructions += 1
+        elif word & BITS["STEP_RESET"]:
+            self.step = 0
+            self.instructions += 1
+        else:
+            self.step += 1
+            if self.step == MAX_STEPS:
+                raise MicrocodeError("opcode 0x{:02x} runs past {} steps".format(op_code, MAX_STEPS))
@@ -0,0 +1,697 @@
+#!python3
+
+#
+#   Instruction level simulator of the CPU.
+#
+#   Executes programs in the encoding implemented by generate_cpu_microcode.py
+#   (INSTR_SET_TWO of the assemblers). Opcodes and cycle counts are taken from
+#   the microcode itself, so the simulator follows the hardware: every
+#   instruction costs as many clock cycles as it has microcode steps.
+#
+#   Note: like the microcode, `jp`/`jpz`/`jpc` store the address of their own
+#   operand word in the C-Register, so `rts` resumes at that operand.
+#
+#   The RAM is an mmap-backed Memory (memory.py) covering all 16M words,
+#   images are copied in page by page and all-zero pages are skipped.
+#   `snapshot`/`restore` copy only pages that hold data, and `run_cases` runs
+#   many test cases from one booted state by forking (copy-on-write) where
+#   os.fork is available.
+#
+#   `run(trace = TraceWriter(...))` records every instruction into a compressed
+#   binary trace (execution_trace.py).
+#
+#   Devices sit on the expansion ports: terminal on EP0, display on EP1,
+#   keyboard on EP2 and the UTC clock on EP3.
+#
+#   No instruction reads a device, so a loop returning to the same registers
+#   without changing the RAM or writing to a device can never end. Between two
+#   slices `run` steps a few instructions looking for such a loop; once found
+#   the run ends there like at `halt` (`idle` holds its address), or with a
+#   limit the counters jump to it, so the cycles and the virtual clock still
+#   advance as if the loop had run.
+#
+#   Ex.: simulator.py program.o
+#        simulator.py program.o --dump-frames frames/ --max-instructions 1000000
+#        simulator.py program.o --virtual-time
+#        simulator.py program.o --trace program.trace
+#        simulator.py program.o --no-fast-forward    (keeps running idle loops)
+#        simulator.py booted.img                  (packed image from save_snapshot)
+#
+
+import argparse
+import os
+import pickle
+import sys
+
+import numpy as np
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+
+import generate_cpu_microcode
+import load_rom
+from control_bits import BITS
+from devices import DeviceBus, Terminal, Keyboard, Clock, TERMINAL_PORT, DISPLAY_PORT, KEYBOARD_PORT, CLOCK_PORT
+from framebuffer import Framebuffer, FrameDumper
+from execution_trace import TraceWriter
+from memory import Memory, PAGE_BITS, IMAGE_MAGIC, ImageError, read_image, write_image
+
+WORD_BITS = 24
+WORD_MASK = (1 << WORD_BITS) - 1
+ADDRESS_MASK = WORD_MASK
+
+CLOCK_HZ = 3800                 # measured on the reference hardware
+FRAME_INSTRUCTIONS = 4096       # instructions between two device syncs (display frames)
+IDLE_PROBE = 32                 # instructions stepped between two slices looking for an idle loop
+
+DEVICE_INSTRUCTIONS = ("tw", "dw", "dw_addr", "dc", "tc")
+
+# opcodes by microcode name, e.g. OPCODES['lda_num'] == 0x02
+OPCODES = {instruction['name']: instruction['op_code'] for instruction in generate_cpu_microcode.instruction_set}
+
+# Builds the cycle table: CYCLES[(op_code << 2) | (cf << 1) | zf] is the number
+# of microcode steps executed for that opcode and flag state, 0 if undefined.
+# The clock stops at a HALT step, the steps after it do not count.
+def build_cycle_table(instruction_set):
+    table = [0] * (256 << 2)
+    microcode = generate_cpu_microcode.generate_microcode(generate_cpu_microcode.fetch, instruction_set)
+    halts = {}
+    for step in microcode:
+        if step['flag'] & BITS["HALT"]:
+            key = step['address'] >> 3
+            halts[key] = min(halts.get(key, 7), step['address'] & 7)
+    for step in microcode:
+        if (step['address'] & 7) > halts.get(step['address'] >> 3, 7):
+            continue
+        op_code = step['address'] >> 5
+        cf = (step['address'] >> 4) & 1
+        zf = (step['address'] >> 3) & 1
+        table[(op_code << 2) | (cf << 1) | zf] += 1
+    return table
+
+CYCLES = build_cycle_table(generate_cpu_microcode.instruction_set)
+
+# registers saved in snapshots, in order
+STATE = ('pc', 'a', 'b', 'c', 'out', 'carry', 'zero', 'halted', 'cycles', 'instructions')
+
+class SimulatorError(Exception):
+    pass
+
+# Registers and memory of a simulator at one point in time.
+class Snapshot:
+    def __init__(self, state, memory):
+        self.state = state
+        self.memory = memory
+
+# Reads a Logisim "v2.0 raw" image (hex words, optionally as "count*value") into an array of words.
+def load_image(file_name):
+    try:
+        return load_rom.read_file(file_name)
+    except load_rom.RawImageError as error:
+        raise SimulatorError(str(error)) from None
+
+# Reads a program image: a packed image (memory.py) or a "v2.0 raw" file.
+# Returns (registers or None, pages or words).
+def read_program(file_name):
+    with open(file_name, "rb") as file:
+        magic = file.read(len(IMAGE_MAGIC))
+    if magic == IMAGE_MAGIC:
+        try:
+            return read_image(file_name)
+        except ImageError as error:
+            raise SimulatorError(str(error)) from None
+    return None, load_image(file_name)
+
+class Simulator:
+    # `instruction_set` replaces generate_cpu_microcode.instruction_set, e.g. to
+    # try fused instructions before they are written to superinstructions.json.
+    def __init__(self, bus = None, instruction_set = None):
+        self.memory = Memory()
+        self.ram = self.memory.words
+        self.bus = bus if bus is not None else DeviceBus()
+        self.bus.cycle_source = lambda: self.cycles
+        self.bus.clock_hz = CLOCK_HZ
+
+        if instruction_set is None:
+            self._opcodes = OPCODES
+            self._cycles = CYCLES
+        else:
+            self._opcodes = {instruction['name']: instruction['op_code'] for instruction in instruction_set}
+            self._cycles = build_cycle_table(instruction_set)
+        self._device_opcodes = set(op_code for name, op_code in self._opcodes.items()
+            if any(part in DEVICE_INSTRUCTIONS for part in name.split("+")))
+        self.fast_forward = True    # end or skip idle loops, see _skip_idle_loop
+
+        self.reset()
+        self._handlers = self._build_handlers()
+
+    # Resets the registers, the RAM is kept.
+    def reset(self):
+        self.pc = 0
+        self.a = 0          # A-Register
+        self.b = 0          # B-Register
+        self.c = 0          # C-Register, holds the return address
+        self.out = 0        # output display
+        self.carry = 0
+        self.zero = 0
+        self.halted = False
+        self.idle = None    # address of the idle loop the run ended in
+        self.cycles = 0
+        self.instructions = 0
+
+    # Copies `words` (a list or any buffer of 32-bit words) to `address`.
+    def load(self, words, address = 0):
+        if not isinstance(words, (np.ndarray, bytes, bytearray, memoryview)):
+            words = np.asarray(words, dtype = np.uint32)
+        self.memory.map_words(address, words)
+
+    # Full register state, see STATE.
+    def state(self):
+        return {name: int(getattr(self, name)) for name in STATE}
+
+    def set_state(self, state):
+        for name in STATE:
+            setattr(self, name, state.get(name, 0))
+        self.halted = bool(self.halted)
+
+    #
+    #   Snapshots
+    #
+
+    def snapshot(self):
+        return Snapshot(self.state(), self.memory.snapshot())
+
+    # Returns to a snapshot, only pages written since the latest snapshot are copied back.
+    def restore(self, snapshot):
+        self.memory.restore(snapshot.memory)
+        self.set_state(snapshot.state)
+
+    # Writes the current state as a packed image.
+    def save_snapshot(self, file_name):
+        snapshot = self.snapshot()
+        write_image(file_name, snapshot.state, snapshot.memory.pages)
+        return snapshot
+
+    def load_snapshot(self, file_name):
+        state, pages = read_image(file_name)
+        self.load_pages(pages)
+        self.set_state(state)
+
+    # Replaces the RAM by the pages ({page index: page bytes}) of an image.
+    def load_pages(self, pages):
+        self.memory.clear()
+        for page, data in pages.items():
+            self.memory.map_words(page << PAGE_BITS, data)
+
+    # Runs `run_case(simulator, case)` for every case, each starting from the
+    # current state, and returns the results in order.
+    # With os.fork every case runs in a child process that shares the booted
+    # memory copy-on-write, otherwise the state is restored between cases.
+    def run_cases(self, cases, run_case, workers = None):
+        cases = list(cases)
+        if hasattr(os, "fork"):
+            return self._run_cases_forked(cases, run_case, workers or os.cpu_count() or 1)
+
+        snapshot = self.snapshot()
+        results = []
+        for case in cases:
+            try:
+                results.append(run_case(self, case))
+            finally:
+                self.restore(snapshot)
+        return results
+
+    # No I/O loop runs while forking, a lock its thread holds would stay
+    # locked in the child. Every child runs its own loop and flushes it
+    # before exiting, the parent's loop is started again afterwards.
+    def _run_cases_forked(self, cases, run_case, workers):
+        results = [None] * len(cases)
+        waiting = list(enumerate(cases))
+        running = []    # (pid, case index, pipe)
+        failure = None
+        restart = self.bus.loop is not None
+        self.bus.stop()
+
+        try:
+            while waiting or running:
+                while waiting and len(running) < workers:
+                    index, case = waiting.pop(0)
+                    read_end, write_end = os.pipe()
+                    pid = os.fork()
+                    if pid == 0:
+                        os.close(read_end)
+                        try:
+                            if restart:
+                                self.bus.start()
+                            try:
+                                payload = pickle.dumps((True, run_case(self, case)))
+                            finally:
+                                self.bus.stop()
+                                sys.stdout.flush()
+                        except BaseException as error:
+                            payload = pickle.dumps((False, "{}: {}".format(type(error).__name__, error)))
+                        with os.fdopen(write_end, "wb") as pipe:
+                            pipe.write(payload)
+                        os._exit(0)
+                    os.close(write_end)
+                    running.append((pid, index, read_end))
+
+                pid, index, read_end = running.pop(0)
+                with os.fdopen(read_end, "rb") as pipe:
+                    payload = pipe.read()
+                os.waitpid(pid, 0)
+
+                if not payload:
+                    ok, result = False, "child process exited without a result"
+                else:
+                    ok, result = pickle.loads(payload)
+                if ok:
+                    results[index] = result
+                elif failure is None:
+                    failure = "case {} failed: {}".format(index, result)
+        finally:
+            if restart:
+                self.bus.start()
+
+        if failure is not None:
+            raise SimulatorError(failure)
+        return results
+
+    def _build_handlers(self):
+        handlers = [None] * 256
+        for name, op_code in self._opcodes.items():
+            # conditional instructions share one handler for every flag state
+            base = name.rsplit("_", 1)[0] if name.endswith(("_0", "_1", "_zf0", "_zf1", "_cf0", "_cf1")) else name
+            if "+" in base:
+                first, second = base.split("+")
+                handlers[op_code] = self._fused(op_code, getattr(self, "_" + first), getattr(self, "_" + second))
+            else:
+                handlers[op_code] = getattr(self, "_" + base)
+        return handlers
+
+    # Handler of a fused pair (superinstructions.py). The microcode of the
+    # second instruction is selected by the flags the first one left, so the
+    # cycles are corrected after it ran.
+    def _fused(self, op_code, first, second):
+        cycles = self._cycles
+        def handler():
+            before = cycles[(op_code << 2) | (self.carry << 1) | self.zero]
+            first()
+            self.cycles += cycles[(op_code << 2) | (self.carry << 1) | self.zero] - before
+            second()
+        return handler
+
+    #
+    #   Execution
+    #
+
+    # Executes a single instruction.
+    def step(self):
+        return self._run_slice(1)
+
+    # Runs until `halt`, an idle loop or until `max_instructions` have been executed.
+    # Every instruction is recorded into `trace` (a TraceWriter) if given.
+    # Returns the number of executed instructions, skipped loop iterations included.
+    def run(self, max_instructions = None, trace = None):
+        executed = 0
+        self.idle = None
+        while not self.halted and self.idle is None:
+            count = FRAME_INSTRUCTIONS
+            if max_instructions is not None:
+                count = min(count, max_instructions - executed)
+                if count <= 0:
+                    break
+            if trace is None:
+                executed += self._run_slice(count)
+                if self.fast_forward:
+                    limit = None if max_instructions is None else max_instructions - executed
+                    executed += self._skip_idle_loop(limit)
+            else:
+                executed += self._run_slice_traced(count, trace)
+            self.bus.sync()
+        return executed
+
+    def _run_slice(self, count):
+        ram = self.ram
+        handlers = self._handlers
+        cycles = self._cycles
+
+        for executed in range(count):
+            if self.halted:
+                break
+            pc = self.pc
+            op_code = ram[pc]
+            cost = cycles[((op_code & 0xFF) << 2) | (self.carry << 1) | self.zero]
+            if op_code > 0xFF or cost == 0:
+                raise SimulatorError("illegal opcode 0x{:04x} at 0x{:06x}".format(op_code, pc))
+            self.pc = (pc + 1) & ADDRESS_MASK
+            handlers[op_code]()
+            self.cycles += cost
+        else:
+            executed = count
+
+        self.instructions += executed
+        return executed
+
+    # Steps up to IDLE_PROBE instructions looking for the registers to repeat
+    # without a device write or a store changing the RAM. Then the program is
+    # in a loop it can never leave: without a limit `idle` is set to end the
+    # run, with one the whole iterations up to it are counted without running
+    # them. Returns the number of instructions executed or skipped.
+    def _skip_idle_loop(self, limit):
+        ram = self.ram
+        handlers = self._handlers
+        cycles = self._cycles
+        device_opcodes = self._device_opcodes
+
+        changed = []
+        def store(address, value):
+            if ram[address] != value:
+                changed.append(address)
+            Simulator._store(self, address, value)
+        self._store = store
+
+        seen = {}
+        executed = 0
+        try:
+            while executed < IDLE_PROBE and (limit is None or executed < limit) and not self.halted and not changed:
+                pc = self.pc
+                key = (pc, self.a, self.b, self.c, self.out, self.carry, self.zero)
+                if key in seen:
+                    start, start_cycles = seen[key]
+                    period = executed - start
+                    if limit is None:
+                        self.idle = pc
+                        break
+                    iterations = (limit - executed) // period
+                    self.instructions += iterations * period
+                    self.cycles += iterations * (self.cycles - start_cycles)
+                    return executed + iterations * period
+                seen[key] = (executed, self.cycles)
+
+                op_code = ram[pc]
+                if op_code in device_opcodes:
+                    break
+                cost = cycles[((op_code & 0xFF) << 2) | (self.carry << 1) | self.zero]
+                if op_code > 0xFF or cost == 0:
+                    raise SimulatorError("illegal opcode 0x{:04x} at 0x{:06x}".format(op_code, pc))
+                self.pc = (pc + 1) & ADDRESS_MASK
+                handlers[op_code]()
+                self.cycles += cost
+                executed += 1
+        finally:
+            del self._store
+            self.instructions += executed
+        return executed
+
+    # Same as _run_slice, but records every instruction and its memory writes.
+    def _run_slice_traced(self, count, trace):
+        ram = self.ram
+        handlers = self._handlers
+        cycles = self._cycles
+        if trace.chunk is None:
+            trace.start(self)
+
+        writes = trace.writes
+        def store(address, value):
+            Simulator._store(self, address, value)
+            writes.append((address, value))
+        self._store = store
+
+        try:
+            for executed in range(count):
+                if self.halted:
+                    break
+                pc = self.pc
+                op_code = ram[pc]
+                cost = cycles[((op_code & 0xFF) << 2) | (self.carry << 1) | self.zero]
+                if op_code > 0xFF or cost == 0:
+                    raise SimulatorError("illegal opcode 0x{:04x} at 0x{:06x}".format(op_code, pc))
+                self.pc = (pc + 1) & ADDRESS_MASK
+                start = self.cycles
+                handlers[op_code]()
+                self.cycles += cost
+                trace.record(pc, op_code, self.cycles - start, self)
+            else:
+                executed = count
+        finally:
+            del self._store
+
+        self.instructions += executed
+        return executed
+
+    # Same as _run_slice, but stops before an instruction whose address is set
+    # in `breakpoints` and after one writing to an address set in `watchpoints`
+    # (bytearrays indexed by address, see debugger.py). The instruction at the
+    # current pc runs even if it has a breakpoint, so a stopped program can go on.
+    # Returns (executed instructions, None or ("break", pc) or ("watch", address, old, new)).
+    def run_debug(self, count, breakpoints, watchpoints):
+        ram = self.ram
+        handlers = self._handlers
+        cycles = self._cycles
+
+        written = []
+        def store(address, value):
+            if watchpoints[address]:
+                written.append((address, ram[address], value))
+            Simulator._store(self, address, value)
+        self._store = store
+
+        executed = 0
+        hit = None
+        try:
+            while executed < count and not self.halted:
+                pc = self.pc
+                if executed and breakpoints[pc]:
+                    hit = ("break", pc)
+                    break
+                op_code = ram[pc]
+                cost = cycles[((op_code & 0xFF) << 2) | (self.carry << 1) | self.zero]
+                if op_code > 0xFF or cost == 0:
+                    raise SimulatorError("illegal opcode 0x{:04x} at 0x{:06x}".format(op_code, pc))
+                self.pc = (pc + 1) & ADDRESS_MASK
+                handlers[op_code]()
+                self.cycles += cost
+                executed += 1
+                if written:
+                    hit = ("watch",) + written[0]
+                    break
+        finally:
+            del self._store
+            self.instructions += executed
+        return executed, hit
+
+    # Reads the operand word following the opcode.
+    def _operand(self):
+        value = self.ram[self.pc]
+        self.pc = (self.pc + 1) & ADDRESS_MASK
+        return value
+
+    def _alu(self, value, subtract):
+        self.b = value
+        if subtract:
+            result = self.a + (~value & WORD_MASK) + 1
+        else:
+            result = self.a + value
+        self.carry = (result >> WORD_BITS) & 1
+        self.a = result & WORD_MASK
+        self.zero = int(self.a == 0)
+
+    def _store(self, address, value):
+        self.ram[address] = value
+        page = address >> PAGE_BITS
+        self.memory.dirty[page] = 1
+        self.memory.resident[page] = 1
+
+    def _jump(self):
+        self.c = self.pc
+        self.pc = self._operand()
+
+    #
+    #   Instructions
+    #
+
+    def _nop(self):
+        pass
+
+    def _halt(self):
+        self.halted = True
+
+    def _lda_num(self):
+        self.a = self._operand()
+
+    def _lda_addr(self):
+        self.a = self.ram[self._operand()]
+
+    def _sta_addr(self):
+        self._store(self._operand(), self.a)
+
+    def _add_num(self):
+        self._alu(self._operand(), False)
+
+    def _add_addr(self):
+        self._alu(self.ram[self._operand()], False)
+
+    def _sub_num(self):
+        self._alu(self._operand(), True)
+
+    def _sub_addr(self):
+        self._alu(self.ram[self._operand()], True)
+
+    def _out_num(self):
+        self.out = self._operand()
+
+    def _out_addr(self):
+        self.out = self.ram[self._operand()]
+
+    def _jp_addr(self):
+        self._jump()
+
+    def _jpz_addr(self):
+        if self.zero:
+            self._jump()
+        else:
+            self.pc = (self.pc + 1) & ADDRESS_MASK
+
+    def _jpc_addr(self):
+        if self.carry:
+            self._jump()
+        else:
+            self.pc = (self.pc + 1) & ADDRESS_MASK
+
+    def _rts(self):
+        self.pc = self.c
+
+    def _lb(self):
+        self.pc = self._operand()
+
+    def _lbz(self):
+        if self.zero:
+            self.pc = self._operand()
+        else:
+            self.pc = (self.pc + 1) & ADDRESS_MASK
+
+    def _lbc(self):
+        if self.carry:
+            self.pc = self._operand()
+        else:
+            self.pc = (self.pc + 1) & ADDRESS_MASK
+
+    def _rtc(self):
+        if self.carry:
+            self.pc = self.c
+
+    def _rtz(self):
+        if self.zero:
+            self.pc = self.c
+
+    def _lpc_num(self):
+        self.c = self._operand()
+
+    def _lpc_addr(self):
+        self.c = self.ram[self._operand()]
+
+    def _spc(self):
+        self._store(self._operand(), self.c)
+
+    def _dc(self):
+        self.bus.clear(DISPLAY_PORT)
+
+    def _tc(self):
+        self.bus.clear(TERMINAL_PORT)
+
+    def _tw(self):
+        self.bus.write(TERMINAL_PORT, self._operand())
+
+    def _dw(self):
+        self.bus.write(DISPLAY_PORT, self._operand())
+
+    def _dw_addr(self):
+        self.bus.write(DISPLAY_PORT, self.ram[self._operand()])
+
+    def _co(self):
+        self.a = (self.a >> 4) & 0xF
+
+    def _ct(self):
+        self.a = self.a & 0xF
+
+    def registers(self):
+        return {
+            'pc': self.pc, 'a': self.a, 'b': self.b, 'c': self.c, 'out': self.out,
+            'carry': self.carry, 'zero': self.zero
+        }
+
+def print_state(simulator):
+    print(" ".join("{}=0x{:06x}".format(name, value) for name, value in simulator.registers().items()))
+    print("{} instructions, {} cycles ({:.2f}s at {} Hz){}".format(
+        simulator.instructions, simulator.cycles, simulator.cycles / CLOCK_HZ, CLOCK_HZ,
+        ", halted" if simulator.halted else
+        ", waiting forever in the loop at 0x{:06x}".format(simulator.idle) if simulator.idle is not None else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Runs an assembled program.")
+    parser.add_argument("image", help = "'v2.0 raw' image written by the assembler or a packed image (snapshot)")
+    parser.add_argument("--max-instructions", type = int, help = "stop after this many instructions")
+    parser.add_argument("--display", metavar = "NAME", help = "shared memory name of the framebuffer")
+    parser.add_argument("--dump-frames", metavar = "DIRECTORY", help = "write every changed frame to DIRECTORY")
+    parser.add_argument("--frame-format", choices = ["png", "ppm"], default = "png")
+    parser.add_argument("--keyboard", action = "store_true", help = "read keyboard input from stdin")
+    parser.add_argument("--virtual-time", action = "store_true",
+        help = "let the clock follow the simulated cycles instead of the wall clock")
+    parser.add_argument("--trace", metavar = "FILE", help = "write a binary execution trace to FILE")
+    parser.add_argument("--no-fast-forward", action = "store_true",
+        help = "keep running loops the program can never leave instead of ending there")
+    args = parser.parse_args()
+
+    bus = DeviceBus()
+    bus.attach(TERMINAL_PORT, Terminal())
+    framebuffer = bus.attach(DISPLAY_PORT, Framebuffer(args.display))
+    bus.attach(KEYBOARD_PORT, Keyboard(sys.stdin if args.keyboard else None))
+    bus.attach(CLOCK_PORT, Clock(args.virtual_time))
+    print("framebuffer: " + framebuffer.name)
+    dumper = FrameDumper(args.dump_frames, args.frame_format) if args.dump_frames else None
+
+    simulator = Simulator(bus)
+    simulator.fast_forward = not args.no_fast_forward
+    try:
+        state, image = read_program(args.image)
+    except SimulatorError as error:
+        bus.close()
+        print("error: {}".format(error))
+        sys.exit(1)
+    if state is None:
+        simulator.load(image)
+    else:
+        simulator.load_pages(image)
+        simulator.set_state(state)
+    trace = TraceWriter(args.trace) if args.trace else None
+    try:
+        if dumper is None:
+            simulator.run(args.max_instructions, trace)
+        else:
+            # presenting frame by frame so every changed frame gets dumped
+            while not simulator.halted and simulator.idle is None:
+                remaining = None
+                if args.max_instructions is not None:
+                    remaining = args.max_instructions - simulator.instructions
+                    if remaining <= 0:
+                        break
+                simulator.run(min(FRAME_INSTRUCTIONS, remaining or FRAME_INSTRUCTIONS), trace)
+                dumper.capture(framebuffer)
+            dumper.flush()
+    except SimulatorError as error:
+        if trace is not None:
+            trace.close()
+        bus.close()
+        print("\nerror: {}".format(error))
+        print_state(simulator)
+        sys.exit(1)
+
+    if trace is not None:
+        trace.close()
+    bus.close()
+    print("")
+    print_state(simulator)
+
+if __name__ == "__main__":
+    main()
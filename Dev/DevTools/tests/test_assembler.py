@@ -0,0 +1,38 @@
+#
+#   Tests of assemblyCompilerv2.assemble(), the in-process entry point of the
+#   assembler.
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+
+import assemblyCompilerv2
+
+NO_SUPERINSTRUCTIONS = [{}, {}]
+
+def assemble(source):
+    return assemblyCompilerv2.assemble(source, NO_SUPERINSTRUCTIONS)[1]
+
+def test_programs_one_after_the_other():
+    assert assemble("lda #1\njp routine\nhalt\n:routine\nadd #1\nrts\n") == \
+        ["0002", "0001", "000b", "0005", "0001", "0005", "0001", "000e"]
+    assert assemble("jp a1\nhalt\n:a1\nrts\n") == ["000b", "0003", "0001", "000e"]
+
+def test_labels_of_the_previous_program_are_gone():
+    assemble("jp target\n:target\nhalt\n")
+    assert "target" in assemble("lda target\nhalt\n")[1]
+
+def test_strings_of_the_previous_program_are_gone():
+    assemble("out $ab$\nhalt\n")
+    assemble("halt\n")
+    start, end = assemblyCompilerv2.PARTITIONS["BUFFER_MEM"]
+    assert all(assemblyCompilerv2.MEMORY[address] == "0000" for address in range(start, end))
+
+def test_nothing_is_printed(capsys):
+    assemble("out $Hello\\sWorld!$\nhalt\n")
+    assert capsys.readouterr().out == ""
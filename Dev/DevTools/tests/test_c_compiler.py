@@ -0,0 +1,133 @@
+#
+#   End to end tests of the C compiler: C source -> mini_c.py -> newAssembler.py.
+#   The program image has to assemble with the opcodes of newGenerator.py
+#   and decode again into instructions with valid jump targets.
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+import pytest
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "CCompiler"))
+
+import mini_c
+import newAssembler
+
+PROGRAMS = {
+    "loop": """
+        int main() {
+            int sum = 0;
+            for (int i = 0; i < 10; i++) {
+                if (i == 5) continue;
+                sum = sum + i;
+            }
+            return sum;
+        }
+    """,
+    "globals": """
+        int table[4] = {3, 1, 4, 1};
+        int total = 7;
+        int main() {
+            int i = 0;
+            while (i != 4) {
+                total = total + table[i];
+                i = i + 1;
+            }
+            return total & 255 | 1 ^ 2;
+        }
+    """,
+    "pointers": """
+        int cell;
+        void put(int *p, int value) { *p = value; }
+        int main() {
+            put(&cell, 5);
+            *&cell = 9;
+            return cell >= 9;
+        }
+    """,
+    "arithmetic": """
+        int f(int x) { return x * 2 + 1; }
+        int main() {
+            int s = 0;
+            for (int i = 0; i < 10; i = i + 1) s = s + f(i);
+            return s;
+        }
+    """,
+    "recursion": """
+        int fib(int n) {
+            if (n <= 1) return n;
+            return fib(n - 1) + fib(n - 2);
+        }
+        int main() { return fib(10) > 50; }
+    """,
+}
+
+# {opcode: (mnemonic, operand words)} of the instructions the assembler can emit.
+def instruction_table(opcodes):
+    table = {}
+    for forms in newAssembler.ENCODINGS.values():
+        for roles, name in forms:
+            if name in opcodes:
+                table[opcodes[name]] = (name, sum(1 for role in roles if role not in ("dest", "src")))
+    return table
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_compiles_assembles_and_decodes(name):
+    opcodes = newAssembler.loadOpcodes()
+    words, labels = newAssembler.assemble(mini_c.compile_source(PROGRAMS[name]), opcodes)
+
+    table = instruction_table(opcodes)
+    starts = set()
+    targets = []
+    position = 0
+    while position < len(words):
+        opcode = words[position] & 0xFF
+        assert opcode in table, "word {} (0x{:06x}) is no instruction".format(position, words[position])
+        mnemonic, operands = table[opcode]
+        starts.add(position)
+        if mnemonic in ("jp", "jpz", "jpc", "call"):
+            targets.append(words[position + 1])
+        position += 1 + operands
+
+    assert position == len(words)
+    assert targets and set(targets) <= starts
+    assert labels["_main"] in starts
+
+def test_first_instruction_sets_the_stack_pointer():
+    opcodes = newAssembler.loadOpcodes()
+    words, _labels = newAssembler.assemble(mini_c.compile_source(PROGRAMS["loop"]), opcodes)
+    assert words[:2] == [opcodes["ldi"] | newAssembler.REGISTERS["sp"] << newAssembler.DEST_SHIFT, 0xf001]
+
+def test_stub_instructions_are_not_emitted():
+    source = mini_c.compile_source(PROGRAMS["globals"])
+    assert "#" not in "".join(line.split(",")[0] for line in source.splitlines() if line.strip().startswith("str "))
+
+# [(target, source)] of the register moves of the assembly, None for other lines.
+def moves(source):
+    result = []
+    for line in source.splitlines():
+        fields = line.replace(",", " ").split()
+        result.append((fields[1], fields[2]) if fields and fields[0] == "mov" else None)
+    return result
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_no_redundant_moves(name):
+    lines = moves(mini_c.compile_source(PROGRAMS[name]))
+    for first, second in zip(lines, lines[1:]):
+        if first is None or second is None:
+            continue
+        # mov X, Y; mov Y, X
+        assert second != (first[1], first[0])
+        # mov T, ACC; mov R, T
+        assert not (first[1] == "ACC" and second[1] == first[0])
+
+def test_result_stays_in_acc():
+    source = mini_c.compile_source(PROGRAMS["arithmetic"])
+    function = source[source.index(":_f"):source.index(":_main")]
+    assert function.split() == [":_f", "mov", "REA,", "REP", "ldi", "REB,", "#2", "mul", "mov", "REA,", "ACC",
+        "ldi", "REB,", "#1", "add", "rts"]
@@ -0,0 +1,32 @@
+#
+#   Tests of the data directives of assemblyCompilerv2.py (.word, .fill, .incbin).
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+import pytest
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+
+import assemblyCompilerv2
+
+def test_word():
+    assert assemblyCompilerv2.dataDirective([".word", "table", "#1", "0xffffff"], 0, ".") == ["table", ["0001", "ffffff"], 4]
+
+@pytest.mark.parametrize("tokens", [
+    [".word", "table", "#-1"],
+    [".word", "table", "0x1000000"],
+    [".fill", "table", "#2", "#-5"],
+    [".fill", "table", "#-2", "#5"],
+])
+def test_values_outside_of_a_word(tokens):
+    with pytest.raises(assemblyCompilerv2.AssemblerError):
+        assemblyCompilerv2.dataDirective(tokens, 0, ".")
+
+def test_incbin(tmp_path):
+    (tmp_path / "data.bin").write_bytes(b"\x00\x01\xff")
+    assert assemblyCompilerv2.dataDirective([".incbin", "blob", "data.bin", "#1"], 0, str(tmp_path)) == ["blob", ["0001", "00ff"], 4]
@@ -0,0 +1,34 @@
+#
+#   Tests of the debug server commands (Simulator/debugger.py).
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "Simulator"))
+
+from debugger import Debugger
+from memory import RAM_WORDS
+from simulator import OPCODES, Simulator
+
+def debugger():
+    simulator = Simulator()
+    simulator.load([OPCODES['nop']] * 8 + [OPCODES['halt']])
+    return Debugger(simulator, [(0x10, 4, "table")])
+
+def test_addresses_outside_of_the_ram():
+    session = debugger()
+    assert session.command("mem 0x{:x}".format(RAM_WORDS - 1))[-1] == "ok"
+    for address in ("0x{:x}".format(RAM_WORDS), "#-1", "table+0x{:x}".format(RAM_WORDS)):
+        for command in ("mem", "break", "watch"):
+            assert session.command("{} {}".format(command, address))[-1].startswith("error")
+    assert session.break_count == 0 and session.watch_count == 0
+
+def test_step_reports_the_instructions_it_ran():
+    session = debugger()
+    assert session.command("step 3")[0].endswith(", 3 instructions")
+    assert session.command("step 2")[0].endswith(", 2 instructions")
+    assert session.command("step 100")[0] == "halted at 0x000009, 4 instructions"
@@ -0,0 +1,46 @@
+#
+#   Tests of the jump selection of assemblyCompilerv2.py: a jump keeps saving
+#   the PC only when a return can be reached from its target.
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+
+import assemblyCompilerv2
+
+# [mnemonic, target, replacement] of the replaced jumps
+def selections(source):
+    assemblyCompilerv2.assemble(source, [{}, {}])
+    return assemblyCompilerv2.JUMP_SELECTIONS
+
+def test_conditional_fall_through_into_rts():
+    # check returns when the zero flag is clear, so jp check keeps the PC
+    assert selections("jp check\nhalt\n:check\njpz done\nrts\n:done\nhalt\n") == [["jpz", "done", "lbz"]]
+
+def test_fall_through_across_labels():
+    assert selections("jp first\nhalt\n:first\nadd #1\n:second\nrts\n") == []
+    assert selections("jp first\nhalt\n:first\nadd #1\n:second\nhalt\n") == [["jp", "first", "lb"]]
+
+def test_loop_that_never_returns():
+    assert selections(":loop\nadd #1\njpz loop\njp loop\n") == [["jpz", "loop", "lbz"], ["jp", "loop", "lb"]]
+
+def test_loop_with_an_exit_to_rts():
+    assert selections(":loop\nadd #1\njpz loop\nrts\n") == []
+
+def test_saving_comes_from_the_microcode():
+    steps = {instruction['name']: len(instruction['flags'])
+        for instruction in assemblyCompilerv2.generate_cpu_microcode.instruction_set}
+    assert assemblyCompilerv2.JUMP_SAVED_CYCLES["000b"] == steps["jp_addr"] - steps["lb"]
+    assert assemblyCompilerv2.JUMP_SAVED_CYCLES["000c"] == steps["jpz_addr_zf1"] - steps["lbz_1"]
+
+def test_map_report_lists_the_replaced_jumps():
+    _tokens, grammar, placed, free = assemblyCompilerv2.assemble(":loop\nadd #1\njpz loop\njp loop\n", [{}, {}])
+    report = assemblyCompilerv2.memoryReport(len(grammar), placed, free, {}, assemblyCompilerv2.JUMP_SELECTIONS)
+    saving = assemblyCompilerv2.JUMP_SAVED_CYCLES["000b"] + assemblyCompilerv2.JUMP_SAVED_CYCLES["000c"]
+    assert "jp   loop" in report
+    assert "2 replaced jumps save {} cycles".format(saving) in report
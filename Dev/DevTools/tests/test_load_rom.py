@@ -0,0 +1,28 @@
+#
+#   Regression tests of the "v2.0 raw" loader (InstructionSetGenerator/load_rom.py).
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "InstructionSetGenerator"))
+
+import load_rom
+
+def test_fixed_width():
+    assert load_rom.parse_image(b"v2.0 raw\n0001 0002 0003\n0004\n").tolist() == [1, 2, 3, 4]
+
+def test_mixed_width_lines():
+    # a space every width + 1 characters does not make the fields equally wide
+    assert load_rom.parse_image(b"v2.0 raw\nbf1 5 d 4 a d b\n").tolist() == [0xbf1, 5, 0xd, 4, 0xa, 0xd, 0xb]
+    assert load_rom.parse_image(b"v2.0 raw\n944 9dd d 3 659\n").tolist() == [0x944, 0x9dd, 0xd, 3, 0x659]
+
+def test_mixed_digit_counts_of_the_assembler():
+    # 4 digit program words next to 5 and 6 digit data words
+    assert load_rom.parse_image(b"v2.0 raw\n0002 000a 10203\nffffff 0001\n").tolist() == [2, 0xa, 0x10203, 0xffffff, 1]
+
+def test_runs():
+    assert load_rom.parse_image(b"v2.0 raw\n3*7 0 2*0 1\n").tolist() == [7, 7, 7, 0, 0, 0, 1]
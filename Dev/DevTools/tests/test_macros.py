@@ -0,0 +1,56 @@
+#
+#   Tests of the .macro and .rept blocks of assemblyCompilerv2.py.
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+import pytest
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+
+import assemblyCompilerv2
+
+def assemble(source):
+    return assemblyCompilerv2.assemble(source, [{}, {}])[1]
+
+def expand(source):
+    return assemblyCompilerv2.expandMacros(assemblyCompilerv2.tokenizer(source))
+
+def test_macro():
+    assert assemble(".macro twice %x\nadd %x\nadd %x\n.endm\ntwice #2\nhalt\n") == ["0005", "0002", "0005", "0002", "0001"]
+
+def test_longer_parameters_first():
+    assert assemble(".macro addto %a %ab\nadd %a\nsta %ab\n.endm\naddto #5 0xa001\nhalt\n") == ["0005", "0005", "0004", "a001", "0001"]
+
+def test_rept():
+    assert assemble(".rept 3\nadd #1\n.endr\nhalt\n") == ["0005", "0001"] * 3 + ["0001"]
+
+def test_nested():
+    assert assemble(".macro inc2\n.rept #2\nadd #1\n.endr\n.endm\n.macro inc4\ninc2\ninc2\n.endm\ninc4\nhalt\n") == \
+        ["0005", "0001"] * 4 + ["0001"]
+
+def test_local_labels_are_numbered_per_expansion():
+    tokens = expand(".macro wait %addr\n:wait\\@\nlbz wait\\@\n.endm\nwait 0xa001\nwait 0xa002\n")
+    assert tokens == [":wait.1", "0010", "wait.1", ":wait.2", "0010", "wait.2"]
+    assert expand(".rept 2\n:l\\@\n.endr\n") == [":l.1", ":l.2"]
+
+def test_macros_of_an_earlier_program_are_forgotten():
+    assemble(".macro twice %x\nadd %x\nadd %x\n.endm\ntwice #2\nhalt\n")
+    assert expand("twice #2\n") == ["twice", "#2"]
+    # a label with the name of an earlier macro stays a label
+    assert expand(":twice\njp twice\n") == [":twice", "000b", "twice"]
+
+@pytest.mark.parametrize("source", [
+    ".macro open\nadd #1\n",
+    ".rept 2\nadd #1\n.endm\n",
+    ".endr\n",
+    ".macro two %a %b\n.endm\ntwo #1\n",
+    ".macro loop\nloop\n.endm\nloop\n",
+])
+def test_errors(source):
+    with pytest.raises(assemblyCompilerv2.AssemblerError):
+        expand(source)
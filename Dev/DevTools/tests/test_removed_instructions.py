@@ -0,0 +1,25 @@
+#
+#   Mnemonics of the older encoding are rejected by assemblyCompilerv2.py
+#   instead of being assembled as unresolved labels.
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+import pytest
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "AssemblyCompiler"))
+
+import assemblyCompilerv2
+
+@pytest.mark.parametrize("line", ["ldb #2", "stb 0xa001", "outa", "outb", "dr"])
+def test_removed_mnemonics(line):
+    with pytest.raises(assemblyCompilerv2.AssemblerError, match = line.split()[0]):
+        assemblyCompilerv2.assemble("lda #1\n{}\nhalt\n".format(line), [{}, {}])
+
+def test_label_named_like_a_removed_mnemonic():
+    _tokens, grammar, _placed, _free = assemblyCompilerv2.assemble("lda #1\njp outb\n:outb\nhalt\n", [{}, {}])
+    assert "0outb" not in grammar
@@ -0,0 +1,51 @@
+#
+#   Tests of the packed RAM images and of running cases in forked children
+#   (Simulator/memory.py, Simulator/simulator.py).
+#
+#   Ex.: python -m pytest Dev/DevTools/tests
+#
+
+import os
+import sys
+
+import pytest
+
+DEV_TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DEV_TOOLS, "Simulator"))
+
+from devices import DeviceBus, Terminal, TERMINAL_PORT
+from memory import ImageError, read_image
+from simulator import OPCODES, Simulator
+
+def test_image_round_trip(tmp_path):
+    simulator = Simulator()
+    simulator.load([OPCODES['nop'], OPCODES['halt']], 0x1000)
+    simulator.a = 7
+    simulator.save_snapshot(str(tmp_path / "state.img"))
+
+    registers, pages = read_image(str(tmp_path / "state.img"))
+    assert registers["a"] == 7 and len(pages) == 1
+
+    (tmp_path / "empty.img").write_bytes(b"")
+    with pytest.raises(ImageError):
+        read_image(str(tmp_path / "empty.img"))
+
+def write_character(simulator, character):
+    simulator.ram[1] = ord(character)
+    simulator.run()
+    return simulator.instructions
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason = "needs os.fork")
+def test_forked_cases_keep_their_terminal_output(tmp_path):
+    output = open(tmp_path / "terminal.txt", "a")
+    bus = DeviceBus()
+    bus.attach(TERMINAL_PORT, Terminal(output))
+    simulator = Simulator(bus)
+    simulator.load([OPCODES['tw'], 0, OPCODES['halt']])
+    assert bus.loop is not None
+
+    assert simulator.run_cases("abcd", write_character, workers = 2) == [2, 2, 2, 2]
+    assert bus.loop is not None     # running again in the parent
+    bus.close()
+    output.close()
+    assert sorted((tmp_path / "terminal.txt").read_text()) == list("abcd")